@@ -1,6 +1,5 @@
 import sys
 import cv2
-import psycopg2
 import numpy as np
 from datetime import datetime
 from PyQt5 import uic
@@ -8,7 +7,11 @@ from PyQt5.QtCore import pyqtSignal, QTimer, QDateTime
 from PyQt5.QtGui import QFontDatabase
 from PyQt5.QtWidgets import (QWidget, QLineEdit, QMessageBox, QPushButton, 
                              QMainWindow, QStackedWidget, QDateTimeEdit, QTextEdit)
-from Db_connection import get_db_connection
+from Db_connection import db_session
+from DbWorker import DbJob, start_db_job, set_loading
+from EmbeddingUtils import embedding_to_bytes
+from FaceGallery import get_face_gallery
+from Repository import add_offense, forget_case_files
 
 class OffenseData:
     def __init__(self):
@@ -25,9 +28,15 @@ class OffenseData:
             'complainant': '',
             'officer': ''
         }
+        
+        # Face scanned on this visit, stored as another template for the juvenile
+        self.facial_data = {
+            'image': None,
+            'embedding': None
+        }
 
 class AddOffenseWindow(QMainWindow):
-    def __init__(self, juv_id):
+    def __init__(self, juv_id, probe_embedding=None, probe_image=None):
         super().__init__()
         uic.loadUi("ui/EnrollMainWindow.ui", self)  # Reuse the same main window
         self.load_fonts()
@@ -35,6 +44,11 @@ class AddOffenseWindow(QMainWindow):
         # Initialize temporary data storage with juvenile ID
         self.offense_data = OffenseData()
         self.offense_data.juv_id = juv_id
+        self.offense_data.facial_data['image'] = probe_image
+        self.offense_data.facial_data['embedding'] = probe_embedding
+        
+        # Save running on a worker, if any
+        self.save_job = None
         
         # Add the stacked widget
         self.stack_widget = QStackedWidget(self)
@@ -69,41 +83,47 @@ class AddOffenseWindow(QMainWindow):
         self.stack_widget.setCurrentWidget(self.review_offense)
 
     def save_to_database(self):
-        try:
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Insert into OFFENSE_INFORMATION
-            cursor.execute("""
-                INSERT INTO OFFENSE_INFORMATION 
-                (OFFNS_TYPE, OFFNS_CASE_RECORD_NO, OFFNS_DATE_TIME, OFFNS_LOCATION, 
-                OFFNS_DESCRIPTION, OFFNS_COMPLAINANT, OFFNS_BARANGAY_OFFICER_IN_CHARGE, JUV_ID)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                self.offense_data.offense_info['offense_type'],
-                self.offense_data.offense_info['case_no'],
-                self.offense_data.offense_info['datetime'],
-                self.offense_data.offense_info['location'],
-                self.offense_data.offense_info['description'],
-                self.offense_data.offense_info['complainant'],
-                self.offense_data.offense_info['officer'],
-                self.offense_data.juv_id
-            ))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            # Show success message
-            QMessageBox.information(self, "Success", "New offense record successfully added!")
-            
-            # Return to menu with filter for this juvenile
-            self.return_to_menu()
-            
-        except Exception as e:
-            QMessageBox.critical(self, "Database Error", f"Failed to save data: {str(e)}")
-            print(f"Database error: {e}")
+        # Saved on a worker; the window returns to the menu once the save has finished
+        if self.save_job is not None:
+            return
+        
+        # Offer the matched scan as another face for this juvenile; add_offense keeps it unless
+        # the juvenile already has enough faces or one just like it
+        probe_embedding = self.offense_data.facial_data['embedding']
+        face = None
+        if probe_embedding is not None and self.offense_data.facial_data['image']:
+            face = (self.offense_data.facial_data['image'], embedding_to_bytes(probe_embedding))
+        
+        job = DbJob(add_offense, self.offense_data.juv_id, dict(self.offense_data.offense_info), face)
+        job.signals.finished.connect(lambda face_id, job=job: self.handle_save_result(job, face_id))
+        job.signals.failed.connect(lambda message, job=job: self.handle_save_error(job, message))
+        self.save_job = start_db_job(job)
+        set_loading(self, True)
+
+    def handle_save_result(self, job, face_id):
+        if job is not self.save_job:
+            return
+        self.save_job = None
+        set_loading(self, False)
+        
+        # Committed: the juvenile's cached case files no longer show the full history
+        forget_case_files(self.offense_data.juv_id)
+        
+        if face_id is not None:
+            get_face_gallery().add(self.offense_data.juv_id, self.offense_data.facial_data['embedding'], face_id)
+        
+        # Show success message
+        QMessageBox.information(self, "Success", "New offense record successfully added!")
+        
+        # Return to menu with filter for this juvenile
+        self.return_to_menu()
+
+    def handle_save_error(self, job, message):
+        if job is not self.save_job:
+            return
+        self.save_job = None
+        set_loading(self, False)
+        QMessageBox.critical(self, "Database Error", f"Failed to save data: {message}")
 
     def return_to_menu(self):
         from DashboardMenu import DbMenuWindow as RecordWindow
@@ -198,15 +218,14 @@ class AddOffenseInfo(QWidget):
     def generate_case_number(self):
         #Generate unique case number in format 10-0001
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Get the latest case number
-            cursor.execute("SELECT OFFNS_CASE_RECORD_NO FROM OFFENSE_INFORMATION ORDER BY OFFNS_ID DESC LIMIT 1")
-            result = cursor.fetchone()
-            
-            cursor.close()
-            conn.close()
+            with db_session() as conn:
+                cursor = conn.cursor()
+                
+                # Get the latest case number
+                cursor.execute("SELECT OFFNS_CASE_RECORD_NO FROM OFFENSE_INFORMATION ORDER BY OFFNS_ID DESC LIMIT 1")
+                result = cursor.fetchone()
+                
+                cursor.close()
             
             if result:
                 # Extract the number part and increment
@@ -0,0 +1,160 @@
+import csv
+import sys
+import argparse
+import numpy as np
+from Db_connection import get_db_connection
+from FaceGallery import FaceGallery, MATCH_THRESHOLD
+from BatchIdentify import fetch_case_numbers
+
+# Whole-database duplicate-person audit:
+#   python AuditDuplicates.py [-o duplicate_clusters.csv] [--pairs pairs.csv] [--threshold 0.4]
+# Compares every stored face with every other one, block by block, and groups juveniles whose
+# faces fall under the threshold into clusters that are likely the same person
+
+CLUSTER_COLUMNS = ['cluster', 'juv_ids', 'min_distance', 'names', 'case_numbers']
+PAIR_COLUMNS = ['juv_id_a', 'juv_id_b', 'distance']
+
+
+def iter_duplicate_pairs(embeddings, owners, threshold=MATCH_THRESHOLD, block_size=1024):
+    #Yields (juv_id_a, juv_id_b, distance) for faces of different juveniles closer than the threshold
+    #Only the upper triangle is computed, one (block_size, block_size) tile at a time
+    n = len(embeddings)
+    sq_norms = np.einsum('ij,ij->i', embeddings, embeddings)
+    sq_threshold = threshold * threshold
+
+    for i in range(0, n, block_size):
+        block_a = embeddings[i:i + block_size]
+        for j in range(i, n, block_size):
+            block_b = embeddings[j:j + block_size]
+            sq_dist = sq_norms[i:i + block_size, None] - 2.0 * (block_a @ block_b.T) + sq_norms[None, j:j + block_size]
+            rows, cols = np.nonzero(sq_dist < sq_threshold)
+            if i == j:
+                upper = rows < cols
+                rows, cols = rows[upper], cols[upper]
+
+            owner_a, owner_b = owners[i + rows], owners[j + cols]
+            different = owner_a != owner_b
+            for a, b, r, c in zip(owner_a[different], owner_b[different], rows[different], cols[different]):
+                yield int(a), int(b), float(np.sqrt(max(sq_dist[r, c], 0.0)))
+
+
+def cluster_pairs(pairs):
+    #Union-find over juvenile ids; returns [(sorted juv_ids, min distance)], tightest clusters first
+    parent = {}
+    best = {}
+
+    def find(x):
+        root = x
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while parent.get(x, x) != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for a, b, distance in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+            best[root_a] = min(best.get(root_a, distance), best.pop(root_b, distance), distance)
+        else:
+            best[root_a] = min(best.get(root_a, distance), distance)
+
+    members = {}
+    for juv_id in parent.keys() | best.keys():
+        members.setdefault(find(juv_id), set()).add(juv_id)
+
+    clusters = [(sorted(ids), best[root]) for root, ids in members.items()]
+    clusters.sort(key=lambda cluster: cluster[1])
+    return clusters
+
+
+def fetch_names(juv_ids):
+    #{juv_id: "LNAME, FNAME"} for the audited juveniles, in one query
+    if not juv_ids:
+        return {}
+
+    conn = get_db_connection()
+    if not conn:
+        return {}
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT JUV_ID, JUV_LNAME || ', ' || JUV_FNAME
+            FROM JUVENILE_PROFILE
+            WHERE JUV_ID = ANY(%s)
+        """, (list(juv_ids),))
+        names = dict(cursor.fetchall())
+        cursor.close()
+        conn.close()
+        return names
+    except Exception as e:
+        print(f"Error fetching juvenile names: {e}")
+        conn.close()
+        return {}
+
+
+def audit(output, pairs_output=None, threshold=MATCH_THRESHOLD, block_size=1024):
+    # all_faces() needs the faces in memory, which only a float32 gallery keeps
+    gallery = FaceGallery(dtype='float32')
+    if not gallery.load(attach_index=False):
+        print("Could not load facial data from the database.")
+        return False
+
+    # Every stored face, not just the per-juvenile centroids
+    embeddings, owners = gallery.all_faces()
+    if len(embeddings) == 0:
+        print("No facial data in database")
+        return True
+    print(f"Auditing {len(embeddings)} face(s) of {len(gallery)} juvenile(s)...")
+
+    pair_file = open(pairs_output, 'w', newline='', encoding='utf-8') if pairs_output else None
+    pair_writer = None
+    if pair_file:
+        pair_writer = csv.writer(pair_file)
+        pair_writer.writerow(PAIR_COLUMNS)
+
+    def tee_pairs():
+        # Pairs are streamed to disk as they are found; only the union-find state stays in memory
+        for count, pair in enumerate(iter_duplicate_pairs(embeddings, owners, threshold, block_size), 1):
+            if pair_writer:
+                pair_writer.writerow([pair[0], pair[1], f"{pair[2]:.4f}"])
+            if count % 1000 == 0:
+                print(f"{count} close pair(s) found so far...")
+            yield pair
+
+    try:
+        clusters = cluster_pairs(tee_pairs())
+    finally:
+        if pair_file:
+            pair_file.close()
+
+    flagged = {juv_id for ids, _ in clusters for juv_id in ids}
+    names = fetch_names(flagged)
+    case_numbers = fetch_case_numbers(flagged)
+
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CLUSTER_COLUMNS)
+        for number, (ids, min_distance) in enumerate(clusters, 1):
+            writer.writerow([
+                number,
+                ';'.join(str(juv_id) for juv_id in ids),
+                f"{min_distance:.4f}",
+                ' | '.join(f"{juv_id}: {names.get(juv_id, '')}" for juv_id in ids),
+                ' | '.join(f"{juv_id}: {case_numbers.get(juv_id, '')}" for juv_id in ids),
+            ])
+
+    print(f"{len(clusters)} likely duplicate cluster(s) covering {len(flagged)} juvenile(s). Written to {output}")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find juveniles enrolled more than once under different profiles.")
+    parser.add_argument("-o", "--output", default="duplicate_clusters.csv", help="cluster CSV to write")
+    parser.add_argument("--pairs", default=None, help="also stream every close pair to this CSV")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD, help="same-person distance threshold")
+    parser.add_argument("--block-size", type=int, default=1024, help="faces per tile of the distance matrix")
+    args = parser.parse_args()
+
+    sys.exit(0 if audit(args.output, args.pairs, args.threshold, args.block_size) else 1)
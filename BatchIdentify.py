@@ -0,0 +1,147 @@
+import os
+import io
+import csv
+import sys
+import zipfile
+import argparse
+from multiprocessing import Pool
+import numpy as np
+from Db_connection import get_db_connection
+from FaceGallery import FaceGallery, MATCH_THRESHOLD
+
+# Headless 1:N identification of a photo dump from a partner office:
+#   python BatchIdentify.py <folder or .zip> [-o results.csv] [--workers N]
+# Every face found in every image is matched against FACIAL_DATA and written as one CSV row
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+CSV_COLUMNS = ['file', 'face', 'status', 'juv_id', 'distance', 'case_numbers']
+
+
+def iter_images(source):
+    #Yields (name, image bytes) for every image in a directory tree or zip archive
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for name in sorted(archive.namelist()):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield name, archive.read(name)
+        return
+
+    for root, _, files in os.walk(source):
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, filename)
+                with open(path, 'rb') as f:
+                    yield os.path.relpath(path, source), f.read()
+
+
+_model = 'hog'
+
+
+def init_worker(model):
+    # Pay the dlib model load once per worker process, not once per image
+    global _model
+    import face_recognition
+    _model = model
+
+
+def encode_image(item):
+    #Worker: detect and encode every face in one image
+    #Returns (name, [embedding, ...], error message or None)
+    name, data = item
+    try:
+        import face_recognition
+        image = face_recognition.load_image_file(io.BytesIO(data))
+        locations = face_recognition.face_locations(image, model=_model)
+        encodings = face_recognition.face_encodings(image, known_face_locations=locations)
+        return name, [np.asarray(encoding, dtype=np.float32) for encoding in encodings], None
+    except Exception as e:
+        return name, [], str(e)
+
+
+def fetch_case_numbers(juv_ids):
+    #{juv_id: "10-0001;10-0007"} for the matched juveniles, in one query
+    if not juv_ids:
+        return {}
+
+    conn = get_db_connection()
+    if not conn:
+        return {}
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT JUV_ID, STRING_AGG(OFFNS_CASE_RECORD_NO, ';' ORDER BY OFFNS_ID)
+            FROM OFFENSE_INFORMATION
+            WHERE JUV_ID = ANY(%s)
+            GROUP BY JUV_ID
+        """, (list(juv_ids),))
+        case_numbers = dict(cursor.fetchall())
+        cursor.close()
+        conn.close()
+        return case_numbers
+    except Exception as e:
+        print(f"Error fetching case numbers: {e}")
+        conn.close()
+        return {}
+
+
+def identify(source, output, workers=None, threshold=MATCH_THRESHOLD, model='hog'):
+    # Always float32 here: a quantized gallery would fetch faces from the database for every probe
+    gallery = FaceGallery(dtype='float32')
+    if not gallery.load(attach_index=False):
+        print("Could not load facial data from the database.")
+        return False
+
+    # Encode in a process pool; results stream back in input order
+    faces = []      # (name, face index, embedding)
+    failures = []   # (name, status)
+    with Pool(processes=workers, initializer=init_worker, initargs=(model,)) as pool:
+        for count, (name, encodings, error) in enumerate(pool.imap(encode_image, iter_images(source), chunksize=4), 1):
+            if error:
+                failures.append((name, 'error'))
+                print(f"Error reading {name}: {error}")
+            elif not encodings:
+                failures.append((name, 'no_face'))
+            for index, encoding in enumerate(encodings):
+                faces.append((name, index, encoding))
+            if count % 50 == 0:
+                print(f"Encoded {count} image(s)...")
+
+    print(f"Matching {len(faces)} face(s) against {len(gallery)} juvenile(s)...")
+    matches = gallery.search_batch([encoding for _, _, encoding in faces], k=1) if faces else []
+
+    matched_ids = {result[0][0] for result in matches if result and result[0][1] < threshold}
+    case_numbers = fetch_case_numbers(matched_ids)
+
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for (name, index, _), result in zip(faces, matches):
+            if result and result[0][1] < threshold:
+                juv_id, distance = result[0]
+                writer.writerow([name, index, 'match', juv_id, f"{distance:.4f}", case_numbers.get(juv_id, '')])
+            else:
+                distance = f"{result[0][1]:.4f}" if result else ''
+                writer.writerow([name, index, 'no_match', '', distance, ''])
+        for name, status in failures:
+            writer.writerow([name, '', status, '', '', ''])
+
+    print(f"{len(matched_ids)} profiled juvenile(s) found. Results written to {output}")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match a folder or zip of photos against enrolled faces.")
+    parser.add_argument("source", help="directory or .zip of images")
+    parser.add_argument("-o", "--output", default="batch_identify_results.csv", help="CSV file to write")
+    parser.add_argument("--workers", type=int, default=None, help="encoder processes (default: CPU count)")
+    parser.add_argument("--threshold", type=float, default=MATCH_THRESHOLD, help="match distance threshold")
+    parser.add_argument("--model", choices=['hog', 'cnn'], default='hog', help="face detector used by dlib")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"{args.source} does not exist.")
+        sys.exit(1)
+
+    sys.exit(0 if identify(args.source, args.output, args.workers, args.threshold, args.model) else 1)
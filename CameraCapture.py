@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import threading
+import cv2
+from dotenv import load_dotenv
+from PyQt5.QtCore import QThread, pyqtSignal
+
+load_dotenv()
+
+# Prioritize using webcam for face scan if plugged in
+CAMERA_INDICES = [1, 2, 0]
+
+# Backends tried for each index, in order
+CAMERA_BACKENDS = {'dshow': cv2.CAP_DSHOW, 'default': cv2.CAP_ANY}
+
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+FRAME_FPS = 30
+
+# Consecutive failed reads after which the camera is reported as lost
+MAX_READ_FAILURES = 30
+
+# Camera settings, overridable from .env
+# CAMERA_CACHE_PATH   - where the index/backend that worked last time is remembered
+# CAMERA_IDLE_RELEASE - seconds an unused camera stays open so the next scan starts instantly
+CAMERA_CACHE_PATH = os.getenv("CAMERA_CACHE_PATH", "cache/camera.json")
+CAMERA_IDLE_RELEASE = float(os.getenv("CAMERA_IDLE_RELEASE", "60"))
+
+
+def try_camera(index, backend):
+    #Open one index with one backend and check it delivers a frame; returns the capture or None
+    cap = cv2.VideoCapture(index, CAMERA_BACKENDS[backend])
+    if not cap.isOpened():
+        return None
+    ret, test_frame = cap.read()
+    if not ret or test_frame is None:
+        cap.release()
+        return None
+
+    # Set camera properties to avoid resolution/format mismatches
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+    cap.set(cv2.CAP_PROP_FPS, FRAME_FPS)
+    return cap
+
+
+def probe_camera(indices=CAMERA_INDICES):
+    #Returns (capture, index, backend) for the first camera that opens and delivers a frame,
+    #or (None, None, None)
+    for index in indices:
+        print(f"Trying camera index {index}...")
+        for backend in CAMERA_BACKENDS:
+            cap = try_camera(index, backend)
+            if cap is not None:
+                print(f"Camera index {index} ({backend}) is working. Using it.")
+                return cap, index, backend
+        print(f"Camera index {index} did not open or deliver a frame. Skipping.")
+    return None, None, None
+
+
+class CameraManager:
+    #Process-wide owner of the camera device. The probe result is remembered on disk so later
+    #starts open the known index/backend directly, and a released camera stays open for
+    #CAMERA_IDLE_RELEASE seconds so the next scan widget gets it without reopening
+
+    def __init__(self, cache_path=CAMERA_CACHE_PATH, idle_release=CAMERA_IDLE_RELEASE):
+        self.cache_path = cache_path
+        self.idle_release = idle_release
+        self._lock = threading.Lock()
+        self._cap = None
+        self._in_use = False
+        self._idle_timer = None
+
+    def acquire(self):
+        #The open camera for exclusive use, or None if there is no working camera or it is in use
+        with self._lock:
+            if self._in_use:
+                print("Camera is already in use.")
+                return None
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+
+            if self._cap is None or not self._cap.isOpened():
+                self._cap = self._open()
+            if self._cap is None:
+                return None
+            self._in_use = True
+            return self._cap
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def release(self, cap, broken=False):
+        #Give the camera back; it is closed after idle_release seconds unless acquired again,
+        #or at once if it stopped working
+        with self._lock:
+            if cap is not self._cap:
+                cap.release()
+                return
+            self._in_use = False
+            if broken or self.idle_release <= 0:
+                self._close()
+                return
+            self._idle_timer = threading.Timer(self.idle_release, self._release_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def shutdown(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            if not self._in_use:
+                self._close()
+
+    def _release_idle(self):
+        with self._lock:
+            self._idle_timer = None
+            if not self._in_use:
+                self._close()
+                print("Idle camera released")
+
+    def _close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _open(self):
+        # Known-good device first; the full probe only runs when it is gone
+        cached = self._load_cache()
+        if cached is not None:
+            index, backend = cached
+            cap = try_camera(index, backend)
+            if cap is not None:
+                print(f"Using camera index {index} ({backend}).")
+                return cap
+            print(f"Camera index {index} ({backend}) no longer works. Probing again.")
+
+        cap, index, backend = probe_camera()
+        if cap is not None:
+            self._save_cache(index, backend)
+        return cap
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('backend') in CAMERA_BACKENDS:
+                return int(cached['index']), cached['backend']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _save_cache(self, index, backend):
+        try:
+            directory = os.path.dirname(self.cache_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'index': index, 'backend': backend}, f)
+        except OSError as e:
+            print(f"Could not remember camera choice: {e}")
+
+
+_camera_manager = None
+_camera_manager_lock = threading.Lock()
+
+
+def get_camera_manager():
+    global _camera_manager
+    with _camera_manager_lock:
+        if _camera_manager is None:
+            _camera_manager = CameraManager()
+        return _camera_manager
+
+
+class CameraThread(QThread):
+    #Reads the camera continuously off the GUI thread into a one-frame buffer.
+    #frame_ready is emitted only when the previous frame has been taken, so a slow UI
+    #never builds up a queue of stale frames: take_frame() always returns the newest one
+    frame_ready = pyqtSignal()
+    camera_failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._running = False
+        self._frame = None
+        self._pending = False
+
+    def run(self):
+        self._running = True
+        manager = get_camera_manager()
+        cap = manager.acquire()
+        if cap is None:
+            self._running = False
+            if manager.in_use:
+                self.camera_failed.emit("The camera is being used by another scan.")
+            else:
+                self.camera_failed.emit("No working camera found. Check connections and permissions.")
+            return
+
+        failures = 0
+        broken = False
+        try:
+            while self._running:
+                ret, frame = cap.read()
+                if not ret or frame is None or frame.size == 0:
+                    failures += 1
+                    if failures >= MAX_READ_FAILURES:
+                        broken = True
+                        self.camera_failed.emit("Camera stopped delivering frames.")
+                        break
+                    time.sleep(0.01)
+                    continue
+                failures = 0
+
+                with self._lock:
+                    self._frame = frame
+                    notify = not self._pending
+                    self._pending = True
+                if notify:
+                    self.frame_ready.emit()
+        finally:
+            # Handed back to the manager, which keeps it open briefly for the next scan
+            manager.release(cap, broken)
+            print("Camera stopped")
+
+    def take_frame(self):
+        #Newest frame and re-arm frame_ready; None before the first read
+        #The thread never writes to a frame once published, but it is shared: draw on a copy
+        with self._lock:
+            self._pending = False
+            return self._frame
+
+    def stop(self, timeout=2000):
+        self._running = False
+        self.wait(timeout)
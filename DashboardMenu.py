@@ -6,10 +6,40 @@ from PyQt5.QtGui import QFontDatabase
 from PyQt5.QtWidgets import (QWidget, QApplication, QComboBox, QLineEdit, QMessageBox, QPushButton, QLabel,
                              QDialogButtonBox, QDialog, QStyle, QMainWindow, QStackedWidget, QListWidget, QHBoxLayout,
                              QListWidgetItem, QTableWidget, QTableWidgetItem, QDateEdit)
-from Db_connection import get_db_connection
+from Db_connection import db_session
+from DbWorker import DbPageMixin
+from Repository import list_records, get_case_file, cached_case_file
 import LoggedUser
 from LoginMain import LogIn
 
+
+class CaseFilePage(DbPageMixin):
+    #For the four case file pages: they all show parts of the same Repository.CaseFile, so paging
+    #through a case loads it once; a case viewed recently is shown straight from the cache
+    current_case_no = None
+
+    def load_case_file(self, case_no, error_message):
+        self.current_case_no = case_no
+        case_file = cached_case_file(case_no)
+        if case_file is not None:
+            self.cancel_db_load()
+            self.show_case_data(case_file)
+            return
+        if self.casenum_label:
+            self.casenum_label.setText("Loading...")
+        self.start_db_load(get_case_file, case_no, on_result=self.show_case_data,
+                           error_message=error_message)
+
+    def show_face_image(self, face_image):
+        if face_image and self.photo_label:
+            from PyQt5.QtGui import QPixmap
+            pixmap = QPixmap()
+            pixmap.loadFromData(face_image)
+            self.photo_label.setPixmap(pixmap)
+        elif self.photo_label:
+            self.photo_label.setText("No Photo")
+
+
 class DbMenuWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -324,9 +354,6 @@ class Settings(QWidget):
             return
 
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
             # Query to get user data from both tables using user_id
             query = """
                 SELECT 
@@ -341,8 +368,12 @@ class Settings(QWidget):
                 JOIN barangay_admin ba ON u.admin_id = ba.admin_id
                 WHERE u.user_id = %s
             """
-            cursor.execute(query, (LoggedUser.current_logged_in_user_id,))
-            result = cursor.fetchone()
+            # The session returns the connection (rolled back) even if the query fails
+            with db_session() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, (LoggedUser.current_logged_in_user_id,))
+                result = cursor.fetchone()
+                cursor.close()
 
             if result:
                 fname, lname, mname, dob, address, role, username = result
@@ -374,9 +405,6 @@ class Settings(QWidget):
             else:
                 QMessageBox.warning(self, "Error", "User data not found.")
 
-            cursor.close()
-            conn.close()
-
         except Exception as e:
             QMessageBox.critical(self, "Database Error", f"Error loading user data: {str(e)}")
 
@@ -458,9 +486,6 @@ class EditSettings(QWidget):
             return
 
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
             # Query to get user data from both tables using user_id
             query = """
                 SELECT 
@@ -475,8 +500,12 @@ class EditSettings(QWidget):
                 JOIN barangay_admin ba ON u.admin_id = ba.admin_id
                 WHERE u.user_id = %s
             """
-            cursor.execute(query, (LoggedUser.current_logged_in_user_id,))
-            result = cursor.fetchone()
+            # The session returns the connection (rolled back) even if the query fails
+            with db_session() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, (LoggedUser.current_logged_in_user_id,))
+                result = cursor.fetchone()
+                cursor.close()
 
             if result:
                 fname, lname, mname, dob, address, role, username = result
@@ -510,9 +539,6 @@ class EditSettings(QWidget):
             else:
                 QMessageBox.warning(self, "Error", "User data not found.")
 
-            cursor.close()
-            conn.close()
-
         except Exception as e:
             QMessageBox.critical(self, "Database Error", f"Error loading user data: {str(e)}")
 
@@ -547,86 +573,84 @@ class EditSettings(QWidget):
         if mname and mname.endswith('.'):
             mname = mname[:-1]
 
+        # Checked before borrowing a connection
+        if (current_password or new_password) and not (current_password and new_password):
+            QMessageBox.warning(self, "Validation Error", "Please enter both current and new password.")
+            return
+        update_password = bool(current_password)
+
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            # Committed if every statement succeeds; rolled back (releasing the row locks) if one
+            # fails, e.g. on a duplicate username, and the connection returned to the pool either way.
+            # Problems are only shown once the block has ended, so no dialog holds the connection
+            problem = None
+            with db_session() as conn:
+                cursor = conn.cursor()
+
+                # Get the admin_id for the current user
+                cursor.execute("SELECT admin_id FROM users WHERE user_id = %s", 
+                             (LoggedUser.current_logged_in_user_id,))
+                admin_result = cursor.fetchone()
+
+                if not admin_result:
+                    problem = ("Error", "User not found.")
+
+                # If password fields are filled, verify current password before updating
+                if problem is None and update_password:
+                    # Verify current password using PostgreSQL's crypt function
+                    verify_query = """
+                        SELECT user_password = crypt(%s, user_password) AS password_match
+                        FROM users 
+                        WHERE user_id = %s
+                    """
+                    cursor.execute(verify_query, (current_password, LoggedUser.current_logged_in_user_id))
+                    result = cursor.fetchone()
+
+                    if not result or not result[0]:
+                        problem = ("Authentication Error", "Current password is incorrect.")
+
+                if problem is None:
+                    admin_id = admin_result[0]
+
+                    # Update barangay_admin table
+                    update_admin_query = """
+                        UPDATE barangay_admin 
+                        SET admin_fname = %s, 
+                            admin_lname = %s, 
+                            admin_mname = %s, 
+                            admin_dob = %s, 
+                            admin_address = %s
+                        WHERE admin_id = %s
+                    """
+                    dob_value = dob.toPyDate() if dob else None
+                    cursor.execute(update_admin_query, 
+                                 (fname, lname, mname, dob_value, address, admin_id))
+
+                    # Update users table
+                    if update_password:
+                        # Use PostgreSQL's crypt function to hash the new password
+                        update_user_query = """
+                            UPDATE users 
+                            SET user_username = %s, 
+                                user_password = crypt(%s, gen_salt('bf', 12))
+                            WHERE user_id = %s
+                        """
+                        cursor.execute(update_user_query, 
+                                     (username, new_password, LoggedUser.current_logged_in_user_id))
+                    else:
+                        update_user_query = """
+                            UPDATE users 
+                            SET user_username = %s
+                            WHERE user_id = %s
+                        """
+                        cursor.execute(update_user_query, 
+                                     (username, LoggedUser.current_logged_in_user_id))
 
-            # Get the admin_id for the current user
-            cursor.execute("SELECT admin_id FROM users WHERE user_id = %s", 
-                         (LoggedUser.current_logged_in_user_id,))
-            admin_result = cursor.fetchone()
-            
-            if not admin_result:
-                QMessageBox.warning(self, "Error", "User not found.")
                 cursor.close()
-                conn.close()
+
+            if problem is not None:
+                QMessageBox.warning(self, *problem)
                 return
-            
-            admin_id = admin_result[0]
-
-            # If password fields are filled, verify current password and update
-            update_password = False
-            if current_password or new_password:
-                if not current_password or not new_password:
-                    QMessageBox.warning(self, "Validation Error", "Please enter both current and new password.")
-                    cursor.close()
-                    conn.close()
-                    return
-
-                # Verify current password using PostgreSQL's crypt function
-                verify_query = """
-                    SELECT user_password = crypt(%s, user_password) AS password_match
-                    FROM users 
-                    WHERE user_id = %s
-                """
-                cursor.execute(verify_query, (current_password, LoggedUser.current_logged_in_user_id))
-                result = cursor.fetchone()
-                
-                if not result or not result[0]:
-                    QMessageBox.warning(self, "Authentication Error", "Current password is incorrect.")
-                    cursor.close()
-                    conn.close()
-                    return
-                
-                update_password = True
-
-            # Update barangay_admin table
-            update_admin_query = """
-                UPDATE barangay_admin 
-                SET admin_fname = %s, 
-                    admin_lname = %s, 
-                    admin_mname = %s, 
-                    admin_dob = %s, 
-                    admin_address = %s
-                WHERE admin_id = %s
-            """
-            dob_value = dob.toPyDate() if dob else None
-            cursor.execute(update_admin_query, 
-                         (fname, lname, mname, dob_value, address, admin_id))
-
-            # Update users table
-            if update_password:
-                # Use PostgreSQL's crypt function to hash the new password
-                update_user_query = """
-                    UPDATE users 
-                    SET user_username = %s, 
-                        user_password = crypt(%s, gen_salt('bf', 12))
-                    WHERE user_id = %s
-                """
-                cursor.execute(update_user_query, 
-                             (username, new_password, LoggedUser.current_logged_in_user_id))
-            else:
-                update_user_query = """
-                    UPDATE users 
-                    SET user_username = %s
-                    WHERE user_id = %s
-                """
-                cursor.execute(update_user_query, 
-                             (username, LoggedUser.current_logged_in_user_id))
-
-            conn.commit()
-            cursor.close()
-            conn.close()
 
             # Show success message
             self.show_dialog()
@@ -671,7 +695,7 @@ class EditSettings(QWidget):
             print("Failed to load Inter font.")
 
 #record list
-class DashboardRecords(QWidget):
+class DashboardRecords(DbPageMixin, QWidget):
     switch_to_dbmenu = pyqtSignal()
     switch_to_specificfile = pyqtSignal()
     def __init__(self, parent=None):
@@ -802,79 +826,43 @@ class DashboardRecords(QWidget):
         self.switch_to_dbmenu.emit()
 
     def load_records_from_db(self, filter_juv_id=None):
-        try:
-            # Clear existing items
-            self.list_widget.clear()
-            self.all_records = []
-
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            # Query to get juvenile records with their offense information
-            if filter_juv_id:
-                # Filter by specific juvenile
-                cursor.execute("""
-                    SELECT 
-                        jp.juv_lname, 
-                        jp.juv_fname, 
-                        jp.juv_mname,
-                        oi.offns_case_record_no,
-                        oi.offns_date_time
-                    FROM juvenile_profile jp
-                    LEFT JOIN offense_information oi ON jp.juv_id = oi.juv_id
-                    WHERE jp.juv_id = %s
-                    ORDER BY oi.offns_date_time DESC
-                """, (filter_juv_id,))
-            else:
-                # Load all records
-                cursor.execute("""
-                    SELECT 
-                        jp.juv_lname, 
-                        jp.juv_fname, 
-                        jp.juv_mname,
-                        oi.offns_case_record_no,
-                        oi.offns_date_time
-                    FROM juvenile_profile jp
-                    LEFT JOIN offense_information oi ON jp.juv_id = oi.juv_id
-                    ORDER BY oi.offns_date_time DESC
-                """)
-
-            records = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            # Store and display records
-            for record in records:
-                lname, fname, mname, case_no, offense_date = record
-                
-                # Format name
-                full_name = f"{lname}, {fname}"
-                if mname:
-                    full_name += f" {mname}"
-                
-                # Format date
-                if offense_date:
-                    formatted_date = offense_date.strftime("%B %d, %Y")
-                    date_sort = offense_date
-                else:
-                    formatted_date = "No date"
-                    date_sort = None
-                
-                # Store record data
-                self.all_records.append({
-                    'name': full_name,
-                    'case_no': case_no or "N/A",
-                    'date': formatted_date,
-                    'date_sort': date_sort
-                })
-                
-                # Add to list
-                self.add_record(full_name, case_no or "N/A", formatted_date)
+        # Clear existing items
+        self.list_widget.clear()
+        self.all_records = []
 
-        except Exception as e:
-            print(f"Error loading records from database: {e}")  
-            # Show error message to user
-            QMessageBox.critical(self, "Database Error", f"Failed to load records: {str(e)}")
+        # Queried on a worker; a load still running for the previous filter is cancelled
+        self.start_db_load(list_records, filter_juv_id, on_result=self.show_records,
+                           error_message="Failed to load records")
+
+    def show_records(self, records):
+        # Store and display records
+        for record in records:
+            lname, fname, mname = record.lname, record.fname, record.mname
+            case_no, offense_date = record.case_no, record.offense_date
+            
+            # Format name
+            full_name = f"{lname}, {fname}"
+            if mname:
+                full_name += f" {mname}"
+            
+            # Format date
+            if offense_date:
+                formatted_date = offense_date.strftime("%B %d, %Y")
+                date_sort = offense_date
+            else:
+                formatted_date = "No date"
+                date_sort = None
+            
+            # Store record data
+            self.all_records.append({
+                'name': full_name,
+                'case_no': case_no or "N/A",
+                'date': formatted_date,
+                'date_sort': date_sort
+            })
+            
+            # Add to list
+            self.add_record(full_name, case_no or "N/A", formatted_date)
 
     def filter_records(self):
         search_text = self.search_line.text().lower().strip()
@@ -977,7 +965,7 @@ class DashboardRecords(QWidget):
             print("Failed to load Inter font.")
 
 #from here, this is when user clicks on a specific case record
-class CasePersonalInfo(QWidget):
+class CasePersonalInfo(CaseFilePage, QWidget):
     switch_to_parentinfo = pyqtSignal()
     
 
@@ -1041,92 +1029,57 @@ class CasePersonalInfo(QWidget):
 
     def load_case_data(self, case_no):
         #Load juvenile data from database based on case number
-        self.current_case_no = case_no
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            # Query to get juvenile personal information and facial image
-            cursor.execute("""
-                SELECT 
-                    jp.juv_lname, 
-                    jp.juv_fname, 
-                    jp.juv_mname,
-                    jp.juv_suffix,
-                    jp.juv_dob,
-                    jp.juv_age,
-                    jp.juv_sex,
-                    jp.juv_gender,
-                    jp.juv_citizenship,
-                    jp.juv_place_of_birth,
-                    jp.juv_state_province,
-                    jp.juv_municipality,
-                    jp.juv_barangay,
-                    jp.juv_street,
-                    oi.offns_case_record_no,
-                    fd.face_image
-                FROM juvenile_profile jp
-                LEFT JOIN offense_information oi ON jp.juv_id = oi.juv_id
-                LEFT JOIN facial_data fd ON jp.juv_id = fd.juv_id
-                WHERE oi.offns_case_record_no = %s
-            """, (case_no,))
-
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-
-            if result:
-                lname, fname, mname, suffix, dob, age, sex, gender, citizenship, birthplace, state, municipal, brgy, street, case_num, face_image = result
-                
-                # Format full name
-                full_name = f"{fname}"
-                if mname:
-                    full_name += f" {mname}"
-                full_name += f" {lname}"
-                if suffix:
-                    full_name += f" {suffix}"
-                
-                # Format address
-                address_parts = [street, brgy, municipal, state]
-                home_address = ", ".join([part for part in address_parts if part])
-                
-                # Format date of birth
-                dob_formatted = dob.strftime("%B %d, %Y") if dob else "N/A"
-                
-                # Update labels
-                if self.casenum_label:
-                    self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
-                if self.fullname_label:
-                    self.fullname_label.setText(full_name)
-                if self.dob_label:
-                    self.dob_label.setText(dob_formatted)
-                if self.age_label:
-                    self.age_label.setText(str(age) if age else "N/A")
-                if self.sex_label:
-                    self.sex_label.setText(sex or "N/A")
-                if self.gender_label:
-                    self.gender_label.setText(gender or "N/A")
-                if self.citizenship_label:
-                    self.citizenship_label.setText(citizenship or "N/A")
-                if self.birthplace_label:
-                    self.birthplace_label.setText(birthplace or "N/A")
-                if self.homeaddress_label:
-                    self.homeaddress_label.setText(home_address or "N/A")
-                
-                # Display facial image
-                if face_image and self.photo_label:
-                    from PyQt5.QtGui import QPixmap
-                    pixmap = QPixmap()
-                    pixmap.loadFromData(face_image)
-                    self.photo_label.setPixmap(pixmap)
-                elif self.photo_label:
-                    self.photo_label.setText("No Photo")
-            else:
-                QMessageBox.warning(self, "Error", "Case record not found.")
-
-        except Exception as e:
-            print(f"Error loading case data: {e}")
-            QMessageBox.critical(self, "Database Error", f"Failed to load case data: {str(e)}")
+        #Queried on a worker unless cached; show_case_data fills the page with the CaseFile
+        self.load_case_file(case_no, "Failed to load case data")
+
+    def show_case_data(self, case_file):
+        if case_file:
+            juvenile = case_file.juvenile
+            lname, fname, mname, suffix = juvenile.lname, juvenile.fname, juvenile.mname, juvenile.suffix
+            dob, age, sex, gender = juvenile.dob, juvenile.age, juvenile.sex, juvenile.gender
+            citizenship, birthplace = juvenile.citizenship, juvenile.birthplace
+            state, municipal, brgy, street = juvenile.state, juvenile.municipality, juvenile.barangay, juvenile.street
+            case_num = case_file.case_no
+            
+            # Format full name
+            full_name = f"{fname}"
+            if mname:
+                full_name += f" {mname}"
+            full_name += f" {lname}"
+            if suffix:
+                full_name += f" {suffix}"
+            
+            # Format address
+            address_parts = [street, brgy, municipal, state]
+            home_address = ", ".join([part for part in address_parts if part])
+            
+            # Format date of birth
+            dob_formatted = dob.strftime("%B %d, %Y") if dob else "N/A"
+            
+            # Update labels
+            if self.casenum_label:
+                self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
+            if self.fullname_label:
+                self.fullname_label.setText(full_name)
+            if self.dob_label:
+                self.dob_label.setText(dob_formatted)
+            if self.age_label:
+                self.age_label.setText(str(age) if age else "N/A")
+            if self.sex_label:
+                self.sex_label.setText(sex or "N/A")
+            if self.gender_label:
+                self.gender_label.setText(gender or "N/A")
+            if self.citizenship_label:
+                self.citizenship_label.setText(citizenship or "N/A")
+            if self.birthplace_label:
+                self.birthplace_label.setText(birthplace or "N/A")
+            if self.homeaddress_label:
+                self.homeaddress_label.setText(home_address or "N/A")
+            
+            # Display facial image
+            self.show_face_image(case_file.face_image)
+        else:
+            QMessageBox.warning(self, "Error", "Case record not found.")
 
     def go_to_parentinfo(self):
         self.switch_to_parentinfo.emit()
@@ -1152,7 +1105,7 @@ class CasePersonalInfo(QWidget):
             print("Failed to load Inter font.")
 
 
-class CaseParentInfo(QWidget):
+class CaseParentInfo(CaseFilePage, QWidget):
     switch_to_offense = pyqtSignal()
     switch_to_personal = pyqtSignal()
     
@@ -1224,81 +1177,49 @@ class CaseParentInfo(QWidget):
 
     def load_case_data(self, case_no):
         #Load guardian data from database based on case number
-        self.current_case_no = case_no
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("""
-                SELECT 
-                    jgp.grdn_full_name,
-                    jgp.grdn_juv_relationship,
-                    jgp.grdn_dob,
-                    jgp.grdn_age,
-                    jgp.grdn_sex,
-                    jgp.grdn_citizenship,
-                    jgp.grdn_civil_status,
-                    jgp.grdn_occupation,
-                    jgp.grdn_contact_no,
-                    jgp.grdn_email_address,
-                    jgp.grdn_residential_address,
-                    oi.offns_case_record_no,
-                    fd.face_image
-                FROM juvenile_guardian_profile jgp
-                JOIN juvenile_profile jp ON jgp.juv_id = jp.juv_id
-                LEFT JOIN offense_information oi ON jp.juv_id = oi.juv_id
-                LEFT JOIN facial_data fd ON jp.juv_id = fd.juv_id
-                WHERE oi.offns_case_record_no = %s
-            """, (case_no,))
-
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-
-            if result:
-                fullname, relationship, dob, age, sex, citizenship, civil_status, occupation, contact, email, address, case_num, face_image = result
-                
-                dob_formatted = dob.strftime("%B %d, %Y") if dob else "N/A"
-                
-                if self.casenum_label:
-                    self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
-                if self.parentname_label:
-                    self.parentname_label.setText(fullname or "N/A")
-                if self.relationshp_label:
-                    self.relationshp_label.setText(relationship or "N/A")
-                if self.birthdate_label:
-                    self.birthdate_label.setText(dob_formatted)
-                if self.age_label:
-                    self.age_label.setText(str(age) if age else "N/A")
-                if self.sex_label:
-                    self.sex_label.setText(sex or "N/A")
-                if self.citizenship_label:
-                    self.citizenship_label.setText(citizenship or "N/A")
-                if self.civilstatus_label:
-                    self.civilstatus_label.setText(civil_status or "N/A")
-                if self.occupation_label:
-                    self.occupation_label.setText(occupation or "N/A")
-                if self.contactnum_label:
-                    self.contactnum_label.setText(contact or "N/A")
-                if self.email_label:
-                    self.email_label.setText(email or "N/A")
-                if self.address_label:
-                    self.address_label.setText(address or "N/A")
-                
-                # Display facial image
-                if face_image and self.photo_label:
-                    from PyQt5.QtGui import QPixmap
-                    pixmap = QPixmap()
-                    pixmap.loadFromData(face_image)
-                    self.photo_label.setPixmap(pixmap)
-                elif self.photo_label:
-                    self.photo_label.setText("No Photo")
-            else:
-                QMessageBox.warning(self, "Error", "Guardian record not found.")
-
-        except Exception as e:
-            print(f"Error loading guardian data: {e}")
-            QMessageBox.critical(self, "Database Error", f"Failed to load guardian data: {str(e)}")
+        #Queried on a worker unless cached; show_case_data fills the page with the CaseFile
+        self.load_case_file(case_no, "Failed to load guardian data")
+
+    def show_case_data(self, case_file):
+        if case_file and case_file.guardian:
+            guardian = case_file.guardian
+            fullname, relationship, dob, age, sex = (guardian.full_name, guardian.relationship, guardian.dob,
+                                                     guardian.age, guardian.sex)
+            citizenship, civil_status, occupation = guardian.citizenship, guardian.civil_status, guardian.occupation
+            contact, email, address = guardian.contact_no, guardian.email, guardian.address
+            case_num = case_file.case_no
+            
+            dob_formatted = dob.strftime("%B %d, %Y") if dob else "N/A"
+            
+            if self.casenum_label:
+                self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
+            if self.parentname_label:
+                self.parentname_label.setText(fullname or "N/A")
+            if self.relationshp_label:
+                self.relationshp_label.setText(relationship or "N/A")
+            if self.birthdate_label:
+                self.birthdate_label.setText(dob_formatted)
+            if self.age_label:
+                self.age_label.setText(str(age) if age else "N/A")
+            if self.sex_label:
+                self.sex_label.setText(sex or "N/A")
+            if self.citizenship_label:
+                self.citizenship_label.setText(citizenship or "N/A")
+            if self.civilstatus_label:
+                self.civilstatus_label.setText(civil_status or "N/A")
+            if self.occupation_label:
+                self.occupation_label.setText(occupation or "N/A")
+            if self.contactnum_label:
+                self.contactnum_label.setText(contact or "N/A")
+            if self.email_label:
+                self.email_label.setText(email or "N/A")
+            if self.address_label:
+                self.address_label.setText(address or "N/A")
+            
+            # Display facial image
+            self.show_face_image(case_file.face_image)
+        else:
+            QMessageBox.warning(self, "Error", "Guardian record not found.")
 
     def go_to_offenseinfo(self):
         self.switch_to_offense.emit()
@@ -1327,7 +1248,7 @@ class CaseParentInfo(QWidget):
             print("Failed to load Inter font.")
 
 
-class CaseOffenseInfo(QWidget):
+class CaseOffenseInfo(CaseFilePage, QWidget):
     switch_to_history = pyqtSignal()
     switch_to_parent = pyqtSignal()
     
@@ -1395,67 +1316,39 @@ class CaseOffenseInfo(QWidget):
 
     def load_case_data(self, case_no):
         #Load offense data from database based on case number
-        self.current_case_no = case_no
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            cursor.execute("""
-                SELECT 
-                    oi.offns_case_record_no,
-                    oi.offns_type,
-                    oi.offns_date_time,
-                    oi.offns_location,
-                    oi.offns_barangay_officer_in_charge,
-                    oi.offns_complainant,
-                    oi.offns_description,
-                    fd.face_image
-                FROM offense_information oi
-                LEFT JOIN juvenile_profile jp ON oi.juv_id = jp.juv_id
-                LEFT JOIN facial_data fd ON jp.juv_id = fd.juv_id
-                WHERE oi.offns_case_record_no = %s
-            """, (case_no,))
-
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-
-            if result:
-                case_num, offense_type, datetime_val, location, officer, complainant, description, face_image = result
-                
-                datetime_formatted = datetime_val.strftime("%B %d, %Y %I:%M %p") if datetime_val else "N/A"
-                
-                if self.casenum_label:
-                    self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
-                if self.casenum_display:
-                    self.casenum_display.setText(case_num or "N/A")
-                if self.offensetype_label:
-                    self.offensetype_label.setText(offense_type or "N/A")
-                if self.dateandtime_label:
-                    self.dateandtime_label.setText(datetime_formatted)
-                if self.location_label:
-                    self.location_label.setText(location or "N/A")
-                if self.officer_label:
-                    self.officer_label.setText(officer or "N/A")
-                if self.complainant_label:
-                    self.complainant_label.setText(complainant or "N/A")
-                if self.description_label:
-                    self.description_label.setText(description or "N/A")
-                
-                # Display facial image
-                if face_image and self.photo_label:
-                    from PyQt5.QtGui import QPixmap
-                    pixmap = QPixmap()
-                    pixmap.loadFromData(face_image)
-                    self.photo_label.setPixmap(pixmap)
-                elif self.photo_label:
-                    self.photo_label.setText("No Photo")
-            else:
-                QMessageBox.warning(self, "Error", "Offense record not found.")
-
-        except Exception as e:
-            print(f"Error loading offense data: {e}")
-            QMessageBox.critical(self, "Database Error", f"Failed to load offense data: {str(e)}")
+        #Queried on a worker unless cached; show_case_data fills the page with the CaseFile
+        self.load_case_file(case_no, "Failed to load offense data")
+
+    def show_case_data(self, case_file):
+        if case_file:
+            offense = case_file.offense
+            case_num, offense_type, datetime_val = offense.case_no, offense.offense_type, offense.date_time
+            location, officer, complainant = offense.location, offense.officer, offense.complainant
+            description = offense.description
+            
+            datetime_formatted = datetime_val.strftime("%B %d, %Y %I:%M %p") if datetime_val else "N/A"
+            
+            if self.casenum_label:
+                self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
+            if self.casenum_display:
+                self.casenum_display.setText(case_num or "N/A")
+            if self.offensetype_label:
+                self.offensetype_label.setText(offense_type or "N/A")
+            if self.dateandtime_label:
+                self.dateandtime_label.setText(datetime_formatted)
+            if self.location_label:
+                self.location_label.setText(location or "N/A")
+            if self.officer_label:
+                self.officer_label.setText(officer or "N/A")
+            if self.complainant_label:
+                self.complainant_label.setText(complainant or "N/A")
+            if self.description_label:
+                self.description_label.setText(description or "N/A")
+            
+            # Display facial image
+            self.show_face_image(case_file.face_image)
+        else:
+            QMessageBox.warning(self, "Error", "Offense record not found.")
 
     def go_to_history(self):
         self.switch_to_history.emit()
@@ -1483,7 +1376,7 @@ class CaseOffenseInfo(QWidget):
         else:
             print("Failed to load Inter font.")
 
-class CaseCriminalHistory(QWidget):
+class CaseCriminalHistory(CaseFilePage, QWidget):
     switch_to_offense = pyqtSignal()
     
 
@@ -1547,76 +1440,39 @@ class CaseCriminalHistory(QWidget):
 
     def load_case_data(self, case_no):
         #Load criminal history from database based on case number
-        self.current_case_no = case_no
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            # Get the juv_id and face image first
-            cursor.execute("""
-                SELECT jp.juv_id, oi.offns_case_record_no, fd.face_image
-                FROM juvenile_profile jp
-                LEFT JOIN offense_information oi ON jp.juv_id = oi.juv_id
-                LEFT JOIN facial_data fd ON jp.juv_id = fd.juv_id
-                WHERE oi.offns_case_record_no = %s
-            """, (case_no,))
-
-            result = cursor.fetchone()
-            if not result:
-                cursor.close()
-                conn.close()
-                QMessageBox.warning(self, "Error", "Case record not found.")
-                return
-                
-            juv_id, case_num, face_image = result
-            
-            # Update case number label
-            if self.casenum_label:
-                self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
-            
-            # Display facial image
-            if face_image and self.photo_label:
-                from PyQt5.QtGui import QPixmap
-                pixmap = QPixmap()
-                pixmap.loadFromData(face_image)
-                self.photo_label.setPixmap(pixmap)
-            elif self.photo_label:
-                self.photo_label.setText("No Photo")
-            
-            # Get all offenses for this juvenile
-            cursor.execute("""
-                SELECT 
-                    oi.offns_case_record_no,
-                    oi.offns_date_time,
-                    oi.offns_type
-                FROM offense_information oi
-                WHERE oi.juv_id = %s
-                ORDER BY oi.offns_date_time DESC
-            """, (juv_id,))
-
-            offenses = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            # Populate table
-            if self.history_table:
-                self.history_table.setRowCount(len(offenses))
-                for row, offense in enumerate(offenses):
-                    offense_case_no, offense_date, offense_type = offense
-                    
-                    # Case Number
-                    self.history_table.setItem(row, 0, QTableWidgetItem(offense_case_no or "N/A"))
-                    
-                    # Date
-                    date_str = offense_date.strftime("%B %d, %Y") if offense_date else "N/A"
-                    self.history_table.setItem(row, 1, QTableWidgetItem(date_str))
-                    
-                    # Offense Type
-                    self.history_table.setItem(row, 2, QTableWidgetItem(offense_type or "N/A"))
+        #Queried on a worker unless cached; show_case_data fills the page with the CaseFile
+        self.load_case_file(case_no, "Failed to load criminal history")
 
-        except Exception as e:
-            print(f"Error loading criminal history: {e}")
-            QMessageBox.critical(self, "Database Error", f"Failed to load criminal history: {str(e)}")
+    def show_case_data(self, case_file):
+        if not case_file:
+            QMessageBox.warning(self, "Error", "Case record not found.")
+            return
+
+        case_num = case_file.case_no
+        offenses = case_file.history
+        
+        # Update case number label
+        if self.casenum_label:
+            self.casenum_label.setText(f"Case No. {case_num or 'N/A'}")
+        
+        # Display facial image
+        self.show_face_image(case_file.face_image)
+
+        # Populate table
+        if self.history_table:
+            self.history_table.setRowCount(len(offenses))
+            for row, offense in enumerate(offenses):
+                offense_case_no, offense_date, offense_type = offense.case_no, offense.date_time, offense.offense_type
+                
+                # Case Number
+                self.history_table.setItem(row, 0, QTableWidgetItem(offense_case_no or "N/A"))
+                
+                # Date
+                date_str = offense_date.strftime("%B %d, %Y") if offense_date else "N/A"
+                self.history_table.setItem(row, 1, QTableWidgetItem(date_str))
+                
+                # Offense Type
+                self.history_table.setItem(row, 2, QTableWidgetItem(offense_type or "N/A"))
 
     def go_to_offense(self):
         self.switch_to_offense.emit()
@@ -0,0 +1,234 @@
+import os
+import re
+import time
+import atexit
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Query instrumentation: every cursor the app opens (see Db_connection.AppConnection) is a
+# TimedCursor, which records each statement's duration, row count and bytes fetched under a
+# short label, e.g. the prepared statement's name or "select juvenile_profile".
+# format_query_summary() returns the per-label totals and latency percentiles.
+#
+# Settings, overridable from .env
+# DB_SLOW_QUERY_MS  - statements slower than this are written to the slow-query log
+# DB_SLOW_QUERY_LOG - path of the slow-query log (rotated at SLOW_QUERY_LOG_BYTES, SLOW_QUERY_LOG_BACKUPS kept)
+# DB_QUERY_SUMMARY  - 1 to also print the summary when the application exits (it is always logged)
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.getenv("DB_SLOW_QUERY_LOG", "logs/slow_queries.log")
+SLOW_QUERY_LOG_BYTES = 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+PRINT_SUMMARY_AT_EXIT = os.getenv("DB_QUERY_SUMMARY", "0") == "1"
+
+# Histogram bucket upper bounds in milliseconds; one more bucket holds everything slower
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Longest statement text written to the slow-query log. Parameters are never logged (passwords)
+LOGGED_SQL_CHARS = 300
+
+
+class TimingStats:
+    #Running totals and a latency histogram for one label
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, seconds, rows=0):
+        ms = seconds * 1000
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.rows += rows
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, q):
+        #Upper bound (ms) of the bucket holding the q-th percentile; the maximum for the last bucket
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record_timing(label, seconds, rows=0):
+    #Count one timed operation; also used for non-SQL phases such as building a page from rows
+    with _stats_lock:
+        stats = _stats.get(label)
+        if stats is None:
+            stats = _stats[label] = TimingStats()
+        stats.add(seconds, rows)
+
+
+def record_bytes(label, nbytes):
+    with _stats_lock:
+        stats = _stats.get(label)
+        if stats is not None:
+            stats.bytes += nbytes
+
+
+def reset_query_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def query_summary():
+    #[(label, count, total_ms, mean_ms, p50_ms, p95_ms, max_ms, rows, bytes), ...], most total time first
+    with _stats_lock:
+        summary = [(label, s.count, s.total, s.total / s.count, s.percentile(50), s.percentile(95), s.max,
+                    s.rows, s.bytes) for label, s in _stats.items() if s.count]
+    return sorted(summary, key=lambda entry: -entry[2])
+
+
+def format_query_summary():
+    lines = [f"{'label':40s} {'count':>6s} {'total ms':>10s} {'mean':>8s} {'p50':>7s} {'p95':>7s} "
+             f"{'max':>8s} {'rows':>8s} {'bytes':>10s}"]
+    for label, count, total, mean, p50, p95, peak, rows, nbytes in query_summary():
+        lines.append(f"{label[:40]:40s} {count:6d} {total:10.1f} {mean:8.1f} {p50:7g} {p95:7g} "
+                     f"{peak:8.1f} {rows:8d} {nbytes:10d}")
+    return "\n".join(lines)
+
+
+_slow_log = None
+_slow_log_lock = threading.Lock()
+
+
+def get_slow_query_log():
+    #Rotating file logger, opened on first use
+    global _slow_log
+    with _slow_log_lock:
+        if _slow_log is None:
+            logger = logging.getLogger("slow_queries")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            try:
+                directory = os.path.dirname(SLOW_QUERY_LOG)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES,
+                                              backupCount=SLOW_QUERY_LOG_BACKUPS, encoding='utf-8')
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                logger.addHandler(handler)
+            except OSError as e:
+                print(f"Could not open slow-query log: {e}")
+                logger.addHandler(logging.NullHandler())
+            _slow_log = logger
+        return _slow_log
+
+
+def log_slow_query(label, seconds, rows, sql):
+    text = " ".join(sql.split())
+    if len(text) > LOGGED_SQL_CHARS:
+        text = text[:LOGGED_SQL_CHARS] + "..."
+    get_slow_query_log().info(f"{seconds * 1000:.1f} ms  {label}  rows={rows}  {text}")
+
+
+_label_cache = {}
+
+_EXECUTE_RE = re.compile(r"\s*(EXECUTE|PREPARE)\s+(\w+)", re.IGNORECASE)
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([\w.]+)", re.IGNORECASE)
+
+
+def statement_label(sql):
+    #Short stable label for a statement: the prepared statement's name, or verb plus first table
+    label = _label_cache.get(sql)
+    if label is not None:
+        return label
+
+    match = _EXECUTE_RE.match(sql)
+    if match:
+        label = match.group(2) if match.group(1).upper() == 'EXECUTE' else f"prepare {match.group(2)}"
+    else:
+        words = sql.split(None, 1)
+        verb = words[0].lower() if words else ''
+        table = _TABLE_RE.search(sql)
+        label = f"{verb} {table.group(1).lower()}" if table else verb
+
+    if len(_label_cache) < 1000:
+        _label_cache[sql] = label
+    return label
+
+
+def row_bytes(row):
+    #Approximate payload of one fetched row: text and binary by length, anything else as 8 bytes
+    return sum(len(value) if isinstance(value, (str, bytes, bytearray, memoryview)) else 8
+               for value in row if value is not None)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    #Cursor that times every execute (round trip plus server time; psycopg2 transfers the whole
+    #result during execute) and counts the bytes of the rows fetched from it
+    label = None
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def _timed(self, execute, query, params):
+        sql = query.decode() if isinstance(query, bytes) else query if isinstance(query, str) else str(query)
+        label = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return execute(query, params)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.label = label
+            rows = max(self.rowcount, 0)
+            record_timing(label, elapsed, rows)
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                log_slow_query(label, elapsed, rows, sql)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            record_bytes(self.label, row_bytes(row))
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        record_bytes(self.label, sum(row_bytes(row) for row in rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        record_bytes(self.label, sum(row_bytes(row) for row in rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        record_bytes(self.label, row_bytes(row))
+        return row
+
+
+def log_summary_at_exit():
+    if not query_summary():
+        return
+    summary = format_query_summary()
+    get_slow_query_log().info("Query summary for this session:\n" + summary)
+    if PRINT_SUMMARY_AT_EXIT:
+        print(summary)
+
+
+atexit.register(log_summary_at_exit)
@@ -0,0 +1,159 @@
+import time
+import threading
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtWidgets import QMessageBox
+from Db_connection import db_session, DB_POOL_MAX
+from DbStats import record_timing
+
+# Database work off the GUI thread:
+#   job = DbJob(fetch_records, filter_juv_id)   # fetch_records(conn, filter_juv_id) runs in db_session()
+#   job.signals.finished.connect(...)           # its return value, delivered on the GUI thread
+#   job.signals.failed.connect(...)             # the error message
+#   start_db_job(job)  ...  job.cancel()
+# Only the query function runs on the worker; it must not touch widgets
+# Besides the per-statement timings, the whole session (borrow, queries, commit) is recorded as
+# "job <fn>" and building a page from the result as "ui <page>.<handler>", so a slow page can be
+# pinned on SQL, the connection or the widgets (see DbStats.format_query_summary)
+
+# Worker threads for database jobs; one pooled connection is left for code still querying on the GUI thread
+DB_WORKERS = max(1, min(4, DB_POOL_MAX - 1))
+
+_db_thread_pool = None
+_db_thread_pool_lock = threading.Lock()
+
+
+def get_db_thread_pool():
+    #Dedicated pool so slow queries never queue behind face jobs on the global pool (or the reverse)
+    global _db_thread_pool
+    with _db_thread_pool_lock:
+        if _db_thread_pool is None:
+            _db_thread_pool = QThreadPool()
+            _db_thread_pool.setMaxThreadCount(DB_WORKERS)
+        return _db_thread_pool
+
+
+class DbJobSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class DbJob(QRunnable):
+    #Run fn(conn, *args) in a database session (committed if it returns, rolled back if it raises)
+    #and deliver the result through signals on the GUI thread.
+    #cancel() drops the result and, if the query is still running, cancels it on the server;
+    #a cancelled job emits nothing
+
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.signals = DbJobSignals()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            if self._conn is not None:
+                try:
+                    self._conn.cancel()
+                except Exception as e:
+                    print(f"Could not cancel query: {e}")
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        if self.cancelled:
+            return
+        started = time.perf_counter()
+        try:
+            with db_session() as conn:
+                with self._lock:
+                    if self.cancelled:
+                        return
+                    self._conn = conn
+                try:
+                    result = self.fn(conn, *self.args)
+                finally:
+                    with self._lock:
+                        self._conn = None
+            record_timing(f"job {getattr(self.fn, '__name__', 'query')}", time.perf_counter() - started)
+
+            if not self.cancelled:
+                self.signals.finished.emit(result)
+
+        except Exception as e:
+            # A cancelled query ends in an error as well; nobody is waiting for it
+            if self.cancelled:
+                return
+            print(f"Database error: {e}")
+            self.signals.failed.emit(str(e))
+
+
+def start_db_job(job):
+    get_db_thread_pool().start(job)
+    return job
+
+
+def set_loading(widget, loading):
+    #Busy cursor over a page while its data loads or saves
+    if loading:
+        widget.setCursor(Qt.BusyCursor)
+    else:
+        widget.unsetCursor()
+
+
+class DbPageMixin:
+    #For QWidget pages that load their data with a DbJob: one load at a time, a busy cursor while
+    #it runs, and the load cancelled when the page is hidden (the user navigated away).
+    #Listed before QWidget in the bases so its hideEvent runs
+    db_job = None
+
+    def start_db_load(self, fn, *args, on_result, error_message):
+        #Run fn(conn, *args) on a worker and pass its result to on_result on the GUI thread
+        self.cancel_db_load()
+        job = DbJob(fn, *args)
+        job.signals.finished.connect(
+            lambda result, job=job: self._db_load_finished(job, on_result, error_message, result))
+        job.signals.failed.connect(
+            lambda message, job=job: self._db_load_failed(job, error_message, message))
+        self.db_job = start_db_job(job)
+        set_loading(self, True)
+        return job
+
+    def cancel_db_load(self):
+        if self.db_job is not None:
+            self.db_job.cancel()
+            self.db_job = None
+            set_loading(self, False)
+
+    def _db_load_finished(self, job, on_result, error_message, result):
+        # Ignore a result that arrives after the load was cancelled or replaced
+        if job is not self.db_job:
+            return
+        self.db_job = None
+        set_loading(self, False)
+        started = time.perf_counter()
+        try:
+            on_result(result)
+            record_timing(f"ui {type(self).__name__}.{getattr(on_result, '__name__', 'result')}",
+                          time.perf_counter() - started)
+        except Exception as e:
+            print(f"Error showing loaded data: {e}")
+            QMessageBox.critical(self, "Database Error", f"{error_message}: {str(e)}")
+
+    def _db_load_failed(self, job, error_message, message):
+        if job is not self.db_job:
+            return
+        self.db_job = None
+        set_loading(self, False)
+        QMessageBox.critical(self, "Database Error", f"{error_message}: {message}")
+
+    def hideEvent(self, event):
+        # Spontaneous hides come from the window system (minimising), not from navigation
+        if not event.spontaneous():
+            self.cancel_db_load()
+        super().hideEvent(event)
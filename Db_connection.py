@@ -1,22 +1,270 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
 import os
+import re
+import sys
+import atexit
+import contextlib
+import threading
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from DbStats import TimedCursor
 
 
 load_dotenv() 
 
+# Connection pool size, overridable from .env
+# DB_POOL_MIN - connections opened up front and kept open
+# DB_POOL_MAX - most connections open at once (GUI, face gallery, background workers)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "8"))
+
+# DB_PREPARE - 0 to run registered statements as plain SQL, e.g. behind a pooler such as
+#              PgBouncer in transaction mode, where a PREPAREd statement may not be there next time
+DB_PREPARE = os.getenv("DB_PREPARE", "1") != "0"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection_settings():
+    return dict(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS") or os.getenv("DB_PASSWORD"),
+        # sslmode="disable"
+        connection_factory=AppConnection,
+    )
+
+
+class AppConnection(psycopg2.extensions.connection):
+    #psycopg2 connection that remembers which registered statements are PREPAREd on it.
+    #The set lives and dies with the server session, so a connection the pool replaces
+    #simply starts empty and prepares again on first use.
+    #Its cursors are timed (see DbStats.py)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = TimedCursor
+
+
+def get_db_pool():
+    #Process-wide pool, created on first use; raises psycopg2.OperationalError if the database is unreachable
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **connection_settings())
+        return _pool
+
+
+def close_db_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.closeall()
+
+
+atexit.register(close_db_pool)
+
+
+class PooledConnection:
+    #A connection borrowed from the pool. Behaves like the psycopg2 connection it wraps, except
+    #that close() hands it back to the pool (rolling back anything left uncommitted) instead of
+    #closing it, so existing `conn.close()` calls return connections without any other change
+
+    def __init__(self, pool, conn, borrower=None):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_borrower', borrower)
+
+    def __getattr__(self, name):
+        conn = self._conn
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        conn = self._conn
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        setattr(conn, name, value)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        conn = self._conn
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+
+        # A connection that failed is dropped; the pool opens a fresh one when needed
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                broken = True
+        try:
+            self._pool.putconn(conn, close=broken)
+        except psycopg2.pool.PoolError:
+            # The pool was closed meanwhile (application exit)
+            conn.close()
+
+    def __del__(self):
+        # Only reports the leak: the caller must close() or use db_session(). The connection
+        # (and any locks its open transaction holds) is not touched from the collecting thread
+        if self.__dict__.get('_conn') is not None:
+            print(f"Warning: pooled database connection borrowed at {self.__dict__.get('_borrower')} "
+                  f"was never closed; its pool slot stays in use")
+
+
+def _borrower():
+    #"File.py:line (function)" of the code outside this module that is borrowing a connection
+    frame = sys._getframe(1)
+    skipped = (os.path.abspath(__file__), os.path.abspath(contextlib.__file__))
+    while frame is not None and os.path.abspath(frame.f_code.co_filename) in skipped:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+
+
+def borrow_connection():
+    #Pooled connection, raising if the database is unreachable or every connection is in use
+    pool = get_db_pool()
+    conn = pool.getconn()
+    if conn.closed:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return PooledConnection(pool, conn, _borrower())
+
+
 def get_db_connection():
-    conn = None
+    #Pooled connection (see PooledConnection), or None if the database cannot be reached
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            database=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASS") or os.getenv("DB_PASSWORD"),
-            # sslmode="disable"
-        )
-        return conn
+        return borrow_connection()
     except psycopg2.OperationalError as e:
         print("Error: Unable to connect to the database.", e)
-        return None
\ No newline at end of file
+        return None
+    except psycopg2.pool.PoolError as e:
+        print("Error: No database connection available.", e)
+        return None
+
+
+def open_db_connection():
+    #A dedicated connection outside the pool, for long-lived uses such as LISTEN; close() closes it
+    try:
+        return psycopg2.connect(**connection_settings())
+    except psycopg2.OperationalError as e:
+        print("Error: Unable to connect to the database.", e)
+        return None
+
+
+@contextmanager
+def db_session():
+    #with db_session() as conn: ...
+    #Borrows a pooled connection, commits when the block ends, rolls back if it raises, and
+    #returns the connection either way. Connection errors are raised like any query error
+    conn = borrow_connection()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            if not conn.closed:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        raise
+    finally:
+        conn.close()
+
+
+# Registered statements by name (see PreparedStatement), and those whose PREPARE failed once,
+# which always run as plain SQL from then on
+_statements = {}
+_failed_statements = set()
+
+
+class PreparedStatement:
+    #A hot query registered once at import:
+    #   FETCH_CASE = PreparedStatement('fetch_case', "SELECT ... WHERE OFFNS_CASE_RECORD_NO = %s")
+    #   FETCH_CASE.execute(cursor, (case_no,))
+    #On each connection the first execute() PREPAREs it, so Postgres parses and plans it once per
+    #session; later calls only send EXECUTE name(params). Falls back to plain SQL on connections
+    #that do not track prepared statements, when DB_PREPARE is off, or if PREPARE fails
+
+    def __init__(self, name, sql):
+        if name in _statements:
+            raise ValueError(f"Statement '{name}' is already registered")
+        self.name = name
+        self.sql = sql
+        self.param_count = sql.count('%s')
+        # PREPARE takes numbered parameters
+        numbers = iter(range(1, self.param_count + 1))
+        self.prepare_sql = f"PREPARE {name} AS " + re.sub(r'%s', lambda _: f"${next(numbers)}", sql)
+        if self.param_count:
+            self.execute_sql = f"EXECUTE {name} (" + ", ".join(["%s"] * self.param_count) + ")"
+        else:
+            self.execute_sql = f"EXECUTE {name}"
+        _statements[name] = self
+
+    def execute(self, cursor, params=()):
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared', None)
+        if not DB_PREPARE or prepared is None or self.name in _failed_statements:
+            cursor.execute(self.sql, params)
+            return
+
+        if self.name not in prepared and not self._prepare(cursor, prepared):
+            cursor.execute(self.sql, params)
+            return
+
+        idle = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            cursor.execute(self.execute_sql, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # The session lost it (e.g. DISCARD ALL by a pooler); prepare again if nothing else
+            # ran in this transaction, otherwise let the caller's transaction fail as it would
+            prepared.discard(self.name)
+            if not idle:
+                raise
+            conn.rollback()
+            self.execute(cursor, params)
+
+    def _prepare(self, cursor, prepared):
+        # A failed PREPARE must not take the caller's open transaction down with it
+        conn = cursor.connection
+        in_transaction = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        try:
+            if in_transaction:
+                cursor.execute("SAVEPOINT prepare_statement")
+            cursor.execute(self.prepare_sql)
+            if in_transaction:
+                cursor.execute("RELEASE SAVEPOINT prepare_statement")
+        except psycopg2.errors.DuplicatePreparedStatement:
+            # Prepared earlier on this session by someone who did not record it
+            if in_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+            else:
+                conn.rollback()
+        except psycopg2.Error as e:
+            print(f"Could not prepare statement '{self.name}', running it as plain SQL: {e}")
+            if in_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+            else:
+                conn.rollback()
+            _failed_statements.add(self.name)
+            return False
+        prepared.add(self.name)
+        return True
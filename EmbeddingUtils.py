@@ -0,0 +1,133 @@
+import ast
+import numpy as np
+from Db_connection import get_db_connection
+
+# face_recognition encodings are 128-d vectors. They are stored in
+# FACIAL_DATA.EMBEDDING as raw little-endian float32 (512 bytes per face)
+EMBEDDING_DIM = 128
+EMBEDDING_DTYPE = np.dtype('<f4')
+EMBEDDING_NBYTES = EMBEDDING_DIM * EMBEDDING_DTYPE.itemsize
+
+
+def embedding_to_bytes(embedding):
+    #Pack a face encoding into the binary format used by FACIAL_DATA.EMBEDDING
+    array = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    if array.shape != (EMBEDDING_DIM,):
+        raise ValueError(f"Expected a {EMBEDDING_DIM}-d embedding, got shape {array.shape}")
+    return array.tobytes()
+
+
+def embedding_from_bytes(data):
+    #Zero-copy view over a stored embedding (psycopg2 returns BYTEA as memoryview)
+    if isinstance(data, str):
+        # Row not migrated yet (legacy TEXT column holding str(list))
+        return parse_legacy_embedding(data)
+
+    array = np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+    if array.size != EMBEDDING_DIM:
+        raise ValueError(f"Expected {EMBEDDING_NBYTES} bytes, got {array.nbytes}")
+    return array
+
+
+def parse_legacy_embedding(text):
+    #Parse the old str(list) representation without eval()
+    return np.asarray(ast.literal_eval(text), dtype=EMBEDDING_DTYPE)
+
+
+# Schema additions made after FACIAL_DATA was first deployed (see juvenile-profiling-system-db.sql):
+# the DATE_ADDED/JUV_ID indexes used by gallery catch-up and template lookups, and the insert
+# trigger that NOTIFYs running kiosks on FaceGallery.NOTIFY_CHANNEL. Every statement is idempotent
+FACIAL_DATA_UPGRADE_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_facial_data_date_added ON facial_data (date_added)",
+    "CREATE INDEX IF NOT EXISTS idx_facial_data_juv_id ON facial_data (juv_id)",
+    """
+    CREATE OR REPLACE FUNCTION public.notify_facial_data_inserted() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify(
+            'facial_data_inserted',
+            json_build_object('face_id', NEW.face_id, 'juv_id', NEW.juv_id)::text
+        );
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_facial_data_notify ON facial_data",
+    """
+    CREATE TRIGGER trg_facial_data_notify
+    AFTER INSERT ON facial_data
+    FOR EACH ROW EXECUTE FUNCTION notify_facial_data_inserted()
+    """,
+)
+
+
+def upgrade_facial_data(cursor):
+    #Bring an existing FACIAL_DATA up to the current schema; the caller commits
+    for statement in FACIAL_DATA_UPGRADE_SQL:
+        cursor.execute(statement)
+
+
+def migrate_text_embeddings():
+    #One-shot migration: convert FACIAL_DATA.EMBEDDING from TEXT to 512-byte float32 BYTEA and
+    #add the indexes and notify trigger (upgrade_facial_data)
+    #Safe to run more than once; the conversion is skipped if the column is already BYTEA
+    conn = get_db_connection()
+    if not conn:
+        return False
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'facial_data' AND column_name = 'embedding'
+        """)
+        column = cursor.fetchone()
+        if column is None:
+            print("FACIAL_DATA.EMBEDDING column not found")
+            cursor.close()
+            conn.close()
+            return False
+
+        if column[0] == 'bytea':
+            upgrade_facial_data(cursor)
+            conn.commit()
+            print("FACIAL_DATA.EMBEDDING is already binary. Indexes and notify trigger are in place.")
+            cursor.close()
+            conn.close()
+            return True
+
+        cursor.execute("ALTER TABLE FACIAL_DATA ADD COLUMN EMBEDDING_BIN BYTEA")
+        cursor.execute("SELECT FACE_ID, EMBEDDING FROM FACIAL_DATA")
+        rows = cursor.fetchall()
+
+        converted = []
+        for face_id, embedding_str in rows:
+            embedding = parse_legacy_embedding(embedding_str)
+            converted.append((embedding_to_bytes(embedding), face_id))
+
+        from psycopg2.extras import execute_batch
+        execute_batch(cursor, "UPDATE FACIAL_DATA SET EMBEDDING_BIN = %s WHERE FACE_ID = %s", converted)
+
+        cursor.execute("ALTER TABLE FACIAL_DATA DROP COLUMN EMBEDDING")
+        cursor.execute("ALTER TABLE FACIAL_DATA RENAME COLUMN EMBEDDING_BIN TO EMBEDDING")
+        cursor.execute("ALTER TABLE FACIAL_DATA ALTER COLUMN EMBEDDING SET NOT NULL")
+        cursor.execute(f"""
+            ALTER TABLE FACIAL_DATA ADD CONSTRAINT facial_data_embedding_len_check
+            CHECK (octet_length(EMBEDDING) = {EMBEDDING_NBYTES})
+        """)
+        upgrade_facial_data(cursor)
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+        print(f"Migrated {len(converted)} embedding(s) to binary float32.")
+        return True
+
+    except Exception as e:
+        print(f"Error migrating embeddings: {e}")
+        conn.rollback()
+        conn.close()
+        return False
+
+
+if __name__ == "__main__":
+    migrate_text_embeddings()
@@ -1,15 +1,20 @@
 import sys
-import cv2
-import psycopg2
-import numpy as np
 from datetime import datetime
 from PyQt5 import uic, Qt
 from PyQt5.QtCore import QEvent, pyqtSignal, Qt, QTimer, QDate, QDateTime
-from PyQt5.QtGui import QFontDatabase, QImage, QPixmap
+from PyQt5.QtGui import QFontDatabase, QPixmap
 from PyQt5.QtWidgets import (QWidget, QApplication, QComboBox, QLineEdit, QMessageBox, QPushButton, QLabel,
                              QDialogButtonBox, QDialog, QStyle, QMainWindow, QStackedWidget, QListWidget, QHBoxLayout,
                              QListWidgetItem, QVBoxLayout, QDateEdit, QDateTimeEdit, QTextEdit)
-from Db_connection import get_db_connection
+from Db_connection import db_session
+from DbWorker import DbJob, start_db_job, set_loading
+from EmbeddingUtils import embedding_to_bytes, embedding_from_bytes
+from FaceGallery import get_face_gallery
+from CameraCapture import CameraThread
+from FramePreview import FramePreview
+from FaceDetection import FaceDetector, BestFrames, find_centered_face
+from FaceWorker import FaceJob, start_face_job
+from Repository import enroll
 
 
 class EnrollmentData:
@@ -85,6 +90,10 @@ class Enroll(QMainWindow):
         # Initialize temporary data storage
         self.enrollment_data = EnrollmentData()
 
+        # Save running on a worker, and whether the dashboard should open when it finishes
+        self.save_job = None
+        self.dashboard_pending = False
+
         # add the stacked widget
         self.stack_widget = QStackedWidget(self)
         uic.loadUi("ui/enroll-stack.ui", self.stack_widget)
@@ -176,6 +185,12 @@ class Enroll(QMainWindow):
         self.stack_widget.setCurrentWidget(self.review4)
 
     def open_dashboardmenu(self):
+        # Submitting saves and closes in one go; wait for the save so the records can be filtered by it
+        if self.save_job is not None:
+            self.dashboard_pending = True
+            return
+        self.dashboard_pending = False
+
         from DashboardMenu import DbMenuWindow as RecordWindow
         self.main_window = RecordWindow()
 
@@ -193,103 +208,46 @@ class Enroll(QMainWindow):
         self.stack_widget.setCurrentWidget(self.personalinfo)
 
     def save_to_database(self):
-        try:
-
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            # Insert into JUVENILE_PROFILE
-            cursor.execute("""
-                INSERT INTO JUVENILE_PROFILE 
-                (JUV_LNAME, JUV_FNAME, JUV_MNAME, JUV_SUFFIX, JUV_SEX, JUV_GENDER, 
-                JUV_AGE, JUV_DOB, JUV_PLACE_OF_BIRTH, JUV_CITIZENSHIP, 
-                JUV_STATE_PROVINCE, JUV_MUNICIPALITY, JUV_BARANGAY, JUV_STREET)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING JUV_ID
-            """, (
-                self.enrollment_data.personal_info['lname'],
-                self.enrollment_data.personal_info['fname'],
-                self.enrollment_data.personal_info['mname'],
-                self.enrollment_data.personal_info['suffix'],
-                self.enrollment_data.personal_info['sex'],
-                self.enrollment_data.personal_info['gender'],
-                int(self.enrollment_data.personal_info['age']) if self.enrollment_data.personal_info['age'] else None,
-                self.enrollment_data.personal_info['dob'],
-                self.enrollment_data.personal_info['birthplace'],
-                self.enrollment_data.personal_info['citizenship'],
-                self.enrollment_data.personal_info['state'],
-                self.enrollment_data.personal_info['municipal'],
-                self.enrollment_data.personal_info['brgy'],
-                self.enrollment_data.personal_info['street']
-            ))
-
-            juv_id = cursor.fetchone()[0]
-            
-            # Store juv_id in enrollment_data for later use
-            self.enrollment_data.juv_id = juv_id
-
-            # Insert into JUVENILE_GUARDIAN_PROFILE
-            cursor.execute("""
-                INSERT INTO JUVENILE_GUARDIAN_PROFILE 
-                (GRDN_FULL_NAME, GRDN_JUV_RELATIONSHIP, GRDN_SEX, GRDN_DOB, GRDN_AGE, 
-                GRDN_CIVIL_STATUS, GRDN_CITIZENSHIP, GRDN_OCCUPATION, GRDN_EMAIL_ADDRESS, 
-                GRDN_CONTACT_NO, GRDN_RESIDENTIAL_ADDRESS, JUV_ID)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                self.enrollment_data.parent_info['fullname'],
-                self.enrollment_data.parent_info['relationship'],
-                self.enrollment_data.parent_info['sex'],
-                self.enrollment_data.parent_info['dob'],
-                int(self.enrollment_data.parent_info['age']) if self.enrollment_data.parent_info['age'] else None,
-                self.enrollment_data.parent_info['civil_status'],
-                self.enrollment_data.parent_info['citizenship'],
-                self.enrollment_data.parent_info['occupation'],
-                self.enrollment_data.parent_info['email'],
-                self.enrollment_data.parent_info['contact'],
-                self.enrollment_data.parent_info['address'],
-                juv_id
-            ))
-
-            # Insert into OFFENSE_INFORMATION
-            cursor.execute("""
-                INSERT INTO OFFENSE_INFORMATION 
-                (OFFNS_TYPE, OFFNS_CASE_RECORD_NO, OFFNS_DATE_TIME, OFFNS_LOCATION, 
-                OFFNS_DESCRIPTION, OFFNS_COMPLAINANT, OFFNS_BARANGAY_OFFICER_IN_CHARGE, JUV_ID)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                self.enrollment_data.offense_info['offense_type'],
-                self.enrollment_data.offense_info['case_no'],
-                self.enrollment_data.offense_info['datetime'],
-                self.enrollment_data.offense_info['location'],
-                self.enrollment_data.offense_info['description'],
-                self.enrollment_data.offense_info['complainant'],
-                self.enrollment_data.offense_info['officer'],
-                juv_id
-            ))
+        # Saved on a worker; the dashboard opens once the save has finished (see open_dashboardmenu)
+        if self.save_job is not None:
+            return
+        data = self.enrollment_data
+        job = DbJob(enroll, dict(data.personal_info), dict(data.parent_info),
+                    dict(data.offense_info), dict(data.facial_data))
+        job.signals.finished.connect(lambda ids, job=job: self.handle_save_result(job, ids))
+        job.signals.failed.connect(lambda message, job=job: self.handle_save_error(job, message))
+        self.save_job = start_db_job(job)
+        set_loading(self, True)
+
+    def handle_save_result(self, job, ids):
+        if job is not self.save_job:
+            return
+        self.save_job = None
+        set_loading(self, False)
 
-            # Insert into FACIAL_DATA
-            cursor.execute("""
-                INSERT INTO FACIAL_DATA 
-                (FACE_IMAGE, EMBEDDING, JUV_ID)
-                VALUES (%s, %s, %s)
-            """, (
-                psycopg2.Binary(self.enrollment_data.facial_data['image']),
-                self.enrollment_data.facial_data['embedding'],
-                juv_id
-            ))
+        juv_id, face_id = ids
+        
+        # Store juv_id in enrollment_data for later use
+        self.enrollment_data.juv_id = juv_id
 
-            conn.commit()
-            cursor.close()
-            conn.close()
+        # Keep the shared recognition gallery in step with the new enrollment
+        get_face_gallery().add(juv_id, embedding_from_bytes(self.enrollment_data.facial_data['embedding']), face_id)
 
-            # Show success message
-            QMessageBox.information(self, "Success", "Record successfully saved to database!")
+        # Show success message
+        QMessageBox.information(self, "Success", "Record successfully saved to database!")
 
-            # Note: Don't reset here - we need juv_id for filtering
+        # Note: Don't reset here - we need juv_id for filtering
+        if self.dashboard_pending:
+            self.open_dashboardmenu()
 
-        except Exception as e:
-            QMessageBox.critical(self, "Database Error", f"Failed to save data: {str(e)}")
-            print(f"Database error: {e}")
+    def handle_save_error(self, job, message):
+        if job is not self.save_job:
+            return
+        self.save_job = None
+        set_loading(self, False)
+        QMessageBox.critical(self, "Database Error", f"Failed to save data: {message}")
+        if self.dashboard_pending:
+            self.open_dashboardmenu()
 
     def load_fonts(self):
         # Poppins
@@ -641,28 +599,27 @@ class OffenseInfo(QWidget):
 
     def generate_case_number(self):
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            # Get the latest case number
-            cursor.execute("SELECT OFFNS_CASE_RECORD_NO FROM OFFENSE_INFORMATION ORDER BY OFFNS_ID DESC LIMIT 1")
-            result = cursor.fetchone()
-            
-            cursor.close()
-            conn.close()
-            
-            if result:
-                last_case = result[0]
-                parts = last_case.split('-')
-                if len(parts) == 2:
-                    number = int(parts[1]) + 1
-                    new_case_no = f"10-{number:04d}"
-                    
-                    from ValidationUtils import check_case_number_exists
-                    while check_case_number_exists(new_case_no):
-                        number += 1
+            # One pooled connection for the lookup and every uniqueness check
+            with db_session() as conn:
+                cursor = conn.cursor()
+                
+                # Get the latest case number
+                cursor.execute("SELECT OFFNS_CASE_RECORD_NO FROM OFFENSE_INFORMATION ORDER BY OFFNS_ID DESC LIMIT 1")
+                result = cursor.fetchone()
+                cursor.close()
+                
+                if result:
+                    last_case = result[0]
+                    parts = last_case.split('-')
+                    if len(parts) == 2:
+                        number = int(parts[1]) + 1
                         new_case_no = f"10-{number:04d}"
-                    return new_case_no
+                        
+                        from ValidationUtils import check_case_number_exists
+                        while check_case_number_exists(new_case_no, conn):
+                            number += 1
+                            new_case_no = f"10-{number:04d}"
+                        return new_case_no
         
             # Default first case number
             return "10-0001"
@@ -742,46 +699,18 @@ class FaceScan(QDialog):
         self.layout.addWidget(self.video_label)
 
         self.face_label = self.findChild(QLabel, "face_label")
+        self.preview = FramePreview.attach(self.face_label) if self.face_label else None
 
         # Find the existing status label from UI
         self.status_label = self.findChild(QLabel, "label")
 
-        # Load face detector (Haar cascade for simplicity)
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-
-        # Prioritize using webcam for face scan if plugged in
-        camera_indices = [1, 2, 0]
-        self.cap = None
-        for index in camera_indices:
-            print(f"Trying camera index {index}...")
-            cap = cv2.VideoCapture(index, cv2.CAP_DSHOW)
-            if not cap.isOpened():
-                cap = cv2.VideoCapture(index)
-            if cap.isOpened():
-                ret, test_frame = cap.read()
-                if ret and test_frame is not None:
-                    print(f"Camera index {index} is working. Using it.")
-                    self.cap = cap
-                    break
-                else:
-                    cap.release()
-                    print(f"Camera index {index} opened but failed to read frame. Skipping.")
-            else:
-                print(f"Failed to open camera index {index}.")
-
-        if self.cap is None:
-            print("No working camera found. Check connections and permissions.")
-            return
-
-        # Set camera properties to avoid resolution/format mismatches
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        self.cap.set(cv2.CAP_PROP_FPS, 30)
+        # Configured detector backend on a downscaled frame every few frames (see FaceDetection.py)
+        self.face_detector = FaceDetector()
 
-        # Timer for video feed
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_frame)
-        self.timer.start(30)
+        # Camera is opened and read on a capture thread; update_frame runs whenever a new frame is ready
+        self.camera = CameraThread(self)
+        self.camera.frame_ready.connect(self.update_frame)
+        self.camera.camera_failed.connect(lambda message: print(message))
 
         # Timer for auto-capture; starts when face is detected
         self.capture_timer = QTimer(self)
@@ -795,68 +724,67 @@ class FaceScan(QDialog):
 
         self.face_detected = False
         self.captured_frame = None
+        self.captured_box = None
+
+        # Sharpest, largest, most centred frames of the current countdown; the best one is encoded
+        self.best_frames = BestFrames()
+
+        # Encoding/duplicate-check job of the current capture, run off the GUI thread
+        self.capture_job = None
+
+        self.camera.start()
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        if self.camera is None:
             return
 
-        # Convert to grayscale for detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Always the newest frame; any frames read since the last call are skipped
+        frame = self.camera.take_frame()
+        if frame is None:
+            return
 
         # Detect faces
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        faces = self.face_detector.detect(frame)
 
         # Check if a face is in the center
-        frame_center_x, frame_center_y = frame.shape[1] // 2, frame.shape[0] // 2
-        tolerance = 0.2  # 20% tolerance
-        face_in_center = False
-        for (x, y, w, h) in faces:
-            face_center_x = x + w // 2
-            face_center_y = y + h // 2
-            if (abs(face_center_x - frame_center_x) < tolerance * frame_center_x and
-                    abs(face_center_y - frame_center_y) < tolerance * frame_center_y):
-                face_in_center = True
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-                break  # Only consider the first detected face
+        face_box = find_centered_face(faces, frame.shape)
+        # Once the countdown runs, it only resets when the tracker loses the face, so a single
+        # missed detection or a small head movement no longer restarts it
+        if face_box is None and self.face_detected and self.face_detector.tracking and faces:
+            face_box = faces[0]
+        face_in_center = face_box is not None
 
         # Update status and timer based on detection
         if face_in_center:
             if not self.face_detected:
                 self.face_detected = True
+                self.best_frames.clear()
                 if self.status_label:
                     self.status_label.setText("Face detected! Scanning in 3 seconds...")
                 self.countdown_value = 3
                 self.countdown_timer.start(1000)  # Update every 1 second
                 self.capture_timer.start(3000)
         else:
-            if self.face_detected:
+            # Leaving the frame does not interrupt a capture that is already being processed
+            if self.face_detected and self.capture_job is None:
                 self.face_detected = False
                 if self.status_label:
                     self.status_label.setText("Position your face at the center for face scan")
                 self.capture_timer.stop()
                 self.countdown_timer.stop()
 
-        # Store current frame
-        self.captured_frame = frame.copy()
+        # Store current frame and its face box (the camera thread never writes to the frame again,
+        # so no copy is needed)
+        self.captured_frame = frame
+        self.captured_box = face_box
 
-        # Crop to square, centered
-        h, w, ch = frame.shape
-        if w > h:
-            start_x = (w - h) // 2
-            cropped = frame[:, start_x:start_x + h]
-        else:
-            start_y = (h - w) // 2
-            cropped = frame[start_y:start_y + w, :]
-
-        cropped = cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB)
-        h_c, w_c, ch_c = cropped.shape
-        qt_image = QImage(cropped.data, w_c, h_c, ch_c * w_c, QImage.Format_RGB888)
+        # Score every frame of the countdown
+        if self.face_detected and self.capture_job is None and face_box is not None:
+            self.best_frames.add(frame, face_box)
 
-        if self.face_label:
-            self.face_label.setPixmap(QPixmap.fromImage(qt_image).scaled(
-                self.face_label.width(), self.face_label.height()
-            ))
+        # Scaled and painted straight from the frame buffer, box drawn on top (see FramePreview.py)
+        if self.preview:
+            self.preview.set_frame(frame, face_box)
 
     def update_countdown(self):
         if self.countdown_value > 0:
@@ -867,109 +795,95 @@ class FaceScan(QDialog):
             self.countdown_timer.stop()
 
     def capture_and_save(self):
-        ret, frame = self.cap.read()
-        if ret and self.enrollment_data:
-            if self.status_label:
-                self.status_label.setText("Processing face... Please wait.")
-
-            # Generate embedding
-            embedding = self.generate_embedding(frame)
+        if self.capture_job is not None:
+            return
 
-            if embedding is None:
-                QMessageBox.warning(self, "Face Detection Error",
-                                    "Could not detect or encode face clearly. Please try again.")
-                self.face_detected = False
-                if self.status_label:
-                    self.status_label.setText("Position your face at the center for face scan")
-                return
-            
-            from ValidationUtils import check_embedding_similarity
-            exists, juv_id = check_embedding_similarity(embedding, threshold=0.4)
-            
-            if exists:
-                reply = QMessageBox.question(
-                    self,
-                    "Duplicate Face Detected",
-                    f"This face appears to be already registered in the system (JUV_ID: {juv_id}).\n\n"
-                    "Are you sure you want to continue enrolling this person again?",
-                    QMessageBox.Yes | QMessageBox.No,
-                    QMessageBox.No
-                )
-                
-                if reply == QMessageBox.No:
-                    self.face_detected = False
-                    if self.status_label:
-                        self.status_label.setText("Position your face at the center for face scan")
-                    return
-            
-            is_success, buffer = cv2.imencode(".jpg", frame)
-            if is_success:
-                image_bytes = buffer.tobytes()
-
-                # Save to temporary storage
-                self.enrollment_data.facial_data['image'] = image_bytes
-                self.enrollment_data.facial_data['embedding'] = embedding
-
-                print("Photo captured and saved to temporary storage.")
-                print(f"Embedding generated successfully with {len(eval(embedding))} dimensions")
-                self.scan_completed.emit()
-                self.accept()
-            else:
-                print("Failed to encode frame.")
-        else:
+        # Best-scored frame of the countdown first, the next ones only if it cannot be encoded
+        candidates = self.best_frames.ranked() or [(self.captured_frame, self.captured_box)]
+        frame, face_box = candidates[0]
+        if frame is None or not self.enrollment_data:
             print("Failed to capture frame.")
+            return
 
-    def generate_embedding(self, frame):
-        try:
-            import face_recognition
+        if self.status_label:
+            self.status_label.setText("Processing face... Please wait.")
+
+        # Encoding and the duplicate check run on a worker; the preview keeps running meanwhile
+        from ValidationUtils import find_similar_faces
+        # The detected box is reused so dlib does not search the whole frame for the face again
+        job = FaceJob(frame, find_similar_faces, face_box, alternatives=candidates[1:])
+        if self.status_label:
+            job.signals.progress.connect(self.status_label.setText)
+        job.signals.finished.connect(
+            lambda embedding, matches, image, job=job: self.handle_capture_result(job, embedding, matches, image))
+        job.signals.failed.connect(lambda message, job=job: self.handle_capture_result(job, None, [], None))
+        self.capture_job = start_face_job(job)
+
+    def handle_capture_result(self, job, embedding, matches, image_bytes):
+        # Ignore a result that arrives after the dialog was hidden
+        if job is not self.capture_job:
+            return
+        self.capture_job = None
 
+        if embedding is None:
+            QMessageBox.warning(self, "Face Detection Error",
+                                "Could not detect or encode face clearly. Please try again.")
+            self.face_detected = False
             if self.status_label:
-                self.status_label.setText("Processing face... Please wait.")
-
-            # Validate frame FIRST
-            if frame is None or frame.size == 0:
-                print("Invalid frame: empty or None")
-                return None
-            
-            # Ensure frame is in correct format (uint8)
-            if frame.dtype != np.uint8:
-                print(f"Converting frame from {frame.dtype} to uint8")
-                frame = frame.astype(np.uint8)
-            
-            # Ensure frame has 3 channels (BGR)
-            if len(frame.shape) != 3 or frame.shape[2] != 3:
-                print(f"Invalid frame shape: {frame.shape}")
-                return None
-
-            # Convert BGR to RGB (OpenCV uses BGR, face_recognition needs RGB)
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # Double-check RGB frame
-            if rgb_frame.dtype != np.uint8:
-                rgb_frame = rgb_frame.astype(np.uint8)
+                self.status_label.setText("Position your face at the center for face scan")
+            return
 
-            # Get face encodings (128-dimension vector)
-            face_encodings = face_recognition.face_encodings(rgb_frame)
+        if matches:
+            shortlist = "\n".join(f"• JUV_ID {juv_id} (distance {distance:.2f})" for juv_id, distance in matches)
+            reply = QMessageBox.question(
+                self,
+                "Duplicate Face Detected",
+                f"This face appears to be already registered in the system:\n\n{shortlist}\n\n"
+                "Are you sure you want to continue enrolling this person again?",
+                QMessageBox.Yes | QMessageBox.No,
+                QMessageBox.No
+            )
 
-            if len(face_encodings) == 0:
-                print("No face detected for embedding generation")
-                return None
+            if reply == QMessageBox.No:
+                self.face_detected = False
+                if self.status_label:
+                    self.status_label.setText("Position your face at the center for face scan")
+                return
 
-            # Get the first face encoding
-            embedding = face_encodings[0]
+        if image_bytes is not None:
+            # Save to temporary storage, packed as float32 bytes for database storage
+            self.enrollment_data.facial_data['image'] = image_bytes
+            self.enrollment_data.facial_data['embedding'] = embedding_to_bytes(embedding)
 
-            # Convert to string for database storage
-            return str(embedding.tolist())
+            print("Photo captured and saved to temporary storage.")
+            print(f"Embedding generated successfully with {embedding.size} dimensions")
+            self.scan_completed.emit()
+            self.accept()
+        else:
+            print("Failed to encode frame.")
+
+    def cancel_capture(self):
+        if self.capture_job is not None:
+            self.capture_job.cancel()
+            self.capture_job = None
+            self.face_detected = False
+
+    def stop_camera(self):
+        if self.camera is not None:
+            self.camera.frame_ready.disconnect(self.update_frame)
+            self.camera.stop()
+            self.camera = None
+            self.face_detector.report_latency()
+
+    def hideEvent(self, event):
+        # accept()/reject() only hide the dialog, so the camera is released here as well
+        self.cancel_capture()
+        self.stop_camera()
+        super().hideEvent(event)
 
-        except Exception as e:
-            print(f"Error generating face embedding: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
-        
     def closeEvent(self, event):
-        if self.cap:
-            self.cap.release()
+        self.cancel_capture()
+        self.stop_camera()
         super().closeEvent(event)
 
     def load_fonts(self):
@@ -1391,17 +1305,11 @@ class ReviewBioInfo(QWidget):
 
     def populate_fields(self):
         if self.facescan_lbl and self.enrollment_data.facial_data['image']:
-            # Convert bytes back to image and display
-            nparr = np.frombuffer(self.enrollment_data.facial_data['image'], np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-            # Convert to RGB for display
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            h, w, ch = img_rgb.shape
-            bytes_per_line = ch * w
-            qt_image = QImage(img_rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
+            # Qt decodes the stored JPEG bytes directly
+            pixmap = QPixmap()
+            pixmap.loadFromData(self.enrollment_data.facial_data['image'])
 
-            self.facescan_lbl.setPixmap(QPixmap.fromImage(qt_image).scaled(
+            self.facescan_lbl.setPixmap(pixmap.scaled(
                 self.facescan_lbl.width(),
                 self.facescan_lbl.height(),
                 Qt.KeepAspectRatio
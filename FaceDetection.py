@@ -0,0 +1,391 @@
+import os
+import sys
+import time
+import heapq
+import itertools
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Live-preview face detection settings, overridable from .env
+# FACE_DETECTOR     - detector backend: haar (default), dnn (OpenCV res10 SSD) or mediapipe;
+#                     run `python FaceDetection.py` to compare their latency on this machine
+# FACE_DETECT_SCALE - the detector runs on the frame resized by this factor (1 = full resolution)
+# FACE_DETECT_EVERY - run the detector on every Nth frame; the frames in between reuse the last boxes
+# FACE_TRACKER      - mosse (cheapest), kcf or csrt (most accurate, slowest) from opencv-contrib to follow
+#                     the face between detections; none to disable
+# FACE_REDETECT_EVERY - while a face is tracked, the detector only re-runs on every Nth frame
+DETECTOR = os.getenv("FACE_DETECTOR", "haar").lower()
+DETECT_SCALE = min(1.0, max(0.1, float(os.getenv("FACE_DETECT_SCALE", "0.5"))))
+DETECT_EVERY = max(1, int(os.getenv("FACE_DETECT_EVERY", "3")))
+TRACKER = os.getenv("FACE_TRACKER", "mosse").lower()
+REDETECT_EVERY = max(1, int(os.getenv("FACE_REDETECT_EVERY", "15")))
+
+# Re-detections in a row that find no face before a track is dropped as drifted
+MAX_REDETECT_MISSES = 2
+
+# Smallest face reported, in full-resolution pixels
+MIN_FACE_SIZE = 30
+
+# OpenCV DNN backend: the res10 SSD Caffe model (deploy.prototxt and
+# res10_300x300_ssd_iter_140000.caffemodel from the OpenCV samples), overridable from .env
+DNN_PROTOTXT = os.getenv("FACE_DNN_PROTOTXT", "models/face_detector/deploy.prototxt")
+DNN_MODEL = os.getenv("FACE_DNN_MODEL", "models/face_detector/res10_300x300_ssd_iter_140000.caffemodel")
+DNN_INPUT_SIZE = 300
+
+# Minimum confidence for the dnn and mediapipe backends
+DETECT_CONFIDENCE = float(os.getenv("FACE_DETECT_CONFIDENCE", "0.5"))
+
+# A face counts as centred when its centre is within this fraction of the frame centre
+CENTER_TOLERANCE = 0.2
+
+# Best-frame selection during a capture countdown: frames kept, the side (pixels) face crops are
+# resized to before measuring sharpness, the Laplacian variance at which sharpness scores 0.5,
+# and the share of the frame area at which a face scores full marks for size
+BEST_FRAMES = 3
+QUALITY_CROP_SIZE = 96
+SHARPNESS_REFERENCE = 100.0
+FULL_SIZE_FRACTION = 0.12
+
+
+def create_tracker(name):
+    #OpenCV tracker by name, or None if this OpenCV build does not have it
+    #Newer builds keep MOSSE (and sometimes the others) only under cv2.legacy
+    factory_name = f"Tracker{name.upper()}_create"
+    for module in (cv2, getattr(cv2, 'legacy', None)):
+        factory = getattr(module, factory_name, None) if module is not None else None
+        if factory is not None:
+            return factory()
+    return None
+
+
+# Detector backends: detect(image, min_size) takes a BGR image and returns face boxes
+# [(x, y, w, h), ...] in that image's coordinates, no smaller than min_size pixels.
+# A backend that cannot be created (package or model file missing) raises, and FaceDetector
+# falls back to Haar
+
+class HaarBackend:
+    name = 'haar'
+
+    def __init__(self):
+        # Load face detector (Haar cascade for simplicity)
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        if self.face_cascade.empty():
+            raise RuntimeError("Haar cascade could not be loaded")
+
+    def detect(self, image, min_size):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+        return [tuple(int(v) for v in face) for face in faces]
+
+
+class DnnBackend:
+    #OpenCV's res10 SSD: more robust to pose and lighting than Haar, at a fixed 300x300 input
+    name = 'dnn'
+
+    def __init__(self, prototxt=DNN_PROTOTXT, model=DNN_MODEL, confidence=DETECT_CONFIDENCE):
+        if not os.path.exists(prototxt) or not os.path.exists(model):
+            raise FileNotFoundError(f"DNN face model not found ({prototxt}, {model})")
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.confidence = confidence
+
+    def detect(self, image, min_size):
+        h, w = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, (DNN_INPUT_SIZE, DNN_INPUT_SIZE)), 1.0,
+                                     (DNN_INPUT_SIZE, DNN_INPUT_SIZE), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        faces = []
+        # Rows are [_, _, confidence, left, top, right, bottom] with coordinates relative to the image
+        for detection in detections[detections[:, 2] >= self.confidence]:
+            left, top, right, bottom = np.clip(detection[3:7], 0.0, 1.0) * (w, h, w, h)
+            box = (int(left), int(top), int(right - left), int(bottom - top))
+            if box[2] >= min_size and box[3] >= min_size:
+                faces.append(box)
+        return faces
+
+
+class MediapipeBackend:
+    #MediaPipe's BlazeFace short-range model, meant for faces within about 2 m of the camera
+    name = 'mediapipe'
+
+    def __init__(self, confidence=DETECT_CONFIDENCE):
+        import mediapipe as mp
+        self.detector = mp.solutions.face_detection.FaceDetection(model_selection=0,
+                                                                  min_detection_confidence=confidence)
+
+    def detect(self, image, min_size):
+        h, w = image.shape[:2]
+        results = self.detector.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        faces = []
+        for detection in results.detections or []:
+            box = detection.location_data.relative_bounding_box
+            left, top = max(0.0, box.xmin) * w, max(0.0, box.ymin) * h
+            right, bottom = min(1.0, box.xmin + box.width) * w, min(1.0, box.ymin + box.height) * h
+            face = (int(left), int(top), int(right - left), int(bottom - top))
+            if face[2] >= min_size and face[3] >= min_size:
+                faces.append(face)
+        return faces
+
+
+DETECTOR_BACKENDS = {'haar': HaarBackend, 'dnn': DnnBackend, 'mediapipe': MediapipeBackend}
+
+
+def create_detector_backend(name=DETECTOR):
+    #Backend by name; Haar if the name is unknown or the backend cannot be created here
+    backend_class = DETECTOR_BACKENDS.get(name)
+    if backend_class is None:
+        print(f"Unknown face detector '{name}', using haar")
+        return HaarBackend()
+    try:
+        return backend_class()
+    except Exception as e:
+        if backend_class is HaarBackend:
+            raise
+        print(f"Face detector '{name}' not available ({e}), using haar")
+        return HaarBackend()
+
+
+class FaceDetector:
+    #Face detection for the live preview: every `every` frames the detector backend runs on a
+    #downscaled copy and the boxes are mapped back to full resolution.
+    #With a tracker, a detected face seeds it and is followed on every frame in between, and the
+    #detector only re-runs every `redetect_every` frames to correct drift; a face the detector misses
+    #is kept while the tracker still holds it, for up to MAX_REDETECT_MISSES re-detections.
+    #Time spent per frame and per detector run is accumulated; report_latency() prints it
+
+    def __init__(self, scale=DETECT_SCALE, every=DETECT_EVERY, tracker=TRACKER, redetect_every=REDETECT_EVERY,
+                 backend=DETECTOR):
+        self.backend = create_detector_backend(backend) if isinstance(backend, str) else backend
+        self.scale = scale
+        self.every = every
+        self.tracker_name = tracker if tracker and tracker != 'none' else None
+        self.redetect_every = redetect_every
+        if self.tracker_name and create_tracker(self.tracker_name) is None:
+            print(f"OpenCV tracker '{self.tracker_name}' not available (needs opencv-contrib), detecting only")
+            self.tracker_name = None
+        self.reset()
+
+    def reset(self):
+        # The next frame is always detected afresh
+        self._frame_count = 0
+        self._faces = []
+        self._tracker = None
+        self._misses = 0
+        self._frames = 0
+        self._frame_seconds = 0.0
+        self._detections = 0
+        self._detect_seconds = 0.0
+
+    def latency(self):
+        #(mean ms per frame, mean ms per detector run) since reset(); None where nothing was timed
+        per_frame = self._frame_seconds * 1000 / self._frames if self._frames else None
+        per_detection = self._detect_seconds * 1000 / self._detections if self._detections else None
+        return per_frame, per_detection
+
+    def report_latency(self):
+        per_frame, per_detection = self.latency()
+        if per_frame is None:
+            return
+        print(f"Face detector {self.backend.name}: {per_frame:.1f} ms per frame over {self._frames} frames, "
+              f"{per_detection or 0:.1f} ms per detection over {self._detections} detections")
+
+    @property
+    def tracking(self):
+        #True while a tracker is following a face
+        return self._tracker is not None
+
+    def detect(self, frame):
+        #Face boxes [(x, y, w, h), ...] in full-resolution coordinates of a BGR frame
+        started = time.perf_counter()
+        faces = self._update(frame)
+        self._frames += 1
+        self._frame_seconds += time.perf_counter() - started
+        return faces
+
+    def _update(self, frame):
+        self._frame_count += 1
+        interval = self.redetect_every if self._tracker is not None else self.every
+        due = (self._frame_count - 1) % interval == 0
+        if not due and self._tracker is None:
+            return self._faces
+
+        if self.scale < 1.0:
+            small = cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_LINEAR)
+        else:
+            small = frame
+
+        if due:
+            faces = self._detect(small)
+            if faces:
+                self._misses = 0
+                self._seed_tracker(small, faces, frame.shape)
+                self._faces = faces
+                return faces
+            if self._tracker is None:
+                self._faces = []
+                return self._faces
+            self._misses += 1
+            if self._misses > MAX_REDETECT_MISSES:
+                self._drop_track()
+                return self._faces
+
+        ok, box = self._tracker.update(small)
+        if not ok:
+            # Track lost: report no face and detect again on the next frame
+            self._drop_track()
+            return self._faces
+        self._faces = [self._to_full(box)]
+        return self._faces
+
+    def _detect(self, small):
+        started = time.perf_counter()
+        min_size = max(1, int(round(MIN_FACE_SIZE * self.scale)))
+        faces = self.backend.detect(small, min_size)
+        self._detections += 1
+        self._detect_seconds += time.perf_counter() - started
+        return [self._to_full(face) for face in faces]
+
+    def _to_full(self, box):
+        return tuple(int(round(v / self.scale)) for v in box)
+
+    def _seed_tracker(self, small, faces, frame_shape):
+        # Follow the centred face if there is one, otherwise the largest
+        if not self.tracker_name:
+            return
+        seed = find_centered_face(faces, frame_shape) or max(faces, key=lambda face: face[2] * face[3])
+        tracker = create_tracker(self.tracker_name)
+        tracker.init(small, tuple(int(round(v * self.scale)) for v in seed))
+        self._tracker = tracker
+        self._frame_count = 1
+
+    def _drop_track(self):
+        self._tracker = None
+        self._faces = []
+        self._misses = 0
+        self._frame_count = 0
+
+
+def find_centered_face(faces, frame_shape, tolerance=CENTER_TOLERANCE):
+    #First face whose centre lies near the frame centre, or None
+    frame_center_x, frame_center_y = frame_shape[1] // 2, frame_shape[0] // 2
+    for (x, y, w, h) in faces:
+        face_center_x = x + w // 2
+        face_center_y = y + h // 2
+        if (abs(face_center_x - frame_center_x) < tolerance * frame_center_x and
+                abs(face_center_y - frame_center_y) < tolerance * frame_center_y):
+            return (x, y, w, h)
+    return None
+
+
+def frame_quality(frame, face_box):
+    #0..1 score of how good a frame is to encode: sharpness of the face (variance of the Laplacian
+    #on a fixed-size grayscale crop), its size relative to the frame and how centred it is.
+    #Sharpness dominates; a small or off-centre face can at most halve the score
+    x, y, w, h = face_box
+    frame_h, frame_w = frame.shape[:2]
+    crop = frame[max(0, y):min(frame_h, y + h), max(0, x):min(frame_w, x + w)]
+    if crop.size == 0:
+        return 0.0
+
+    gray = cv2.cvtColor(cv2.resize(crop, (QUALITY_CROP_SIZE, QUALITY_CROP_SIZE), interpolation=cv2.INTER_AREA),
+                        cv2.COLOR_BGR2GRAY)
+    variance = cv2.Laplacian(gray, cv2.CV_64F).var()
+    sharpness = variance / (variance + SHARPNESS_REFERENCE)
+
+    size = min(1.0, (w * h) / (FULL_SIZE_FRACTION * frame_w * frame_h))
+
+    offset_x = abs(x + w / 2 - frame_w / 2) / (frame_w / 2)
+    offset_y = abs(y + h / 2 - frame_h / 2) / (frame_h / 2)
+    centring = max(0.0, 1.0 - max(offset_x, offset_y))
+
+    return sharpness * (0.5 + 0.25 * size + 0.25 * centring)
+
+
+class BestFrames:
+    #The few highest-scoring (frame, face_box) pairs seen since the last clear()
+
+    def __init__(self, size=BEST_FRAMES):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, frame, face_box):
+        score = frame_quality(frame, face_box)
+        # The counter breaks ties so frames themselves are never compared
+        entry = (score, next(self._counter), frame, face_box)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, entry)
+        elif score > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+        return score
+
+    def ranked(self):
+        #[(frame, face_box), ...], best first
+        return [(frame, face_box) for _, _, frame, face_box in sorted(self._heap, key=lambda entry: -entry[0])]
+
+
+def benchmark(frames, backends=DETECTOR_BACKENDS, scale=DETECT_SCALE):
+    #Detector run time (ms) of each available backend over the same frames:
+    #{name: (mean, 95th percentile, frames with a face)}
+    results = {}
+    for name in backends:
+        try:
+            backend = DETECTOR_BACKENDS[name]()
+        except Exception as e:
+            print(f"{name}: not available ({e})")
+            continue
+        detector = FaceDetector(scale=scale, every=1, tracker='none', backend=backend)
+        # The first run loads and initialises the model; it is not counted
+        detector.detect(frames[0])
+        timings, found = [], 0
+        for frame in frames:
+            started = time.perf_counter()
+            found += bool(detector.detect(frame))
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = (float(np.mean(timings)), float(np.percentile(timings, 95)), found)
+    return results
+
+
+if __name__ == "__main__":
+    # python FaceDetection.py [video or image files...]
+    # Without files, 100 frames are read from the camera
+    frames = []
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append(image)
+                continue
+            video = cv2.VideoCapture(path)
+            while True:
+                ret, frame = video.read()
+                if not ret:
+                    break
+                frames.append(frame)
+            video.release()
+    else:
+        from CameraCapture import probe_camera
+        cap, _, _ = probe_camera()
+        while cap is not None and len(frames) < 100:
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        if cap is not None:
+            cap.release()
+
+    if not frames:
+        print("No frames to benchmark")
+        sys.exit(1)
+
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, detector scale {DETECT_SCALE}")
+    for name, (mean, p95, found) in benchmark(frames).items():
+        print(f"{name:10s} {mean:7.2f} ms mean  {p95:7.2f} ms p95  face in {found}/{len(frames)} frames")
@@ -0,0 +1,857 @@
+import os
+import glob
+import json
+import time
+import struct
+import select
+import threading
+from datetime import datetime
+import numpy as np
+from dotenv import load_dotenv
+from Db_connection import get_db_connection, open_db_connection, PreparedStatement
+from EmbeddingUtils import EMBEDDING_DIM, EMBEDDING_DTYPE, embedding_from_bytes
+from FaceIndex import IVFIndex, ANN_ENABLED, ANN_MIN_SIZE, ANN_INDEX_PATH
+
+load_dotenv()
+
+# face_recognition distance below which two encodings are the same person
+MATCH_THRESHOLD = 0.4
+
+# Default shortlist length for FaceGallery.search
+TOP_K = 5
+
+# Closest centroids re-scored against every stored face of their juvenile. A juvenile is only
+# matched through its real faces, so this is kept wide enough that one whose close face is
+# outweighed in the centroid by others still makes the shortlist
+RERANK_CANDIDATES = 32
+
+# A juvenile keeps at most this many faces; a confirmed scan closer than
+# MIN_TEMPLATE_DISTANCE to a stored face adds nothing and is not kept
+MAX_TEMPLATES = 10
+MIN_TEMPLATE_DISTANCE = 0.1
+
+# Storage for the search matrix, overridable from .env (FACE_GALLERY_DTYPE):
+#   float32 - exact and fastest; every stored face is also kept in memory for re-scoring
+#   float16 - half the matrix size, but each scan is about 7x slower than float32 (numpy has no
+#             float16 BLAS, and upcasting the rows costs more than the product itself; about
+#             42 ms against 6 ms per probe at 100,000 juveniles). Shortlist re-ranked on float32
+#             faces from FACIAL_DATA
+#   int8    - a quarter of the matrix size (per-row scale) and scans within about 1.3x of
+#             float32; re-ranked the same way. The better choice when memory is the constraint
+# Reported distances are always exact float32 ones; quantization only affects which
+# RERANK_CANDIDATES juveniles make the shortlist. Run 'python FaceGallery.py' on a site's
+# own data to measure that (max/mean coarse distance error, shortlist recall and scan time)
+GALLERY_DTYPES = ('float32', 'float16', 'int8')
+GALLERY_DTYPE = os.getenv("FACE_GALLERY_DTYPE", "float32")
+
+# Rows are upcast to float32 this many at a time when the search matrix is quantized
+QUANTIZED_CHUNK_ROWS = 8192
+
+# Channel used by the facial_data insert trigger (see juvenile-profiling-system-db.sql;
+# existing databases get it from 'python EmbeddingUtils.py')
+NOTIFY_CHANNEL = 'facial_data_inserted'
+NOTIFY_TRIGGER = 'trg_facial_data_notify'
+
+# Rows added this long before the newest DATE_ADDED seen are re-checked on catch-up, so a
+# transaction that took a lower FACE_ID but committed late is not skipped by the watermark
+CATCHUP_OVERLAP = '10 minutes'
+
+# On-disk copy of the gallery that is memory-mapped at startup, so the first scan does not wait
+# for every embedding to come over the network; only rows newer than its watermark are fetched.
+# Overridable from .env:
+#   FACE_GALLERY_SNAPSHOT_DIR     - where snapshot files are kept ('' disables snapshots)
+#   FACE_GALLERY_SNAPSHOT_REFRESH - rewrite the snapshot once this many faces were added since it was taken
+#   FACE_GALLERY_SNAPSHOT_MAX_AGE - hours after which a restored snapshot is replaced by a full reload
+#                                   (the only way faces deleted from FACIAL_DATA leave the gallery)
+SNAPSHOT_DIR = os.getenv("FACE_GALLERY_SNAPSHOT_DIR", "cache/face_gallery")
+SNAPSHOT_REFRESH = int(os.getenv("FACE_GALLERY_SNAPSHOT_REFRESH", "1000"))
+SNAPSHOT_MAX_AGE_HOURS = float(os.getenv("FACE_GALLERY_SNAPSHOT_MAX_AGE", "24"))
+
+SNAPSHOT_MAGIC = b'JPSGALL\0'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGN = 64
+
+
+def quantize(rows, dtype):
+    #float32 (n, 128) rows -> (stored rows, per-row float32 scales) for the given gallery dtype
+    rows = np.asarray(rows, dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_DIM)
+    scales = np.ones(len(rows), dtype=EMBEDDING_DTYPE)
+    if dtype == 'float16':
+        return rows.astype(np.float16), scales
+    if dtype == 'int8':
+        peak = np.max(np.abs(rows), axis=1)
+        scales = np.where(peak > 0, peak / 127.0, 1.0).astype(EMBEDDING_DTYPE)
+        return np.clip(np.rint(rows / scales[:, None]), -127, 127).astype(np.int8), scales
+    return rows, scales
+
+
+def dequantize(stored, scales):
+    #Inverse of quantize(); returns float32 rows
+    rows = np.asarray(stored, dtype=EMBEDDING_DTYPE)
+    if stored.dtype == np.int8:
+        rows = rows * scales[:, None]
+    return rows
+
+
+def _align(offset):
+    return -(-offset // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+
+def write_snapshot(path, header, arrays):
+    #One file: magic, header length, JSON header (metadata plus the layout of every array),
+    #then the raw arrays at aligned offsets so each can be memory-mapped in place
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset = _align(offset + array.nbytes)
+    encoded = json.dumps(dict(header, arrays=layout)).encode('utf-8')
+    data_start = _align(len(SNAPSHOT_MAGIC) + 8 + len(encoded))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(memoryview(np.ascontiguousarray(array)).cast('B'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    #Returns (header, {name: array}) with every array memory-mapped copy-on-write, so in-place
+    #gallery updates never reach the file; (None, {}) if the file is not a snapshot
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            return None, {}
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode('utf-8'))
+    data_start = _align(len(SNAPSHOT_MAGIC) + 8 + length)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        else:
+            # Plain ndarray views of the mapping: slicing a np.memmap is several times slower
+            arrays[name] = np.asarray(np.memmap(path, dtype=dtype, mode='c', offset=data_start + spec['offset'],
+                                                shape=shape))
+    return header, arrays
+
+
+# Embedding lookups that run on every re-rank and every new enrollment, PREPAREd once per connection
+FACES_FOR_JUVENILES = PreparedStatement(
+    'faces_for_juveniles', "SELECT JUV_ID, EMBEDDING FROM FACIAL_DATA WHERE JUV_ID = ANY(%s)")
+FACE_BY_ID = PreparedStatement(
+    'face_by_id', "SELECT JUV_ID, EMBEDDING, DATE_ADDED FROM FACIAL_DATA WHERE FACE_ID = %s")
+
+
+def fetch_templates(juv_ids):
+    #{juv_id: (T, 128) float32 faces} straight from FACIAL_DATA, for galleries that do not keep them
+    if len(juv_ids) == 0:
+        return {}
+
+    conn = get_db_connection()
+    if not conn:
+        return {}
+
+    try:
+        cursor = conn.cursor()
+        FACES_FOR_JUVENILES.execute(cursor, ([int(juv_id) for juv_id in juv_ids],))
+        results = cursor.fetchall()
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        print(f"Error fetching face templates: {e}")
+        conn.close()
+        return {}
+
+    templates = {}
+    for juv_id, stored_embedding in results:
+        try:
+            templates.setdefault(juv_id, []).append(embedding_from_bytes(stored_embedding))
+        except Exception as e:
+            print(f"Skipping invalid embedding for JUV_ID {juv_id}: {e}")
+    return {juv_id: np.array(faces, dtype=EMBEDDING_DTYPE) for juv_id, faces in templates.items()}
+
+
+def wants_template(faces, embedding):
+    #Whether a confirmed scan is worth storing as another face for a juvenile whose stored faces
+    #are faces ((T, 128) float32): under the per-juvenile cap and not a near-copy of one of them
+    if len(faces) >= MAX_TEMPLATES:
+        return False
+    if len(faces) == 0:
+        return True
+    probe = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(EMBEDDING_DIM)
+    return float(np.min(np.linalg.norm(np.asarray(faces, dtype=EMBEDDING_DTYPE) - probe, axis=1))) >= MIN_TEMPLATE_DISTANCE
+
+
+class FaceGallery:
+    #In-memory copy of FACIAL_DATA for 1:N matching. The search matrix holds one row per juvenile
+    #(the centroid of all their stored faces) as a contiguous (N, 128) matrix with a parallel
+    #JUV_ID array, so a lookup is a single matrix-vector product. A shortlist of the closest
+    #centroids is then scored by each juvenile's best stored face (never the centroid) in float32
+
+    def __init__(self, dtype=GALLERY_DTYPE):
+        if dtype not in GALLERY_DTYPES:
+            print(f"Unknown face gallery dtype '{dtype}', using float32")
+            dtype = 'float32'
+        self.dtype = dtype
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._embeddings = np.empty((0, EMBEDDING_DIM), dtype=dtype)
+        self._scales = np.empty(0, dtype=EMBEDDING_DTYPE)
+        self._sq_norms = np.empty(0, dtype=EMBEDDING_DTYPE)
+        self._counts = np.empty(0, dtype=np.int32)
+        self._juv_ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._rows = {}
+        self._templates = {}
+        self._known_face_ids = set()
+        self.ann_index = None
+        self.face_id_watermark = 0
+        self.date_watermark = None
+        self.loaded = False
+        self.snapshot_created = None
+        self._faces_since_snapshot = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def keeps_templates(self):
+        #Quantized galleries leave the float32 faces in the database to save memory
+        return self.dtype == 'float32'
+
+    def memory_bytes(self):
+        #Approximate size of the numeric arrays (search matrix, side arrays and kept faces)
+        embeddings, scales, sq_norms, juv_ids = self.snapshot()
+        total = embeddings.nbytes + scales.nbytes + sq_norms.nbytes + juv_ids.nbytes + 4 * len(juv_ids)
+        return total + sum(faces.nbytes for faces in list(self._templates.values()))
+
+    def load(self, attach_index=True):
+        #(Re)build the whole gallery from the database
+        conn = get_db_connection()
+        if not conn:
+            return False
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT FACE_ID, JUV_ID, EMBEDDING, DATE_ADDED FROM FACIAL_DATA ORDER BY FACE_ID")
+            results = cursor.fetchall()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            print(f"Error loading face gallery: {e}")
+            conn.close()
+            return False
+
+        face_ids = []
+        templates = {}
+        date_watermark = None
+        for face_id, juv_id, stored_embedding, date_added in results:
+            try:
+                templates.setdefault(juv_id, []).append(embedding_from_bytes(stored_embedding))
+                face_ids.append(face_id)
+                if date_added is not None and (date_watermark is None or date_added > date_watermark):
+                    date_watermark = date_added
+            except Exception as e:
+                print(f"Skipping invalid embedding for JUV_ID {juv_id}: {e}")
+
+        juv_ids = list(templates)
+        templates = {juv_id: np.array(faces, dtype=EMBEDDING_DTYPE) for juv_id, faces in templates.items()}
+        centroids = np.array([templates[juv_id].mean(axis=0) for juv_id in juv_ids],
+                             dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_DIM)
+        counts = np.array([len(templates[juv_id]) for juv_id in juv_ids], dtype=np.int32)
+        embeddings, scales = quantize(centroids, self.dtype)
+        decoded = dequantize(embeddings, scales)
+        with self._lock:
+            self._embeddings = embeddings
+            self._scales = scales
+            self._sq_norms = np.einsum('ij,ij->i', decoded, decoded)
+            self._counts = counts
+            self._juv_ids = np.array(juv_ids, dtype=np.int64)
+            self._size = len(juv_ids)
+            self._rows = {juv_id: row for row, juv_id in enumerate(juv_ids)}
+            self._templates = templates if self.keeps_templates else {}
+            self._known_face_ids = set(face_ids)
+            self.ann_index = None
+            self.face_id_watermark = max(face_ids, default=0)
+            self.date_watermark = date_watermark
+            self.loaded = True
+            self.snapshot_created = None
+            self._faces_since_snapshot = 0
+
+        print(f"Face gallery loaded with {len(face_ids)} embedding(s) of {self._size} juvenile(s) "
+              f"({self.dtype}, {self.memory_bytes() / 1e6:.1f} MB)")
+
+        if ANN_ENABLED and attach_index:
+            self.attach_ann_index()
+        return True
+
+    def attach_ann_index(self, rebuild=False):
+        #Use the persisted IVF index (training and saving a new one if needed) once the
+        #gallery is large enough for the exact scan to matter
+        embeddings, scales, _, juv_ids = self.snapshot()
+        if len(embeddings) < ANN_MIN_SIZE:
+            return False
+
+        try:
+            rows = dequantize(embeddings, scales)
+            index = None if rebuild else IVFIndex.load(ANN_INDEX_PATH, rows, juv_ids)
+            if index is None:
+                print(f"Training ANN index over {len(rows)} juvenile(s)...")
+                index = IVFIndex.train(rows)
+                index.save(ANN_INDEX_PATH, juv_ids)
+            del rows
+        except Exception as e:
+            print(f"ANN index unavailable, using exact scan: {e}")
+            return False
+
+        with self._lock:
+            # Rows may have been appended while the index was being built
+            if self._size > len(index):
+                index.add(dequantize(self._embeddings[len(index):self._size], self._scales[len(index):self._size]))
+            self.ann_index = index
+
+        print(f"ANN index ready ({index.nlist} cells, nprobe={index.nprobe})")
+        return True
+
+    def catch_up(self, conn=None):
+        #Append rows added since the watermark (e.g. while the listener was disconnected)
+        if not self.loaded:
+            self.ensure_loaded()
+            if not self.loaded:
+                return False
+
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db_connection()
+            if not conn:
+                return False
+
+        try:
+            cursor = conn.cursor()
+            if self.date_watermark is not None:
+                cursor.execute(f"""
+                    SELECT FACE_ID, JUV_ID, EMBEDDING, DATE_ADDED FROM FACIAL_DATA
+                    WHERE FACE_ID > %s OR DATE_ADDED > %s - INTERVAL '{CATCHUP_OVERLAP}'
+                    ORDER BY FACE_ID
+                """, (self.face_id_watermark, self.date_watermark))
+            else:
+                cursor.execute("""
+                    SELECT FACE_ID, JUV_ID, EMBEDDING, DATE_ADDED FROM FACIAL_DATA
+                    WHERE FACE_ID > %s ORDER BY FACE_ID
+                """, (self.face_id_watermark,))
+            results = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            print(f"Error catching up face gallery: {e}")
+            return False
+        finally:
+            if own_conn:
+                conn.close()
+
+        added = 0
+        for face_id, juv_id, stored_embedding, date_added in results:
+            try:
+                if self.add(juv_id, embedding_from_bytes(stored_embedding), face_id, date_added):
+                    added += 1
+            except Exception as e:
+                print(f"Skipping invalid embedding for JUV_ID {juv_id}: {e}")
+
+        if added:
+            print(f"Face gallery caught up with {added} new embedding(s)")
+        return True
+
+    def ensure_loaded(self):
+        #The listener thread may already be loading; wait for it rather than loading twice
+        if not self.loaded:
+            with self._load_lock:
+                if not self.loaded:
+                    # A snapshot answers at once; the listener's catch_up then fetches only newer rows
+                    if not self.restore_snapshot() and self.load():
+                        self.save_snapshot()
+
+    def restore_snapshot(self, directory=SNAPSHOT_DIR):
+        #Memory-map the newest usable snapshot for this gallery dtype; False if there is none
+        if not directory or not os.path.isdir(directory):
+            return False
+
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, f"gallery-{self.dtype}-*.snap")):
+            try:
+                snapshots.append((os.path.getmtime(path), path))
+            except OSError:
+                # Deleted since the glob, e.g. pruned by another instance saving a snapshot
+                continue
+        snapshots.sort(reverse=True)
+        for _, path in snapshots:
+            try:
+                header, arrays = read_snapshot(path)
+                if (header is None or header.get('version') != SNAPSHOT_VERSION
+                        or header.get('dim') != EMBEDDING_DIM or header.get('dtype') != self.dtype
+                        or (self.keeps_templates and 'faces' not in arrays)):
+                    continue
+
+                juv_ids = arrays['juv_ids']
+                rows = {juv_id: row for row, juv_id in enumerate(juv_ids.tolist())}
+                templates = {}
+                if self.keeps_templates:
+                    faces, offsets = arrays['faces'], arrays['face_offsets'].tolist()
+                    templates = {juv_id: faces[offsets[row]:offsets[row + 1]] for juv_id, row in rows.items()}
+                known_face_ids = set(arrays['face_ids'].tolist())
+                date_watermark = header.get('date_watermark')
+                date_watermark = datetime.fromisoformat(date_watermark) if date_watermark else None
+            except Exception as e:
+                print(f"Ignoring unreadable gallery snapshot {path}: {e}")
+                continue
+
+            with self._lock:
+                self._embeddings = arrays['embeddings']
+                self._scales = arrays['scales']
+                self._sq_norms = arrays['sq_norms']
+                self._counts = arrays['counts']
+                self._juv_ids = juv_ids
+                self._size = len(juv_ids)
+                self._rows = rows
+                self._templates = templates
+                self._known_face_ids = known_face_ids
+                self.ann_index = None
+                self.face_id_watermark = int(header['face_id_watermark'])
+                self.date_watermark = date_watermark
+                self.snapshot_created = float(header['created'])
+                self._faces_since_snapshot = 0
+                self.loaded = True
+
+            age = (time.time() - self.snapshot_created) / 3600
+            print(f"Face gallery restored from snapshot with {len(known_face_ids)} embedding(s) of "
+                  f"{self._size} juvenile(s) ({self.dtype}, {age:.1f} h old)")
+            if ANN_ENABLED:
+                self.attach_ann_index()
+            return True
+        return False
+
+    def save_snapshot(self, directory=SNAPSHOT_DIR):
+        #Write the current gallery to a new snapshot file and drop older ones
+        if not directory or not self.loaded:
+            return False
+
+        with self._lock:
+            size = self._size
+            juv_ids = self._juv_ids[:size].copy()
+            arrays = {
+                'embeddings': self._embeddings[:size].copy(),
+                'scales': self._scales[:size].copy(),
+                'sq_norms': self._sq_norms[:size].copy(),
+                'counts': self._counts[:size].copy(),
+                'juv_ids': juv_ids,
+                'face_ids': np.fromiter(self._known_face_ids, dtype=np.int64, count=len(self._known_face_ids)),
+            }
+            if self.keeps_templates:
+                faces = [self._templates[juv_id] for juv_id in juv_ids.tolist()]
+                arrays['faces'] = (np.concatenate(faces) if faces
+                                   else np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE))
+                arrays['face_offsets'] = np.concatenate([[0], np.cumsum([len(f) for f in faces])]).astype(np.int64)
+            header = {
+                'version': SNAPSHOT_VERSION,
+                'dim': EMBEDDING_DIM,
+                'dtype': self.dtype,
+                'face_id_watermark': int(self.face_id_watermark),
+                'date_watermark': self.date_watermark.isoformat() if self.date_watermark else None,
+                'created': time.time(),
+            }
+            faces_since_snapshot = self._faces_since_snapshot
+            self._faces_since_snapshot = 0
+
+        path = os.path.join(directory, f"gallery-{self.dtype}-{header['face_id_watermark']}.snap")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            write_snapshot(path, header, arrays)
+        except Exception as e:
+            print(f"Error saving face gallery snapshot: {e}")
+            with self._lock:
+                self._faces_since_snapshot += faces_since_snapshot
+            return False
+        self.snapshot_created = header['created']
+
+        # A file still mapped by this process cannot be removed on Windows; it goes on a later save
+        for old_path in glob.glob(os.path.join(directory, f"gallery-{self.dtype}-*.snap")):
+            if os.path.abspath(old_path) != os.path.abspath(path):
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        return True
+
+    def refresh_snapshot(self):
+        #Run from the listener thread: replace a snapshot that is too old with a full reload,
+        #or rewrite it once enough faces have arrived since it was taken
+        if not SNAPSHOT_DIR or not self.loaded:
+            return
+        if (self.snapshot_created is not None
+                and time.time() - self.snapshot_created > SNAPSHOT_MAX_AGE_HOURS * 3600):
+            if self.load():
+                self.save_snapshot()
+        elif self._faces_since_snapshot >= SNAPSHOT_REFRESH:
+            self.save_snapshot()
+
+    def add(self, juv_id, embedding, face_id=None, date_added=None):
+        #Store one more face for a juvenile: a new juvenile gets a new search row (arrays grow
+        #geometrically), an existing one has its centroid row recomputed in place
+        #Returns False if the FACE_ID is already in the gallery
+        face = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(EMBEDDING_DIM)
+        with self._lock:
+            if face_id is not None:
+                if face_id in self._known_face_ids:
+                    return False
+                self._known_face_ids.add(face_id)
+                self.face_id_watermark = max(self.face_id_watermark, face_id)
+            self._faces_since_snapshot += 1
+            if date_added is not None and (self.date_watermark is None or date_added > self.date_watermark):
+                self.date_watermark = date_added
+
+            row = self._rows.get(juv_id)
+            if self.keeps_templates:
+                faces = self._templates.get(juv_id)
+                faces = face[None, :] if faces is None else np.vstack([faces, face])
+                self._templates[juv_id] = faces
+                centroid = faces.mean(axis=0)
+            elif row is None:
+                centroid = face
+            else:
+                # Running mean over the dequantized centroid; the faces themselves stay in the database
+                previous = dequantize(self._embeddings[row:row + 1], self._scales[row:row + 1])[0]
+                centroid = previous + (face - previous) / (self._counts[row] + 1)
+
+            stored, scale = quantize(centroid, self.dtype)
+            decoded = dequantize(stored, scale)[0]
+
+            if row is not None:
+                self._embeddings[row] = stored[0]
+                self._scales[row] = scale[0]
+                self._sq_norms[row] = decoded @ decoded
+                self._counts[row] += 1
+                if self.ann_index is not None:
+                    self.ann_index.update(row, decoded)
+                return True
+
+            if self._size == len(self._embeddings):
+                capacity = max(16, 2 * len(self._embeddings))
+                embeddings = np.empty((capacity, EMBEDDING_DIM), dtype=self._embeddings.dtype)
+                scales = np.empty(capacity, dtype=EMBEDDING_DTYPE)
+                sq_norms = np.empty(capacity, dtype=EMBEDDING_DTYPE)
+                counts = np.empty(capacity, dtype=np.int32)
+                juv_ids = np.empty(capacity, dtype=np.int64)
+                embeddings[:self._size] = self._embeddings[:self._size]
+                scales[:self._size] = self._scales[:self._size]
+                sq_norms[:self._size] = self._sq_norms[:self._size]
+                counts[:self._size] = self._counts[:self._size]
+                juv_ids[:self._size] = self._juv_ids[:self._size]
+                self._embeddings, self._scales, self._sq_norms = embeddings, scales, sq_norms
+                self._counts, self._juv_ids = counts, juv_ids
+
+            self._embeddings[self._size] = stored[0]
+            self._scales[self._size] = scale[0]
+            self._sq_norms[self._size] = decoded @ decoded
+            self._counts[self._size] = 1
+            self._juv_ids[self._size] = juv_id
+            self._rows[juv_id] = self._size
+            self._size += 1
+            if self.ann_index is not None:
+                self.ann_index.add(decoded)
+            return True
+
+    def template_count(self, juv_id):
+        row = self._rows.get(juv_id)
+        return 0 if row is None else int(self._counts[row])
+
+    def templates_for(self, juv_ids):
+        #{juv_id: (T, 128) float32 faces} from memory, or from FACIAL_DATA for quantized galleries
+        if self.keeps_templates:
+            return {juv_id: self._templates[juv_id] for juv_id in juv_ids if juv_id in self._templates}
+        return fetch_templates(juv_ids)
+
+    def all_faces(self):
+        #Every stored face as one (F, 128) matrix plus the JUV_ID owning each row
+        #Only float32 galleries keep the faces in memory
+        with self._lock:
+            templates = list(self._templates.items())
+        if not templates:
+            return np.empty((0, EMBEDDING_DIM), dtype=EMBEDDING_DTYPE), np.empty(0, dtype=np.int64)
+        embeddings = np.vstack([faces for _, faces in templates])
+        owners = np.repeat(np.array([juv_id for juv_id, _ in templates], dtype=np.int64),
+                           [len(faces) for _, faces in templates])
+        return embeddings, owners
+
+    def snapshot(self):
+        #Views of the live search rows (stored dtype), their scales, squared norms and JUV_IDs.
+        #Rows are only rewritten in place when a juvenile gains a face, so a concurrent reader
+        #sees at worst a stale centroid for that row
+        with self._lock:
+            size = self._size
+            return self._embeddings[:size], self._scales[:size], self._sq_norms[:size], self._juv_ids[:size]
+
+    def _products(self, embeddings, scales, probes):
+        #(rows, probes) dot products; quantized rows are upcast a chunk at a time so the
+        #float32 copy of the whole matrix is never materialised. The upcast dominates for
+        #float16 (see GALLERY_DTYPE); einsum with float32 accumulation or a float16 matmul
+        #measured no faster
+        if embeddings.dtype == EMBEDDING_DTYPE:
+            return embeddings @ probes.T
+
+        products = np.empty((len(embeddings), len(probes)), dtype=EMBEDDING_DTYPE)
+        for start in range(0, len(embeddings), QUANTIZED_CHUNK_ROWS):
+            chunk = embeddings[start:start + QUANTIZED_CHUNK_ROWS].astype(EMBEDDING_DTYPE)
+            products[start:start + len(chunk)] = chunk @ probes.T
+        if embeddings.dtype == np.int8:
+            products *= scales[:, None]
+        return products
+
+    def distances(self, embedding, nprobe=None):
+        #Euclidean distance from the probe to the per-juvenile centroids (same metric as
+        #face_recognition.face_distance). Scans every row, or only the ANN candidates when attached
+        embeddings, scales, sq_norms, juv_ids = self.snapshot()
+        probe = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(EMBEDDING_DIM)
+
+        index = self.ann_index
+        if index is not None:
+            try:
+                rows = index.candidates(probe, nprobe)
+                rows = rows[rows < len(juv_ids)]
+                if len(rows):
+                    embeddings, scales, sq_norms, juv_ids = embeddings[rows], scales[rows], sq_norms[rows], juv_ids[rows]
+            except Exception as e:
+                print(f"ANN lookup failed, falling back to exact scan: {e}")
+
+        sq_dist = sq_norms - 2.0 * self._products(embeddings, scales, probe[None, :])[:, 0] + probe @ probe
+        return np.sqrt(np.maximum(sq_dist, 0.0)), juv_ids
+
+    def search(self, embedding, k=TOP_K, nprobe=None):
+        #The k nearest juveniles as [(juv_id, distance), ...], closest first
+        #Centroids pick a shortlist of RERANK_CANDIDATES; each candidate then scores as its best
+        #stored face
+        self.ensure_loaded()
+        probe = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(EMBEDDING_DIM)
+        distances, juv_ids = self.distances(probe, nprobe)
+        n = len(distances)
+        if n == 0 or k <= 0:
+            return []
+
+        m = min(n, max(k, RERANK_CANDIDATES))
+        top = np.argpartition(distances, m - 1)[:m] if m < n else np.arange(n)
+        return self._rescore(probe, juv_ids[top], distances[top], k)
+
+    def search_batch(self, embeddings, k=TOP_K, chunk_size=128):
+        #search() for many probes at once (exact, no ANN): the centroid distances of a block of
+        #probes come from one matrix-matrix product; chunk_size bounds the (chunk, N) temporary
+        self.ensure_loaded()
+        probes = np.asarray(embeddings, dtype=EMBEDDING_DTYPE).reshape(-1, EMBEDDING_DIM)
+        gallery, scales, sq_norms, juv_ids = self.snapshot()
+        n = len(juv_ids)
+        if n == 0 or k <= 0:
+            return [[] for _ in range(len(probes))]
+
+        m = min(n, max(k, RERANK_CANDIDATES))
+        results = []
+        for start in range(0, len(probes), chunk_size):
+            block = probes[start:start + chunk_size]
+            sq_dist = (sq_norms[None, :] - 2.0 * self._products(gallery, scales, block).T
+                       + np.einsum('ij,ij->i', block, block)[:, None])
+            if m < n:
+                top = np.argpartition(sq_dist, m - 1, axis=1)[:, :m]
+            else:
+                top = np.broadcast_to(np.arange(n), (len(block), n))
+            top_dist = np.sqrt(np.maximum(np.take_along_axis(sq_dist, top, axis=1), 0.0))
+            for probe, rows, distances in zip(block, top, top_dist):
+                results.append(self._rescore(probe, juv_ids[rows], distances, k))
+        return results
+
+    def _rescore(self, probe, juv_ids, distances, k):
+        #Score shortlisted juveniles by their best stored face, in float32. The centroid only picks
+        #the shortlist: it is a synthetic mean, and a probe between two of a juvenile's faces can be
+        #close to it while no real face is. Only if the faces cannot be fetched at all (quantized
+        #gallery, database unreachable) are the coarse centroid distances reported instead
+        templates = self.templates_for([int(juv_id) for juv_id in juv_ids])
+        if not templates:
+            return sorted(((int(juv_id), float(distance)) for juv_id, distance in zip(juv_ids, distances)),
+                          key=lambda candidate: candidate[1])[:k]
+
+        candidates = []
+        for juv_id in juv_ids:
+            juv_id = int(juv_id)
+            faces = templates.get(juv_id)
+            if faces is None:
+                # Deleted from FACIAL_DATA since the gallery was loaded
+                continue
+            candidates.append((juv_id, float(np.min(np.linalg.norm(faces - probe, axis=1)))))
+
+        candidates.sort(key=lambda candidate: candidate[1])
+        return candidates[:k]
+
+    def nearest(self, embedding):
+        #Returns (juv_id, distance) of the closest juvenile, or (None, inf) if the gallery is empty
+        results = self.search(embedding, k=1)
+        if not results:
+            return None, float('inf')
+        return results[0]
+
+
+class GalleryListener(threading.Thread):
+    #Background LISTEN on the facial_data insert channel; appends each new face to the
+    #gallery as it is committed on any kiosk and catches up after every (re)connect
+
+    def __init__(self, gallery, poll_interval=5.0, retry_interval=10.0):
+        super().__init__(daemon=True)
+        self.gallery = gallery
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+        self.trigger_installed = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            # LISTEN needs a connection of its own for as long as the listener runs, not a pooled one
+            conn = open_db_connection()
+            if not conn:
+                self._stop_event.wait(self.retry_interval)
+                continue
+
+            try:
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                if self.trigger_installed is None:
+                    self.check_trigger(cursor)
+                cursor.close()
+
+                # LISTEN first, then catch up, so nothing committed in between is lost
+                self.gallery.catch_up(conn)
+                self.gallery.refresh_snapshot()
+
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        if not self.trigger_installed:
+                            # Nothing will NOTIFY us; poll for new rows instead
+                            self.gallery.catch_up(conn)
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.handle_notify(conn, conn.notifies.pop(0))
+
+            except Exception as e:
+                print(f"Face gallery listener disconnected: {e}")
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+            self._stop_event.wait(self.retry_interval)
+
+    def check_trigger(self, cursor):
+        #Say once if nothing will NOTIFY this listener, e.g. a database created before the
+        #trigger existed; the listener then falls back to a catch-up every poll_interval
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s AND NOT tgisinternal", (NOTIFY_TRIGGER,))
+        self.trigger_installed = cursor.fetchone() is not None
+        if not self.trigger_installed:
+            print(f"Warning: trigger {NOTIFY_TRIGGER} is not installed; faces enrolled on other kiosks are "
+                  f"polled every {self.poll_interval:g} s instead. Run 'python EmbeddingUtils.py' to install it.")
+
+    def handle_notify(self, conn, notify):
+        try:
+            payload = json.loads(notify.payload)
+            face_id = payload['face_id']
+        except (ValueError, KeyError) as e:
+            print(f"Ignoring malformed face gallery notification: {e}")
+            return
+
+        cursor = conn.cursor()
+        FACE_BY_ID.execute(cursor, (face_id,))
+        result = cursor.fetchone()
+        cursor.close()
+
+        if result is None:
+            return
+
+        juv_id, stored_embedding, date_added = result
+        if self.gallery.add(juv_id, embedding_from_bytes(stored_embedding), face_id, date_added):
+            print(f"Face gallery received new embedding for JUV_ID {juv_id}")
+            self.gallery.refresh_snapshot()
+
+
+_gallery = None
+_gallery_listener = None
+_gallery_lock = threading.Lock()
+
+
+def get_face_gallery():
+    #Process-wide gallery shared by recognition and the enrollment duplicate check
+    #The first call also starts the listener that keeps it in sync with other kiosks
+    global _gallery, _gallery_listener
+    with _gallery_lock:
+        if _gallery is None:
+            _gallery = FaceGallery()
+            _gallery_listener = GalleryListener(_gallery)
+            _gallery_listener.start()
+        return _gallery
+
+
+def measure_quantization_error(gallery, dtype, probes=200, seed=0):
+    #Compare a quantized copy of a float32 gallery against it: (max and mean absolute error of
+    #the coarse centroid distances, fraction of the exact RERANK_CANDIDATES shortlist kept)
+    embeddings, _, sq_norms, _ = gallery.snapshot()
+    n = len(embeddings)
+    if n == 0:
+        return 0.0, 0.0, 1.0
+
+    stored, scales = quantize(embeddings, dtype)
+    decoded = dequantize(stored, scales)
+    coarse_sq_norms = np.einsum('ij,ij->i', decoded, decoded)
+
+    rng = np.random.default_rng(seed)
+    m = min(n, RERANK_CANDIDATES)
+    max_error, total_error, kept = 0.0, 0.0, 0
+    sample = embeddings[rng.choice(n, size=min(n, probes), replace=False)]
+    for probe in sample:
+        exact = np.sqrt(np.maximum(sq_norms - 2.0 * (embeddings @ probe) + probe @ probe, 0.0))
+        coarse = np.sqrt(np.maximum(coarse_sq_norms - 2.0 * gallery._products(stored, scales, probe[None, :])[:, 0]
+                                    + probe @ probe, 0.0))
+        error = np.abs(coarse - exact)
+        max_error = max(max_error, float(error.max()))
+        total_error += float(error.mean())
+        if m < n:
+            kept += len(np.intersect1d(np.argpartition(exact, m - 1)[:m], np.argpartition(coarse, m - 1)[:m]))
+        else:
+            kept += m
+    return max_error, total_error / len(sample), kept / (m * len(sample))
+
+
+def measure_scan_time(gallery, dtype, repeats=20, seed=0):
+    #Milliseconds for one probe's coarse scan over the gallery's rows stored as dtype
+    embeddings, _, _, _ = gallery.snapshot()
+    stored, scales = quantize(embeddings, dtype)
+    probe = np.random.default_rng(seed).normal(0, 0.1, (1, EMBEDDING_DIM)).astype(EMBEDDING_DTYPE)
+    gallery._products(stored, scales, probe)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        gallery._products(stored, scales, probe)
+    return (time.perf_counter() - started) / repeats * 1000
+
+
+if __name__ == "__main__":
+    # Report what FACE_GALLERY_DTYPE=float16 / int8 would cost on this site's FACIAL_DATA
+    gallery = FaceGallery(dtype='float32')
+    if gallery.load(attach_index=False) and len(gallery):
+        print(f"float32: scan {measure_scan_time(gallery, 'float32'):.2f} ms")
+        for dtype in GALLERY_DTYPES[1:]:
+            max_error, mean_error, recall = measure_quantization_error(gallery, dtype)
+            print(f"{dtype}: coarse distance error max {max_error:.5f} / mean {mean_error:.5f}, "
+                  f"shortlist recall {recall:.4f}, scan {measure_scan_time(gallery, dtype):.2f} ms")
@@ -0,0 +1,171 @@
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from EmbeddingUtils import EMBEDDING_DIM, EMBEDDING_DTYPE
+
+load_dotenv()
+
+# Approximate nearest-neighbour (IVF) settings, overridable from .env
+# FACE_ANN_ENABLED   - 1 to use the index once the gallery is large enough
+# FACE_ANN_MIN_SIZE  - below this many gallery rows the exact scan is used
+# FACE_ANN_NLIST     - number of k-means cells (0 = about 4 * sqrt(N))
+# FACE_ANN_NPROBE    - cells visited per query; higher = better recall, slower
+# FACE_ANN_INDEX_PATH - where the trained index is persisted
+ANN_ENABLED = os.getenv("FACE_ANN_ENABLED", "0") == "1"
+ANN_MIN_SIZE = int(os.getenv("FACE_ANN_MIN_SIZE", "100000"))
+ANN_NLIST = int(os.getenv("FACE_ANN_NLIST", "0"))
+ANN_NPROBE = int(os.getenv("FACE_ANN_NPROBE", "8"))
+ANN_INDEX_PATH = os.getenv("FACE_ANN_INDEX_PATH", "cache/face_ann_index.npz")
+
+INDEX_VERSION = 2
+
+# Persisted assignments are reused only if most of the gallery is still covered by them
+MIN_REUSE_FRACTION = 0.5
+
+
+class IVFIndex:
+    #Inverted-file index over the gallery matrix: rows are bucketed by their nearest k-means
+    #centroid and a query only scans the nprobe closest buckets. Candidate distances are computed
+    #exactly against the gallery rows, so only recall (never the reported distance) is approximate
+
+    def __init__(self, centroids, assignments, nprobe=ANN_NPROBE):
+        self.centroids = np.ascontiguousarray(centroids, dtype=EMBEDDING_DTYPE)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._order = None
+        self._offsets = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.assignments)
+
+    @classmethod
+    def train(cls, embeddings, nlist=ANN_NLIST, nprobe=ANN_NPROBE, iterations=10, sample_size=None):
+        #Train the coarse quantizer (k-means on a sample of the gallery) and assign every row
+        n = len(embeddings)
+        if nlist <= 0:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(0)
+        sample_size = min(n, sample_size or 32 * nlist)
+        sample = np.asarray(embeddings[rng.choice(n, size=sample_size, replace=False)], dtype=EMBEDDING_DTYPE)
+
+        index = cls(sample[rng.choice(sample_size, size=nlist, replace=False)], np.empty(0, dtype=np.int32), nprobe)
+        for _ in range(iterations):
+            labels = index.assign(sample)
+            counts = np.bincount(labels, minlength=nlist)
+            sums = np.zeros((nlist, EMBEDDING_DIM), dtype=np.float64)
+            np.add.at(sums, labels, sample)
+            # Empty cells keep their previous centroid
+            filled = counts > 0
+            centroids = index.centroids.copy()
+            centroids[filled] = sums[filled] / counts[filled, None]
+            index = cls(centroids, index.assignments, nprobe)
+
+        index.assignments = index.assign(embeddings)
+        return index
+
+    def assign(self, embeddings, chunk_size=65536):
+        #Nearest centroid for each row, in chunks to bound the temporary (chunk, nlist) matrix
+        result = np.empty(len(embeddings), dtype=np.int32)
+        for start in range(0, len(embeddings), chunk_size):
+            chunk = np.asarray(embeddings[start:start + chunk_size], dtype=EMBEDDING_DTYPE)
+            sq_dist = self.centroid_sq_norms - 2.0 * (chunk @ self.centroids.T)
+            result[start:start + len(chunk)] = np.argmin(sq_dist, axis=1)
+        return result
+
+    def add(self, embeddings):
+        #Assign rows appended to the gallery; they keep the gallery's row order
+        new_assignments = self.assign(np.atleast_2d(embeddings))
+        with self._lock:
+            self.assignments = np.concatenate([self.assignments, new_assignments])
+            self._order = None
+
+    def update(self, row, embedding):
+        #Reassign a row whose gallery vector changed (a juvenile's centroid moved)
+        cell = self.assign(np.atleast_2d(embedding))[0]
+        with self._lock:
+            if self.assignments[row] != cell:
+                self.assignments[row] = cell
+                self._order = None
+
+    def _inverted_lists(self):
+        #Row ids grouped by cell (CSR layout), rebuilt lazily after adds
+        with self._lock:
+            if self._order is None:
+                self._order = np.argsort(self.assignments, kind='stable').astype(np.int64)
+                counts = np.bincount(self.assignments, minlength=self.nlist)
+                self._offsets = np.concatenate([[0], np.cumsum(counts)])
+            return self._order, self._offsets
+
+    def candidates(self, probe, nprobe=None):
+        #Gallery row ids in the nprobe cells closest to the probe
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        sq_dist = self.centroid_sq_norms - 2.0 * (self.centroids @ probe)
+        cells = np.argpartition(sq_dist, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+        order, offsets = self._inverted_lists()
+        return np.concatenate([order[offsets[c]:offsets[c + 1]] for c in cells])
+
+    def save(self, path, juv_ids):
+        #Persist centroids and per-row assignments keyed by JUV_ID (sorted for lookup on load)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        juv_ids = np.asarray(juv_ids, dtype=np.int64)
+        sort = np.argsort(juv_ids, kind='stable')
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, version=INDEX_VERSION, centroids=self.centroids,
+                 juv_ids=juv_ids[sort], assignments=self.assignments[sort])
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, embeddings, juv_ids, nprobe=ANN_NPROBE):
+        #Rebuild an index aligned with the current gallery rows from a persisted file
+        #Returns None if the file is missing, incompatible or too stale to be worth reusing
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            if int(data['version']) != INDEX_VERSION or data['centroids'].shape[1] != EMBEDDING_DIM:
+                return None
+            centroids = data['centroids']
+            saved_ids = data['juv_ids']
+            saved_assignments = data['assignments']
+
+        juv_ids = np.asarray(juv_ids, dtype=np.int64)
+        if len(saved_ids) == 0:
+            return None
+        pos = np.clip(np.searchsorted(saved_ids, juv_ids), 0, len(saved_ids) - 1)
+        found = saved_ids[pos] == juv_ids
+        if len(juv_ids) and found.mean() < MIN_REUSE_FRACTION:
+            return None
+
+        index = cls(centroids, np.empty(len(juv_ids), dtype=np.int32), nprobe)
+        index.assignments[found] = saved_assignments[pos[found]]
+        if not found.all():
+            index.assignments[~found] = index.assign(embeddings[~found])
+        return index
+
+
+if __name__ == "__main__":
+    # Build (or rebuild) the persisted index from the current FACIAL_DATA embeddings
+    from FaceGallery import FaceGallery, dequantize
+
+    gallery = FaceGallery()
+    if gallery.load(attach_index=False):
+        embeddings, scales, _, juv_ids = gallery.snapshot()
+        if len(embeddings):
+            index = IVFIndex.train(dequantize(embeddings, scales))
+            index.save(ANN_INDEX_PATH, juv_ids)
+            print(f"ANN index with {index.nlist} cells over {len(index)} juveniles saved to {ANN_INDEX_PATH}")
+        else:
+            print("No facial data in database")
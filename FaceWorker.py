@@ -0,0 +1,239 @@
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+# Face encoding and matching off the GUI thread:
+#   job = FaceJob(frame, matcher)
+#   job.signals.finished.connect(...)
+#   start_face_job(job)  ...  job.cancel()
+# dlib holds the GIL while encoding, so the encoding itself runs in a separate process
+# (same approach as BatchIdentify) and only the waiting and matching happen on a pool thread
+# warm_up_encoder() (called after login) loads the models in that process before the first scan
+
+# Context kept around a known face box when only the crop is encoded, as a fraction of the box size
+CROP_MARGIN = 0.25
+
+# Known boxes smaller than this (pixels) are not trusted and the frame is searched instead
+MIN_LOCATION_SIZE = 20
+
+# Side (pixels) of the blank image encoded once to warm the encoder process up
+WARM_UP_SIZE = 150
+
+_encoder_pool = None
+_encoder_lock = threading.Lock()
+_warm_up = None
+_encoder_ready = threading.Event()
+
+
+def get_encoder_pool():
+    #Single encoder process shared by every scan window; dlib's models load once in it
+    global _encoder_pool
+    with _encoder_lock:
+        if _encoder_pool is None:
+            _encoder_pool = ProcessPoolExecutor(max_workers=1)
+        return _encoder_pool
+
+
+def reset_encoder_pool():
+    global _encoder_pool, _warm_up
+    with _encoder_lock:
+        pool, _encoder_pool = _encoder_pool, None
+        _warm_up = None
+        _encoder_ready.clear()
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def warm_up_models():
+    #Runs in the encoder process: import face_recognition (which loads dlib's models) and put one
+    #blank image through the detector and the encoder so the first real scan pays none of it
+    import face_recognition
+
+    blank = np.zeros((WARM_UP_SIZE, WARM_UP_SIZE, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    face_recognition.face_encodings(blank, known_face_locations=[(0, WARM_UP_SIZE, WARM_UP_SIZE, 0)])
+
+
+def warm_up_encoder():
+    #Start the encoder process and load the models in it in the background, once; returns the future
+    #Scans submitted meanwhile simply queue behind it on the single encoder process
+    global _warm_up
+    pool = get_encoder_pool()
+    with _encoder_lock:
+        if _warm_up is not None:
+            return _warm_up
+        started = time.perf_counter()
+        _warm_up = pool.submit(warm_up_models)
+
+    def report(future):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Face recognition warm-up failed: {e}")
+            return
+        _encoder_ready.set()
+        print(f"Face recognition models ready ({time.perf_counter() - started:.1f} s)")
+
+    _warm_up.add_done_callback(report)
+    return _warm_up
+
+
+def encoder_ready():
+    #True once the encoder process has its models loaded
+    return _encoder_ready.is_set()
+
+
+def face_location(face_box, frame_shape):
+    #Detector box (x, y, w, h) -> dlib (top, right, bottom, left) clipped to the frame, or None
+    if face_box is None:
+        return None
+    x, y, w, h = (int(v) for v in face_box)
+    top, left = max(0, y), max(0, x)
+    bottom, right = min(frame_shape[0], y + h), min(frame_shape[1], x + w)
+    if bottom - top < MIN_LOCATION_SIZE or right - left < MIN_LOCATION_SIZE:
+        return None
+    return top, right, bottom, left
+
+
+def encode_face(rgb_frame, location=None):
+    #Runs in the encoder process: 128-d encoding of the face at location, or of the first face
+    #dlib finds in the frame when no location is given or encoding the crop fails; None if none
+    import face_recognition
+
+    if location is not None:
+        try:
+            # Encode only a crop around the known face instead of running dlib's HOG detector
+            # over the whole frame again
+            top, right, bottom, left = location
+            margin_y = int((bottom - top) * CROP_MARGIN)
+            margin_x = int((right - left) * CROP_MARGIN)
+            crop_top, crop_left = max(0, top - margin_y), max(0, left - margin_x)
+            crop = np.ascontiguousarray(rgb_frame[crop_top:min(rgb_frame.shape[0], bottom + margin_y),
+                                                  crop_left:min(rgb_frame.shape[1], right + margin_x)])
+            encodings = face_recognition.face_encodings(
+                crop, known_face_locations=[(top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)])
+            if len(encodings) > 0:
+                return np.asarray(encodings[0], dtype=np.float32)
+        except Exception as e:
+            print(f"Encoding the known face box failed, searching the whole frame: {e}")
+
+    encodings = face_recognition.face_encodings(rgb_frame)
+    if len(encodings) == 0:
+        return None
+    return np.asarray(encodings[0], dtype=np.float32)
+
+
+def default_matcher(embedding):
+    from FaceGallery import get_face_gallery
+    return get_face_gallery().search(embedding)
+
+
+class FaceJobSignals(QObject):
+    progress = pyqtSignal(str)
+    # embedding (None if no face could be encoded), candidates [(juv_id, distance), ...], JPEG bytes
+    finished = pyqtSignal(object, list, object)
+    failed = pyqtSignal(str)
+
+
+class FaceJob(QRunnable):
+    #Encode one BGR frame, match it with matcher(embedding) and JPEG-encode it for storage
+    #face_box is the (x, y, w, h) the preview detector already found, so dlib need not search again
+    #alternatives are further (frame, face_box) pairs, best first, encoded only if no face could be
+    #encoded in the frames before them
+    #Results are delivered through signals on the GUI thread; a cancelled job emits nothing
+
+    def __init__(self, frame, matcher=default_matcher, face_box=None, alternatives=()):
+        super().__init__()
+        self.frame = frame
+        self.matcher = matcher
+        self.face_box = face_box
+        self.alternatives = list(alternatives)
+        self.signals = FaceJobSignals()
+        self._cancelled = threading.Event()
+        # Set when the encode finishes or the job is cancelled, whichever comes first
+        self._wake = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._wake.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        try:
+            if encoder_ready():
+                self.signals.progress.emit("Processing face... Please wait.")
+            else:
+                self.signals.progress.emit("Loading face recognition models... Please wait.")
+            embedding = None
+            for frame, face_box in [(self.frame, self.face_box)] + self.alternatives:
+                if frame is None or frame.size == 0:
+                    print("Invalid frame for recognition")
+                    continue
+                if frame.dtype != np.uint8:
+                    frame = frame.astype(np.uint8)
+                embedding = self._encode(frame, face_box)
+                if self.cancelled:
+                    return
+                if embedding is not None:
+                    break
+                print("No face could be encoded in this frame")
+
+            if embedding is None:
+                self.signals.finished.emit(None, [], None)
+                return
+
+            self.signals.progress.emit("Matching face...")
+            candidates = list(self.matcher(embedding)) if self.matcher else []
+
+            is_success, buffer = cv2.imencode(".jpg", frame)
+            image_bytes = buffer.tobytes() if is_success else None
+
+            if not self.cancelled:
+                self.signals.finished.emit(embedding, candidates, image_bytes)
+
+        except CancelledError:
+            return
+        except BrokenProcessPool as e:
+            # The encoder process died (e.g. out of memory); the next job starts a new one
+            print(f"Face encoder process failed: {e}")
+            reset_encoder_pool()
+            if not self.cancelled:
+                self.signals.failed.emit("Face encoder stopped unexpectedly. Please try again.")
+        except Exception as e:
+            print(f"Error during face recognition: {e}")
+            import traceback
+            traceback.print_exc()
+            if not self.cancelled:
+                self.signals.failed.emit(str(e))
+
+    def _encode(self, frame, face_box):
+        #Embedding of the face in one frame from the encoder process; None if there is none
+        #or the job was cancelled while waiting
+        # Convert BGR to RGB (OpenCV uses BGR, face_recognition needs RGB)
+        rgb_frame = np.ascontiguousarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+        self._wake.clear()
+        if self.cancelled:
+            return None
+        future = get_encoder_pool().submit(encode_face, rgb_frame, face_location(face_box, frame.shape))
+        future.add_done_callback(lambda _: self._wake.set())
+        self._wake.wait()
+        if self.cancelled:
+            # A running encode cannot be interrupted; its result is simply dropped
+            future.cancel()
+            return None
+        embedding = future.result()
+        _encoder_ready.set()
+        return embedding
+
+
+def start_face_job(job):
+    QThreadPool.globalInstance().start(job)
+    return job
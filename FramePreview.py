@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+from PyQt5.QtCore import Qt, QRectF, QEvent
+from PyQt5.QtGui import QImage, QPainter, QPen
+from PyQt5.QtWidgets import QWidget
+
+# QImage.Format_RGB32 is B, G, R, X in memory on little-endian (x86) machines, so OpenCV's BGR2BGRA
+# output is wrapped as-is; it is also the format Qt scales and draws fastest
+PREVIEW_FORMAT = QImage.Format_RGB32
+
+
+class FramePreview(QWidget):
+    #Paints camera frames through one preallocated buffer: the centred square crop is converted
+    #into it in a single cvtColor call (no per-frame allocation), a QImage wraps the buffer
+    #without copying, and QPainter does the one scale to the widget size while drawing.
+    #Replaces the crop/cvtColor/QImage/QPixmap/scaled() chain of copies on every frame
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Every pixel is painted, so Qt need not clear the background first
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self._buffer = None
+        self._image = None
+        self._crop = None
+        self._frame_shape = None
+        self._face_box = None
+        self._box_pen = QPen(Qt.blue, 2)
+
+    @classmethod
+    def attach(cls, label):
+        #Preview laid over a .ui placeholder label, inside its border so the label's styling stays;
+        #it follows the label when the label is resized
+        preview = cls(label)
+        preview.setGeometry(label.contentsRect())
+        label.installEventFilter(preview)
+        preview.show()
+        return preview
+
+    def eventFilter(self, watched, event):
+        if watched is self.parent() and event.type() == QEvent.Resize:
+            self.setGeometry(watched.contentsRect())
+        return False
+
+    def set_frame(self, frame, face_box=None):
+        #Show a BGR frame, with the detected face box (full-frame coordinates) drawn on top
+        if frame.shape != self._frame_shape:
+            # Crop to square, centered; buffer and image are only rebuilt when the camera size changes
+            h, w = frame.shape[:2]
+            side = min(w, h)
+            self._crop = ((h - side) // 2, (w - side) // 2, side)
+            self._buffer = np.empty((side, side, 4), dtype=np.uint8)
+            self._image = QImage(self._buffer.data, side, side, self._buffer.strides[0], PREVIEW_FORMAT)
+            self._frame_shape = frame.shape
+
+        top, left, side = self._crop
+        cv2.cvtColor(frame[top:top + side, left:left + side], cv2.COLOR_BGR2BGRA, dst=self._buffer)
+        self._face_box = face_box
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        target = self.rect()
+        if self._image is None:
+            painter.fillRect(target, Qt.white)
+            return
+
+        painter.drawImage(target, self._image)
+
+        if self._face_box is not None:
+            top, left, side = self._crop
+            x, y, w, h = self._face_box
+            scale_x = target.width() / side
+            scale_y = target.height() / side
+            painter.setPen(self._box_pen)
+            painter.drawRect(QRectF((x - left) * scale_x, (y - top) * scale_y, w * scale_x, h * scale_y))
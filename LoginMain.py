@@ -8,7 +8,9 @@ from PyQt5.QtWidgets import (QWidget, QApplication, QComboBox, QLineEdit, QMessa
                              QDialogButtonBox, QDialog, QStyle, QDateEdit)
 from PyQt5.QtWidgets import *
 from Db_connection import get_db_connection
+from DbWorker import DbJob, start_db_job, set_loading
 import LoggedUser
+from Repository import authenticate_user
 
 
 class LogIn(QWidget):
@@ -23,6 +25,9 @@ class LogIn(QWidget):
         self.forgot_password_widget = None
         self.create_account_widget = None
 
+        # Login query running on a worker, if any
+        self.login_job = None
+
         #add logo
         self.loginlogo_widget = QWidget(self)
         uic.loadUi("ui/login-logo.ui", self.loginlogo_widget)
@@ -91,13 +96,36 @@ class LogIn(QWidget):
             QMessageBox.warning(self, "Input Error", "Please enter your password.")
             return
 
-        #authenticate user
-        user_data = self.authenticate_user(username, password)
+        #authenticate user on a worker so the window stays responsive on a slow link
+        if self.login_job is not None:
+            return
+        job = DbJob(authenticate_user, username, password)
+        job.signals.finished.connect(lambda user_data, job=job: self.handle_login_result(job, user_data))
+        job.signals.failed.connect(lambda message, job=job: self.handle_login_error(job, message))
+        self.login_job = start_db_job(job)
+        self.set_login_busy(True)
+
+    def set_login_busy(self, busy):
+        set_loading(self, busy)
+        login_btn = self.login_account_widget.findChild(QPushButton, "login_btn")
+        if login_btn:
+            login_btn.setEnabled(not busy)
+
+    def handle_login_result(self, job, user_data):
+        if job is not self.login_job:
+            return
+        self.login_job = None
+        self.set_login_busy(False)
+
         if user_data:
             # Store the logged-in user_id in class variable
             LoggedUser.current_logged_in_user_id = user_data['user_id']
             print(f"LOGGED IN: User ID = {LoggedUser.current_logged_in_user_id}, Username = {user_data['username']}")
             
+            # Load the face recognition models in the background while the menu opens
+            from FaceWorker import warm_up_encoder
+            warm_up_encoder()
+
             self.open_menu_window()
         else:
             QMessageBox.warning(
@@ -106,43 +134,16 @@ class LogIn(QWidget):
                 "Invalid username or password.\n\nPlease try again."
             )
             #clear password field for security
-            pw_line.clear()
-
-    def authenticate_user(self, username, password):
-        conn = get_db_connection()
-        if not conn:
-            QMessageBox.critical(self, "Database Error", "Failed to connect to the database.")
-            return None
-
-        try:
-            cur = conn.cursor()
-            query = """
-                SELECT USER_ID, USER_USERNAME, USER_ROLE, ADMIN_ID 
-                FROM USERS 
-                WHERE USER_USERNAME = %s 
-                AND USER_PASSWORD = crypt(%s, USER_PASSWORD)
-            """
-            cur.execute(query, (username, password))
-            user = cur.fetchone()
-            cur.close()
-
-            if user:
-                user_data = {
-                    'user_id': user[0],
-                    'username': user[1],
-                    'role': user[2],
-                    'admin_id': user[3]
-                }
-                return user_data
-            else:
-                return None
+            pw_line = self.login_account_widget.findChild(QLineEdit, "pw_line")
+            if pw_line:
+                pw_line.clear()
 
-        except Exception as e:
-            QMessageBox.critical(self, "Database Error", f"An error occurred during login:\n{e}")
-            return None
-        finally:
-            if conn:
-                conn.close()
+    def handle_login_error(self, job, message):
+        if job is not self.login_job:
+            return
+        self.login_job = None
+        self.set_login_busy(False)
+        QMessageBox.critical(self, "Database Error", f"An error occurred during login:\n{message}")
 
     def open_menu_window(self):
         #Open the MenuWindow after successful login
@@ -1,14 +1,15 @@
 import sys
-import cv2
-import psycopg2
 import numpy as np
-from scipy.spatial.distance import cosine
 from PyQt5 import uic, Qt
 from PyQt5.QtCore import QEvent, pyqtSignal, QTimer, QThread, Qt
-from PyQt5.QtGui import QFontDatabase, QImage, QPixmap, QPainter
+from PyQt5.QtGui import QFontDatabase
 from PyQt5.QtWidgets import (QWidget, QApplication, QComboBox, QLineEdit, QMessageBox, QPushButton, QLabel,
                              QDialogButtonBox, QDialog, QStyle, QMainWindow, QStackedWidget, QVBoxLayout)
-from Db_connection import get_db_connection
+from FaceGallery import get_face_gallery, MATCH_THRESHOLD
+from CameraCapture import CameraThread
+from FramePreview import FramePreview
+from FaceDetection import FaceDetector, find_centered_face
+from FaceWorker import FaceJob, start_face_job
 
 
 class SystemMenu(QMainWindow):
@@ -50,6 +51,9 @@ class SystemMenu(QMainWindow):
         # DON'T create facescan yet - create it only when needed
         self.facescan = None
 
+        # Start restoring the face gallery in the background so the first scan does not wait for it
+        get_face_gallery()
+
     def go_dashboardmenu(self):
         from DashboardMenu import DbMenuWindow as DbMenuMainWindow
         self.main_window = DbMenuMainWindow()
@@ -74,8 +78,9 @@ class SystemMenu(QMainWindow):
 
     def open_add_offense_window(self, juv_id):
         #Open the add offense window for existing juvenile
+        #The matched scan goes along so it can be kept as another face template
         from AddOffense import AddOffenseWindow
-        self.main_window = AddOffenseWindow(juv_id)
+        self.main_window = AddOffenseWindow(juv_id, self.facescan.probe_embedding, self.facescan.probe_image)
 
         self.main_window.show()
         self.close()
@@ -137,248 +142,159 @@ class FaceScan(QWidget):
         self.layout.addWidget(self.video_label)
 
         self.face_label = self.findChild(QLabel, "face_label")
+        self.preview = FramePreview.attach(self.face_label) if self.face_label else None
         
         # Find the existing status label from UI
         self.status_label = self.findChild(QLabel, "label")
 
-        # Load face detector (Haar cascade for simplicity)
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # Configured detector backend on a downscaled frame every few frames (see FaceDetection.py)
+        self.face_detector = FaceDetector()
 
         # Initialize variables but DON'T start camera yet
-        self.cap = None
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_frame)
+        # Frames are read on a capture thread; update_frame runs whenever a new one is ready
+        self.camera = None
         
         self.face_detected = False
+        
+        # Encoding/matching job of the current scan, run off the GUI thread
+        self.recognition_job = None
+        
+        # Shortlist [(juv_id, distance), ...] from the last recognition, closest first
+        self.candidates = []
+        
+        # Last scanned face (embedding array + JPEG bytes), kept as a new template on a confirmed match
+        self.probe_embedding = None
+        self.probe_image = None
 
     def start_camera(self):
-        if self.cap is not None and self.cap.isOpened():
+        if self.camera is not None and self.camera.isRunning():
             print("Camera already running")
             return  # Camera already running
-        
-        # Release any existing camera first
-        if self.cap is not None:
-            self.cap.release()
-            self.cap = None
-        
-        # Prioritize using webcam for face scan if plugged in
-        camera_indices = [1, 2, 0]
-        for index in camera_indices:
-            print(f"Trying camera index {index}...")
-            cap = cv2.VideoCapture(index, cv2.CAP_DSHOW)
-            if not cap.isOpened():
-                cap = cv2.VideoCapture(index)
-            if cap.isOpened():
-                ret, test_frame = cap.read()
-                if ret and test_frame is not None:
-                    print(f"Camera index {index} is working. Using it.")
-                    self.cap = cap
-                    break
-                else:
-                    cap.release()
-                    print(f"Camera index {index} opened but failed to read frame. Skipping.")
-            else:
-                print(f"Failed to open camera index {index}.")
-
-        if self.cap is None:
-            QMessageBox.warning(self, "Camera Error", "No working camera found. Check connections and permissions.")
-            return
 
-        # Set camera properties
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        self.cap.set(cv2.CAP_PROP_FPS, 30)
-
-        # Start timer for video feed
-        self.timer.start(30)
+        # Camera probing and reads happen on the capture thread, off the GUI thread
+        self.face_detector.reset()
+        self.camera = CameraThread(self)
+        self.camera.frame_ready.connect(self.update_frame)
+        self.camera.camera_failed.connect(self.handle_camera_error)
+        self.camera.start()
         
         if self.status_label:
             self.status_label.setText("Position your face at the center for face scan")
 
     def stop_camera(self):
         print("Stopping camera...")
-        if self.timer.isActive():
-            self.timer.stop()
-        
-        if self.cap is not None:
-            self.cap.release()
-            self.cap = None
-        
-        print("Camera stopped and released")
+        if self.camera is not None:
+            self.camera.frame_ready.disconnect(self.update_frame)
+            self.camera.stop()
+            self.camera = None
+            self.face_detector.report_latency()
+
+    def handle_camera_error(self, message):
+        self.stop_camera()
+        QMessageBox.warning(self, "Camera Error", message)
 
     def update_frame(self):
-        if self.cap is None or not self.cap.isOpened():
+        if self.camera is None:
             return
-            
-        ret, frame = self.cap.read()
-        if not ret or frame is None:
-            print("Failed to read frame")
-            return
-        
-        # Validate frame
-        if frame.size == 0:
-            print("Empty frame received")
+
+        # Always the newest frame; any frames read since the last call are skipped
+        frame = self.camera.take_frame()
+        if frame is None:
             return
         
         #Ensure frame is contiguous in memory
         frame = np.ascontiguousarray(frame)
 
-        # Convert to grayscale for detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
         # Detect faces
-        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        faces = self.face_detector.detect(frame)
 
         # Check if a face is in the center
-        frame_center_x, frame_center_y = frame.shape[1] // 2, frame.shape[0] // 2
-        tolerance = 0.2  # 20% tolerance
-        face_in_center = False
-        for (x, y, w, h) in faces:
-            face_center_x = x + w // 2
-            face_center_y = y + h // 2
-            if (abs(face_center_x - frame_center_x) < tolerance * frame_center_x and
-                    abs(face_center_y - frame_center_y) < tolerance * frame_center_y):
-                face_in_center = True
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
-                break
+        face_box = find_centered_face(faces, frame.shape)
+        face_in_center = face_box is not None
 
         # Recognition logic
         if face_in_center:
             if not self.face_detected:
                 self.face_detected = True
-                # Perform recognition
-                match_found, juv_id = self.recognize_face(frame)
-                
-                # IMPORTANT: Stop camera before emitting signal
-                self.stop_camera()
-                
-                if match_found:
-                    if self.status_label:
-                        self.status_label.setText("Biometric match detected. Adding new offense to profile...")
-                    QTimer.singleShot(2000, lambda: self.recognition_completed.emit(True, juv_id))
-                else:
-                    if self.status_label:
-                        self.status_label.setText("No biometric match detected. Proceeding to enrollment...")
-                    QTimer.singleShot(2000, lambda: self.recognition_completed.emit(False, None))
-                return  # Stop processing after recognition
+                # Perform recognition on a worker; the preview keeps running until the result arrives
+                self.recognize_face(frame, face_box)
         else:
-            if self.face_detected:
+            if self.face_detected and self.recognition_job is None:
                 self.face_detected = False
                 if self.status_label:
                     self.status_label.setText("Position your face at the center for face scan")
 
-        # Crop to square, centered
-        h, w, ch = frame.shape
-        if w > h:
-            start_x = (w - h) // 2
-            cropped = frame[:, start_x:start_x + h]
+        # Scaled and painted straight from the frame buffer, box drawn on top (see FramePreview.py)
+        if self.preview:
+            self.preview.set_frame(frame, face_box)
+
+    def recognize_face(self, frame, face_box=None):
+        #Encode and match the frame on a worker; the result arrives in handle_recognition_result
+        #The detected box is reused so dlib does not search the whole frame for the face again
+        if self.status_label:
+            self.status_label.setText("Processing face recognition...")
+
+        job = FaceJob(frame, face_box=face_box)
+        if self.status_label:
+            job.signals.progress.connect(self.status_label.setText)
+        job.signals.finished.connect(
+            lambda embedding, candidates, image, job=job: self.handle_recognition_result(job, embedding, candidates, image))
+        # A failed recognition is treated as no match, as before
+        job.signals.failed.connect(lambda message, job=job: self.handle_recognition_result(job, None, [], None))
+        self.recognition_job = start_face_job(job)
+
+    def handle_recognition_result(self, job, embedding, candidates, image):
+        # Ignore a result that arrives after the scan was cancelled or restarted
+        if job is not self.recognition_job:
+            return
+        self.recognition_job = None
+
+        match_found, juv_id = False, None
+        if embedding is None:
+            print("No face detected during recognition")
         else:
-            start_y = (h - w) // 2
-            cropped = frame[start_y:start_y + w, :]
-
-        cropped = cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB)
-        h_c, w_c, ch_c = cropped.shape
-        qt_image = QImage(cropped.data, w_c, h_c, ch_c * w_c, QImage.Format_RGB888)
-        if self.face_label:
-            self.face_label.setPixmap(QPixmap.fromImage(qt_image).scaled(
-                self.face_label.width(), self.face_label.height()
-            ))
-
-    def recognize_face(self, frame):
-        try:
-            import face_recognition
-            import numpy as np
-            
-            if self.status_label:
-                self.status_label.setText("Processing face recognition...")
-            
-            # Validate frame
-            if frame is None or frame.size == 0:
-                print("Invalid frame for recognition")
-                return False, None
-            
-            # Ensure frame is uint8
-            if frame.dtype != np.uint8:
-                frame = frame.astype(np.uint8)
-            
-            #Ensure frame is C-contiguous
-            if not frame.flags['C_CONTIGUOUS']:
-                frame = np.ascontiguousarray(frame)
-            
-            # Convert BGR to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            #Ensure RGB frame is also C-contiguous
-            if not rgb_frame.flags['C_CONTIGUOUS']:
-                rgb_frame = np.ascontiguousarray(rgb_frame)
-            
-            # Double-check RGB frame
-            if rgb_frame.dtype != np.uint8:
-                rgb_frame = rgb_frame.astype(np.uint8)
-            
-            # Get face encodings
-            face_encodings = face_recognition.face_encodings(rgb_frame)
-            
-            if len(face_encodings) == 0:
-                print("No face detected during recognition")
-                return False, None
-            
-            scanned_embedding = face_encodings[0]
-            
-            # Fetch all embeddings from database
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT JUV_ID, EMBEDDING FROM FACIAL_DATA")
-            results = cursor.fetchall()
-            
-            cursor.close()
-            conn.close()
-            
-            if not results:
+            self.probe_embedding = embedding
+            self.probe_image = image
+            self.candidates = candidates
+
+            if not self.candidates:
                 print("No facial data in database")
-                return False, None
-            
-            # Compare embeddings
-            threshold = 0.4  # face_recognition threshold
-            best_match_id = None
-            best_distance = float('inf')
-            
-            for juv_id, stored_embedding_str in results:
-                try:
-                    stored_embedding = np.array(eval(stored_embedding_str))
-                    
-                    # Calculate face distance
-                    distance = face_recognition.face_distance([stored_embedding], scanned_embedding)[0]
-                    
-                    if distance < best_distance:
-                        best_distance = distance
-                        best_match_id = juv_id
-                    
-                    print(f"JUV_ID {juv_id}: Distance = {distance:.4f}")
-                    
-                except Exception as e:
-                    print(f"Error comparing with JUV_ID {juv_id}: {e}")
-                    continue
-            
-            if best_distance < threshold:
-                print(f"Match found! JUV_ID: {best_match_id}, Distance: {best_distance:.4f}")
-                return True, best_match_id
             else:
-                print(f"No match found. Best distance: {best_distance:.4f}")
-                return False, None
-                
-        except Exception as e:
-            print(f"Error during face recognition: {e}")
-            import traceback
-            traceback.print_exc()
-            return False, None
+                for candidate_id, distance in self.candidates:
+                    print(f"JUV_ID {candidate_id}: Distance = {distance:.4f}")
+
+                best_match_id, best_distance = self.candidates[0]
+                if best_distance < MATCH_THRESHOLD:
+                    print(f"Match found! JUV_ID: {best_match_id}, Distance: {best_distance:.4f}")
+                    match_found, juv_id = True, best_match_id
+                else:
+                    print(f"No match found. Best distance: {best_distance:.4f}")
+
+        # IMPORTANT: Stop camera before emitting signal
+        self.stop_camera()
+
+        if match_found:
+            if self.status_label:
+                self.status_label.setText("Biometric match detected. Adding new offense to profile...")
+            QTimer.singleShot(2000, lambda: self.recognition_completed.emit(True, juv_id))
+        else:
+            if self.status_label:
+                self.status_label.setText("No biometric match detected. Proceeding to enrollment...")
+            QTimer.singleShot(2000, lambda: self.recognition_completed.emit(False, None))
+
+    def cancel_recognition(self):
+        if self.recognition_job is not None:
+            self.recognition_job.cancel()
+            self.recognition_job = None
+            self.face_detected = False
 
     def hideEvent(self, event):
+        self.cancel_recognition()
         self.stop_camera()
         super().hideEvent(event)
 
     def closeEvent(self, event):
+        self.cancel_recognition()
         self.stop_camera()
         super().closeEvent(event)
 
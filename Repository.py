@@ -0,0 +1,427 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import psycopg2
+from dotenv import load_dotenv
+from Db_connection import PreparedStatement
+from EmbeddingUtils import embedding_from_bytes
+from FaceGallery import wants_template
+
+load_dotenv()
+
+# Data access for juvenile records: every query and insert the record, case file, enrollment,
+# add-offense and login screens need lives here, on top of the pooled and prepared statements of
+# Db_connection. Functions take the session connection first, so they run unchanged in a DbJob:
+#   start_db_job(DbJob(get_case_file, case_no))
+# and return __slots__ row objects instead of bare tuples.
+
+# Case files kept in memory, overridable from .env
+# CASE_FILE_CACHE_SIZE - most recently viewed case files kept (0 disables the cache)
+# CASE_FILE_CACHE_TTL  - seconds a cached case file is trusted, so offenses added on another
+#                        workstation show up without restarting
+CASE_FILE_CACHE_SIZE = int(os.getenv("CASE_FILE_CACHE_SIZE", "32"))
+CASE_FILE_CACHE_TTL = float(os.getenv("CASE_FILE_CACHE_TTL", "60"))
+
+
+class RecordRow:
+    #One line of the record list; a juvenile without offenses has case_no and offense_date None
+    __slots__ = ('lname', 'fname', 'mname', 'case_no', 'offense_date')
+
+    def __init__(self, lname, fname, mname, case_no, offense_date):
+        self.lname = lname
+        self.fname = fname
+        self.mname = mname
+        self.case_no = case_no
+        self.offense_date = offense_date
+
+
+class JuvenileInfo:
+    __slots__ = ('juv_id', 'lname', 'fname', 'mname', 'suffix', 'dob', 'age', 'sex', 'gender', 'citizenship',
+                 'birthplace', 'state', 'municipality', 'barangay', 'street')
+
+    def __init__(self, juv_id, lname, fname, mname, suffix, dob, age, sex, gender, citizenship,
+                 birthplace, state, municipality, barangay, street):
+        self.juv_id = juv_id
+        self.lname = lname
+        self.fname = fname
+        self.mname = mname
+        self.suffix = suffix
+        self.dob = dob
+        self.age = age
+        self.sex = sex
+        self.gender = gender
+        self.citizenship = citizenship
+        self.birthplace = birthplace
+        self.state = state
+        self.municipality = municipality
+        self.barangay = barangay
+        self.street = street
+
+
+class GuardianInfo:
+    __slots__ = ('full_name', 'relationship', 'dob', 'age', 'sex', 'citizenship', 'civil_status', 'occupation',
+                 'contact_no', 'email', 'address')
+
+    def __init__(self, full_name, relationship, dob, age, sex, citizenship, civil_status, occupation,
+                 contact_no, email, address):
+        self.full_name = full_name
+        self.relationship = relationship
+        self.dob = dob
+        self.age = age
+        self.sex = sex
+        self.citizenship = citizenship
+        self.civil_status = civil_status
+        self.occupation = occupation
+        self.contact_no = contact_no
+        self.email = email
+        self.address = address
+
+
+class OffenseInfo:
+    __slots__ = ('case_no', 'offense_type', 'date_time', 'location', 'officer', 'complainant', 'description')
+
+    def __init__(self, case_no, offense_type, date_time, location, officer, complainant, description):
+        self.case_no = case_no
+        self.offense_type = offense_type
+        self.date_time = date_time
+        self.location = location
+        self.officer = officer
+        self.complainant = complainant
+        self.description = description
+
+
+class OffenseSummary:
+    #One line of a juvenile's criminal history
+    __slots__ = ('case_no', 'date_time', 'offense_type')
+
+    def __init__(self, case_no, date_time, offense_type):
+        self.case_no = case_no
+        self.date_time = date_time
+        self.offense_type = offense_type
+
+
+class CaseFile:
+    #Everything the four case file pages show for one case, loaded in two queries.
+    #guardian is None if none was recorded; face_image is the juvenile's first enrolled photo (JPEG bytes)
+    __slots__ = ('case_no', 'juvenile', 'guardian', 'offense', 'history', 'face_image', 'loaded_at')
+
+    def __init__(self, case_no, juvenile, guardian, offense, history, face_image):
+        self.case_no = case_no
+        self.juvenile = juvenile
+        self.guardian = guardian
+        self.offense = offense
+        self.history = history
+        self.face_image = face_image
+        self.loaded_at = time.monotonic()
+
+
+ALL_RECORDS = PreparedStatement('all_records', """
+    SELECT
+        jp.juv_lname,
+        jp.juv_fname,
+        jp.juv_mname,
+        oi.offns_case_record_no,
+        oi.offns_date_time
+    FROM juvenile_profile jp
+    LEFT JOIN offense_information oi ON jp.juv_id = oi.juv_id
+    ORDER BY oi.offns_date_time DESC
+""")
+
+RECORDS_FOR_JUVENILE = PreparedStatement('records_for_juvenile', """
+    SELECT
+        jp.juv_lname,
+        jp.juv_fname,
+        jp.juv_mname,
+        oi.offns_case_record_no,
+        oi.offns_date_time
+    FROM juvenile_profile jp
+    LEFT JOIN offense_information oi ON jp.juv_id = oi.juv_id
+    WHERE jp.juv_id = %s
+    ORDER BY oi.offns_date_time DESC
+""")
+
+# One row per case: juvenile, guardian (if any), the offense and the first enrolled photo.
+# The photo comes from a LATERAL pick so juveniles with several face templates still give one row
+CASE_FILE = PreparedStatement('case_file', """
+    SELECT
+        jp.juv_id,
+        jp.juv_lname,
+        jp.juv_fname,
+        jp.juv_mname,
+        jp.juv_suffix,
+        jp.juv_dob,
+        jp.juv_age,
+        jp.juv_sex,
+        jp.juv_gender,
+        jp.juv_citizenship,
+        jp.juv_place_of_birth,
+        jp.juv_state_province,
+        jp.juv_municipality,
+        jp.juv_barangay,
+        jp.juv_street,
+        jgp.grdn_id,
+        jgp.grdn_full_name,
+        jgp.grdn_juv_relationship,
+        jgp.grdn_dob,
+        jgp.grdn_age,
+        jgp.grdn_sex,
+        jgp.grdn_citizenship,
+        jgp.grdn_civil_status,
+        jgp.grdn_occupation,
+        jgp.grdn_contact_no,
+        jgp.grdn_email_address,
+        jgp.grdn_residential_address,
+        oi.offns_case_record_no,
+        oi.offns_type,
+        oi.offns_date_time,
+        oi.offns_location,
+        oi.offns_barangay_officer_in_charge,
+        oi.offns_complainant,
+        oi.offns_description,
+        fd.face_image
+    FROM offense_information oi
+    JOIN juvenile_profile jp ON oi.juv_id = jp.juv_id
+    LEFT JOIN juvenile_guardian_profile jgp ON jgp.juv_id = jp.juv_id
+    LEFT JOIN LATERAL (
+        SELECT face_image FROM facial_data WHERE facial_data.juv_id = jp.juv_id ORDER BY face_id LIMIT 1
+    ) fd ON TRUE
+    WHERE oi.offns_case_record_no = %s
+    LIMIT 1
+""")
+
+JUVENILE_OFFENSES = PreparedStatement('juvenile_offenses', """
+    SELECT
+        oi.offns_case_record_no,
+        oi.offns_date_time,
+        oi.offns_type
+    FROM offense_information oi
+    WHERE oi.juv_id = %s
+    ORDER BY oi.offns_date_time DESC
+""")
+
+JUVENILE_FACES = PreparedStatement('juvenile_faces', """
+    SELECT EMBEDDING FROM FACIAL_DATA WHERE JUV_ID = %s
+""")
+
+AUTHENTICATE_USER = PreparedStatement('authenticate_user', """
+    SELECT USER_ID, USER_USERNAME, USER_ROLE, ADMIN_ID
+    FROM USERS
+    WHERE USER_USERNAME = %s
+    AND USER_PASSWORD = crypt(%s, USER_PASSWORD)
+""")
+
+
+def list_records(conn, filter_juv_id=None):
+    #[RecordRow, ...] for the record list, newest offense first; only one juvenile's when filtered
+    cursor = conn.cursor()
+    if filter_juv_id:
+        RECORDS_FOR_JUVENILE.execute(cursor, (filter_juv_id,))
+    else:
+        ALL_RECORDS.execute(cursor)
+    records = [RecordRow(*row) for row in cursor.fetchall()]
+    cursor.close()
+    return records
+
+
+_case_files = OrderedDict()
+_case_files_lock = threading.Lock()
+# Bumped by forget_case_files, so a load that was already running when records changed does not
+# put what it read back into the cache
+_case_files_generation = 0
+
+
+def cached_case_file(case_no):
+    #The case file if it was loaded within CASE_FILE_CACHE_TTL seconds, else None; no database access
+    with _case_files_lock:
+        case_file = _case_files.get(case_no)
+        if case_file is None:
+            return None
+        if time.monotonic() - case_file.loaded_at > CASE_FILE_CACHE_TTL:
+            del _case_files[case_no]
+            return None
+        _case_files.move_to_end(case_no)
+        return case_file
+
+
+def forget_case_files(juv_id):
+    #Drop cached case files of a juvenile whose records changed; call it once the change is committed
+    global _case_files_generation
+    with _case_files_lock:
+        _case_files_generation += 1
+        for case_no in [case_no for case_no, case_file in _case_files.items()
+                        if case_file.juvenile.juv_id == juv_id]:
+            del _case_files[case_no]
+
+
+def get_case_file(conn, case_no):
+    #CaseFile for a case number, or None if there is no such case; served from the cache when fresh
+    case_file = cached_case_file(case_no)
+    if case_file is not None:
+        return case_file
+    generation = _case_files_generation
+
+    cursor = conn.cursor()
+    CASE_FILE.execute(cursor, (case_no,))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.close()
+        return None
+
+    juvenile = JuvenileInfo(*row[0:15])
+    guardian = GuardianInfo(*row[16:27]) if row[15] is not None else None
+    offense = OffenseInfo(*row[27:34])
+    face_image = bytes(row[34]) if row[34] is not None else None
+
+    JUVENILE_OFFENSES.execute(cursor, (juvenile.juv_id,))
+    history = [OffenseSummary(*offense_row) for offense_row in cursor.fetchall()]
+    cursor.close()
+
+    case_file = CaseFile(case_no, juvenile, guardian, offense, history, face_image)
+    if CASE_FILE_CACHE_SIZE > 0:
+        with _case_files_lock:
+            if generation != _case_files_generation:
+                return case_file
+            _case_files[case_no] = case_file
+            _case_files.move_to_end(case_no)
+            while len(_case_files) > CASE_FILE_CACHE_SIZE:
+                _case_files.popitem(last=False)
+    return case_file
+
+
+def insert_offense(cursor, juv_id, offense_info):
+    # Insert into OFFENSE_INFORMATION
+    cursor.execute("""
+        INSERT INTO OFFENSE_INFORMATION
+        (OFFNS_TYPE, OFFNS_CASE_RECORD_NO, OFFNS_DATE_TIME, OFFNS_LOCATION,
+        OFFNS_DESCRIPTION, OFFNS_COMPLAINANT, OFFNS_BARANGAY_OFFICER_IN_CHARGE, JUV_ID)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        offense_info['offense_type'],
+        offense_info['case_no'],
+        offense_info['datetime'],
+        offense_info['location'],
+        offense_info['description'],
+        offense_info['complainant'],
+        offense_info['officer'],
+        juv_id
+    ))
+
+
+def insert_face(cursor, juv_id, image, embedding):
+    #New FACIAL_DATA row from JPEG bytes and a 512-byte embedding; returns its FACE_ID
+    cursor.execute("""
+        INSERT INTO FACIAL_DATA
+        (FACE_IMAGE, EMBEDDING, JUV_ID)
+        VALUES (%s, %s, %s)
+        RETURNING FACE_ID
+    """, (
+        psycopg2.Binary(image),
+        psycopg2.Binary(embedding),
+        juv_id
+    ))
+    return cursor.fetchone()[0]
+
+
+def enroll(conn, personal_info, parent_info, offense_info, facial_data):
+    #Insert a new juvenile with guardian, offense and face from the enrollment form dicts
+    #Returns (juv_id, face_id); the session commits all four rows together
+    cursor = conn.cursor()
+
+    # Insert into JUVENILE_PROFILE
+    cursor.execute("""
+        INSERT INTO JUVENILE_PROFILE
+        (JUV_LNAME, JUV_FNAME, JUV_MNAME, JUV_SUFFIX, JUV_SEX, JUV_GENDER,
+        JUV_AGE, JUV_DOB, JUV_PLACE_OF_BIRTH, JUV_CITIZENSHIP,
+        JUV_STATE_PROVINCE, JUV_MUNICIPALITY, JUV_BARANGAY, JUV_STREET)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING JUV_ID
+    """, (
+        personal_info['lname'],
+        personal_info['fname'],
+        personal_info['mname'],
+        personal_info['suffix'],
+        personal_info['sex'],
+        personal_info['gender'],
+        int(personal_info['age']) if personal_info['age'] else None,
+        personal_info['dob'],
+        personal_info['birthplace'],
+        personal_info['citizenship'],
+        personal_info['state'],
+        personal_info['municipal'],
+        personal_info['brgy'],
+        personal_info['street']
+    ))
+
+    juv_id = cursor.fetchone()[0]
+
+    # Insert into JUVENILE_GUARDIAN_PROFILE
+    cursor.execute("""
+        INSERT INTO JUVENILE_GUARDIAN_PROFILE
+        (GRDN_FULL_NAME, GRDN_JUV_RELATIONSHIP, GRDN_SEX, GRDN_DOB, GRDN_AGE,
+        GRDN_CIVIL_STATUS, GRDN_CITIZENSHIP, GRDN_OCCUPATION, GRDN_EMAIL_ADDRESS,
+        GRDN_CONTACT_NO, GRDN_RESIDENTIAL_ADDRESS, JUV_ID)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        parent_info['fullname'],
+        parent_info['relationship'],
+        parent_info['sex'],
+        parent_info['dob'],
+        int(parent_info['age']) if parent_info['age'] else None,
+        parent_info['civil_status'],
+        parent_info['citizenship'],
+        parent_info['occupation'],
+        parent_info['email'],
+        parent_info['contact'],
+        parent_info['address'],
+        juv_id
+    ))
+
+    insert_offense(cursor, juv_id, offense_info)
+
+    # Insert into FACIAL_DATA
+    face_id = insert_face(cursor, juv_id, facial_data['image'], facial_data['embedding'])
+
+    cursor.close()
+    return juv_id, face_id
+
+
+def add_offense(conn, juv_id, offense_info, face=None):
+    #Insert a new offense for an enrolled juvenile, plus the scanned face as another template
+    #when face is (image bytes, embedding bytes) and the juvenile's stored faces want it (see
+    #FaceGallery.wants_template). Returns the new FACE_ID, or None if no face was stored
+    #The caller calls forget_case_files(juv_id) after the session has committed
+    cursor = conn.cursor()
+    insert_offense(cursor, juv_id, offense_info)
+
+    face_id = None
+    if face is not None:
+        image, embedding = face
+        # Decided on this connection from FACIAL_DATA itself, so it holds whether or not the
+        # gallery has the juvenile's faces in memory
+        JUVENILE_FACES.execute(cursor, (juv_id,))
+        faces = [embedding_from_bytes(row[0]) for row in cursor.fetchall()]
+        if wants_template(faces, embedding_from_bytes(embedding)):
+            face_id = insert_face(cursor, juv_id, image, embedding)
+
+    cursor.close()
+    return face_id
+
+
+def authenticate_user(conn, username, password):
+    #The user's details if the credentials match, else None
+    cur = conn.cursor()
+    AUTHENTICATE_USER.execute(cur, (username, password))
+    user = cur.fetchone()
+    cur.close()
+
+    if user:
+        user_data = {
+            'user_id': user[0],
+            'username': user[1],
+            'role': user[2],
+            'admin_id': user[3]
+        }
+        return user_data
+    else:
+        return None
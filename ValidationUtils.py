@@ -1,4 +1,7 @@
-from Db_connection import get_db_connection
+import numpy as np
+from Db_connection import get_db_connection, db_session
+from EmbeddingUtils import embedding_from_bytes, EMBEDDING_DTYPE
+from FaceGallery import get_face_gallery, MATCH_THRESHOLD, TOP_K
 
 def check_email_exists(email):
     if not email or not email.strip():
@@ -24,13 +27,18 @@ def check_email_exists(email):
             conn.close()
         return False
 
-def check_case_number_exists(case_no):
+def check_case_number_exists(case_no, conn=None):
+    #conn lets a caller checking several numbers reuse one connection (left open for it)
     if not case_no or not case_no.strip():
         return False
     
-    conn = get_db_connection()
-    if not conn:
-        return False
+    if conn is None:
+        try:
+            with db_session() as conn:
+                return check_case_number_exists(case_no, conn)
+        except Exception as e:
+            print(f"Error checking case number: {e}")
+            return False
     
     try:
         cursor = conn.cursor()
@@ -40,56 +48,40 @@ def check_case_number_exists(case_no):
         )
         exists = cursor.fetchone() is not None
         cursor.close()
-        conn.close()
         return exists
     except Exception as e:
         print(f"Error checking case number: {e}")
-        if conn:
-            conn.close()
         return False
 
-def check_embedding_similarity(new_embedding, threshold=0.4):
-    #Check if a similar embedding already exists in database
-    #Returns (exists, juv_id) - exists=True if similar face found
-    
-    if not new_embedding:
-        return False, None
+def find_similar_faces(new_embedding, threshold=MATCH_THRESHOLD, k=TOP_K):
+    #Shortlist of already enrolled juveniles that look like this face
+    #Returns [(juv_id, distance), ...] under the threshold, closest first
     
-    conn = get_db_connection()
-    if not conn:
-        return False, None
+    #new_embedding is the float32 array from FaceWorker.encode_face, or stored FACIAL_DATA bytes
+    if new_embedding is None or np.size(new_embedding) == 0:
+        return []
     
     try:
-        import numpy as np
-        import face_recognition
-        
-        cursor = conn.cursor()
-        cursor.execute("SELECT JUV_ID, EMBEDDING FROM FACIAL_DATA")
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        if not results:
-            return False, None
-        
-        new_emb_array = np.array(eval(new_embedding))
-        
-        for juv_id, stored_embedding_str in results:
-            try:
-                stored_emb_array = np.array(eval(stored_embedding_str))
-                distance = face_recognition.face_distance([stored_emb_array], new_emb_array)[0]
-                if distance < threshold:
-                    print(f"Similar face found! JUV_ID: {juv_id}, Distance: {distance}")
-                    return True, juv_id
-                    
-            except Exception as e:
-                print(f"Error comparing with JUV_ID {juv_id}: {e}")
-                continue
-        
-        return False, None
+        if isinstance(new_embedding, np.ndarray):
+            embedding = np.asarray(new_embedding, dtype=EMBEDDING_DTYPE)
+        else:
+            embedding = embedding_from_bytes(new_embedding)
+        gallery = get_face_gallery()
+        candidates = gallery.search(embedding, k=k)
+        return [(juv_id, distance) for juv_id, distance in candidates if distance < threshold]
         
     except Exception as e:
         print(f"Error checking embedding similarity: {e}")
-        if conn:
-            conn.close()
-        return False, None
\ No newline at end of file
+        return []
+
+def check_embedding_similarity(new_embedding, threshold=MATCH_THRESHOLD):
+    #Check if a similar embedding already exists in database
+    #Returns (exists, juv_id) - exists=True if similar face found, juv_id is the closest one
+    
+    matches = find_similar_faces(new_embedding, threshold, k=1)
+    if matches:
+        juv_id, distance = matches[0]
+        print(f"Similar face found! JUV_ID: {juv_id}, Distance: {distance}")
+        return True, juv_id
+    
+    return False, None
\ No newline at end of file
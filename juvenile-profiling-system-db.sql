@@ -15,13 +15,32 @@ CREATE TABLE public.barangay_admin (
 CREATE TABLE public.facial_data (
     face_id    SERIAL PRIMARY KEY,
     face_image BYTEA NOT NULL,
-    embedding  TEXT NOT NULL,
+    embedding  BYTEA NOT NULL,  -- 128 x float32 (see EmbeddingUtils.py)
     date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     juv_id     INTEGER NOT NULL,
+    CONSTRAINT facial_data_embedding_len_check CHECK (octet_length(embedding) = 512),
     CONSTRAINT fk_facialdata_juvenile
         FOREIGN KEY (juv_id) REFERENCES juvenile_profile(juv_id) ON DELETE CASCADE
 );
 
+CREATE INDEX idx_facial_data_date_added ON facial_data (date_added);
+CREATE INDEX idx_facial_data_juv_id ON facial_data (juv_id);
+
+-- Tell running kiosks about new faces so their in-memory gallery (FaceGallery.py) stays fresh
+CREATE OR REPLACE FUNCTION public.notify_facial_data_inserted() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'facial_data_inserted',
+        json_build_object('face_id', NEW.face_id, 'juv_id', NEW.juv_id)::text
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_facial_data_notify
+AFTER INSERT ON facial_data
+FOR EACH ROW EXECUTE FUNCTION notify_facial_data_inserted();
+
 CREATE TABLE public.juvenile_guardian_profile (
     grdn_id                  SERIAL PRIMARY KEY,
     grdn_full_name           VARCHAR(100) NOT NULL,
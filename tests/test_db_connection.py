@@ -0,0 +1,43 @@
+from Db_connection import PreparedStatement
+
+
+def test_prepared_statement_numbers_parameters():
+    statement = PreparedStatement('test_two_params', "SELECT * FROM T WHERE A = %s AND B = %s")
+    assert statement.param_count == 2
+    assert statement.prepare_sql == "PREPARE test_two_params AS SELECT * FROM T WHERE A = $1 AND B = $2"
+    assert statement.execute_sql == "EXECUTE test_two_params (%s, %s)"
+
+
+def test_prepared_statement_without_parameters():
+    statement = PreparedStatement('test_no_params', "SELECT COUNT(*) FROM T")
+    assert statement.param_count == 0
+    assert statement.prepare_sql == "PREPARE test_no_params AS SELECT COUNT(*) FROM T"
+    assert statement.execute_sql == "EXECUTE test_no_params"
+
+
+def test_prepared_statement_names_are_unique():
+    PreparedStatement('test_unique', "SELECT 1")
+    try:
+        PreparedStatement('test_unique', "SELECT 2")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("duplicate statement name was accepted")
+
+
+def test_execute_falls_back_to_plain_sql_without_session_tracking():
+    statement = PreparedStatement('test_fallback', "SELECT * FROM T WHERE A = %s")
+    cursor = FakeCursor()
+    statement.execute(cursor, (7,))
+    assert cursor.executed == [("SELECT * FROM T WHERE A = %s", (7,))]
+
+
+class FakeCursor:
+    # A plain psycopg2 connection: no 'prepared' set to track statements in
+    connection = object()
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
@@ -0,0 +1,155 @@
+import numpy as np
+import pytest
+import FaceGallery
+from EmbeddingUtils import EMBEDDING_DIM
+from FaceGallery import GALLERY_DTYPES, MATCH_THRESHOLD, RERANK_CANDIDATES
+
+
+def make_gallery(dtype='float32'):
+    # Marked loaded so search() neither restores a snapshot nor queries the database
+    gallery = FaceGallery.FaceGallery(dtype=dtype)
+    gallery.loaded = True
+    return gallery
+
+
+def make_faces(juveniles, seed=0):
+    #{juv_id: (T, 128) faces}: one to three faces scattered around a centre per juvenile
+    rng = np.random.default_rng(seed)
+    faces = {}
+    for juv_id in range(1, juveniles + 1):
+        centre = rng.normal(0, 0.1, EMBEDDING_DIM)
+        count = rng.integers(1, 4)
+        faces[juv_id] = (centre + rng.normal(0, 0.02, (count, EMBEDDING_DIM))).astype(np.float32)
+    return faces
+
+
+def fill(gallery, faces, monkeypatch):
+    face_id = 0
+    for juv_id, rows in faces.items():
+        for row in rows:
+            face_id += 1
+            gallery.add(juv_id, row, face_id=face_id)
+    # Quantized galleries re-rank on faces fetched from FACIAL_DATA
+    monkeypatch.setattr(FaceGallery, 'fetch_templates',
+                        lambda juv_ids: {juv_id: faces[juv_id] for juv_id in juv_ids if juv_id in faces})
+
+
+def brute_force(faces, probe, k):
+    #[(juv_id, distance to the juvenile's nearest face)], closest first
+    scored = [(juv_id, float(np.min(np.linalg.norm(rows - probe, axis=1)))) for juv_id, rows in faces.items()]
+    return sorted(scored, key=lambda candidate: candidate[1])[:k]
+
+
+def probes_near(faces, count, seed=1):
+    rng = np.random.default_rng(seed)
+    owners = rng.choice(list(faces), size=count)
+    return np.array([faces[juv_id][0] + rng.normal(0, 0.03, EMBEDDING_DIM) for juv_id in owners],
+                    dtype=np.float32)
+
+
+def assert_same_results(results, expected):
+    assert [juv_id for juv_id, _ in results] == [juv_id for juv_id, _ in expected]
+    assert np.allclose([distance for _, distance in results], [distance for _, distance in expected], atol=1e-5)
+
+
+@pytest.mark.parametrize('dtype', GALLERY_DTYPES)
+def test_search_matches_brute_force(dtype, monkeypatch):
+    # Small enough that every juvenile is re-ranked, so the result must equal brute force exactly
+    faces = make_faces(RERANK_CANDIDATES - 2)
+    gallery = make_gallery(dtype)
+    fill(gallery, faces, monkeypatch)
+
+    for probe in probes_near(faces, 10):
+        assert_same_results(gallery.search(probe, k=5), brute_force(faces, probe, 5))
+
+
+@pytest.mark.parametrize('dtype', GALLERY_DTYPES)
+def test_search_finds_nearest_in_larger_gallery(dtype, monkeypatch):
+    # Larger than the shortlist: the centroids pick it, the nearest juvenile must still be found
+    faces = make_faces(300, seed=2)
+    gallery = make_gallery(dtype)
+    fill(gallery, faces, monkeypatch)
+
+    for probe in probes_near(faces, 20, seed=3):
+        assert_same_results(gallery.search(probe, k=1), brute_force(faces, probe, 1))
+
+
+@pytest.mark.parametrize('dtype', GALLERY_DTYPES)
+def test_search_batch_matches_search(dtype, monkeypatch):
+    faces = make_faces(300, seed=4)
+    gallery = make_gallery(dtype)
+    fill(gallery, faces, monkeypatch)
+    probes = probes_near(faces, 40, seed=5)
+
+    batched = gallery.search_batch(probes, k=3, chunk_size=16)
+    assert len(batched) == len(probes)
+    for probe, results in zip(probes, batched):
+        assert_same_results(results, gallery.search(probe, k=3))
+
+
+@pytest.mark.parametrize('dtype', GALLERY_DTYPES)
+def test_snapshot_round_trip_then_add(dtype, monkeypatch, tmp_path):
+    faces = make_faces(50, seed=6)
+    gallery = make_gallery(dtype)
+    fill(gallery, faces, monkeypatch)
+    assert gallery.save_snapshot(str(tmp_path))
+
+    restored = FaceGallery.FaceGallery(dtype=dtype)
+    assert restored.restore_snapshot(str(tmp_path))
+    assert len(restored) == len(gallery)
+    assert restored.face_id_watermark == gallery.face_id_watermark
+    probes = probes_near(faces, 10, seed=7)
+    for probe in probes:
+        assert_same_results(restored.search(probe, k=3), gallery.search(probe, k=3))
+
+    # The restored arrays are memory-mapped copy-on-write; both kinds of add must still work
+    rng = np.random.default_rng(8)
+    new_face = rng.normal(0, 0.1, EMBEDDING_DIM).astype(np.float32)
+    extra_face = (faces[1][0] + rng.normal(0, 0.05, EMBEDDING_DIM)).astype(np.float32)
+    faces[999] = new_face[None, :]
+    faces[1] = np.vstack([faces[1], extra_face])
+    watermark = restored.face_id_watermark
+    assert restored.add(999, new_face, face_id=watermark + 1)
+    assert restored.add(1, extra_face, face_id=watermark + 2)
+    assert not restored.add(1, extra_face, face_id=watermark + 2)
+
+    assert restored.search(new_face, k=1)[0][0] == 999
+    (juv_id, distance), = restored.search(extra_face, k=1)
+    assert juv_id == 1 and distance < 1e-5
+    assert restored.template_count(1) == len(faces[1])
+
+    # The file itself is unchanged by the adds
+    again = FaceGallery.FaceGallery(dtype=dtype)
+    assert again.restore_snapshot(str(tmp_path))
+    assert len(again) == len(gallery)
+
+
+def test_match_needs_a_stored_face_not_the_centroid():
+    # Two faces 0.45 either side of the probe: their mean is the probe itself, no face is within 0.4
+    gallery = make_gallery()
+    base = np.random.default_rng(0).normal(0, 0.1, EMBEDDING_DIM).astype(np.float32)
+    offset = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    offset[0] = 0.45
+    gallery.add(1, base + offset, face_id=1)
+    gallery.add(1, base - offset, face_id=2)
+
+    centroid_distances, _ = gallery.distances(base)
+    assert centroid_distances[0] < 1e-3
+
+    (juv_id, distance), = gallery.search(base, k=1)
+    assert juv_id == 1
+    assert abs(distance - 0.45) < 1e-4
+    assert distance >= MATCH_THRESHOLD
+
+
+def test_wants_template():
+    faces = np.zeros((2, EMBEDDING_DIM), dtype=np.float32)
+    near = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    near[0] = FaceGallery.MIN_TEMPLATE_DISTANCE / 2
+    far = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    far[0] = FaceGallery.MIN_TEMPLATE_DISTANCE * 2
+
+    assert FaceGallery.wants_template([], far)
+    assert not FaceGallery.wants_template(faces, near)
+    assert FaceGallery.wants_template(faces, far)
+    assert not FaceGallery.wants_template(np.zeros((FaceGallery.MAX_TEMPLATES, EMBEDDING_DIM)), far)
@@ -0,0 +1,30 @@
+import numpy as np
+from EmbeddingUtils import EMBEDDING_DIM
+from FaceIndex import IVFIndex
+
+
+def test_save_load_keeps_assignments(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(0, 0.1, (500, EMBEDDING_DIM)).astype(np.float32)
+    juv_ids = rng.permutation(np.arange(1000, 1500))
+    index = IVFIndex.train(embeddings, nlist=16, nprobe=4)
+    path = str(tmp_path / "index" / "face_ann_index.npz")
+    index.save(path, juv_ids)
+
+    # Gallery rows come back in a different order after a reload
+    order = rng.permutation(len(juv_ids))
+    loaded = IVFIndex.load(path, embeddings[order], juv_ids[order], nprobe=4)
+    assert loaded is not None
+    assert loaded.nlist == index.nlist
+    assert np.array_equal(loaded.centroids, index.centroids)
+    assert np.array_equal(loaded.assignments, index.assignments[order])
+
+
+def test_load_missing_or_unrelated_returns_none(tmp_path):
+    rng = np.random.default_rng(1)
+    embeddings = rng.normal(0, 0.1, (200, EMBEDDING_DIM)).astype(np.float32)
+    path = str(tmp_path / "face_ann_index.npz")
+    assert IVFIndex.load(path, embeddings, np.arange(200)) is None
+
+    IVFIndex.train(embeddings, nlist=8).save(path, np.arange(200))
+    assert IVFIndex.load(path, embeddings, np.arange(5000, 5200)) is None
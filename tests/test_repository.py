@@ -0,0 +1,80 @@
+import pytest
+import Repository
+
+JUV_ID = 5
+CASE_NO = "2024-0001"
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    Repository._case_files.clear()
+    yield
+    Repository._case_files.clear()
+
+
+class FakeConnection:
+    # Without a 'prepared' set statements run as plain SQL, so the fake can route on the text
+    def __init__(self, on_history=None):
+        self.queries = 0
+        self.on_history = on_history
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        self.connection.queries += 1
+        if sql == Repository.CASE_FILE.sql:
+            juvenile = (JUV_ID,) + ("x",) * 14
+            guardian = (1,) + ("g",) * 11
+            offense = (params[0],) + ("o",) * 6
+            self.rows = [juvenile + guardian + offense + (b"jpeg",)]
+        elif sql == Repository.JUVENILE_OFFENSES.sql:
+            if self.connection.on_history:
+                self.connection.on_history()
+            self.rows = [(CASE_NO, "2024-01-01", "theft")]
+        else:
+            raise AssertionError(f"unexpected query: {sql}")
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def test_case_file_is_cached():
+    conn = FakeConnection()
+    case_file = Repository.get_case_file(conn, CASE_NO)
+    assert case_file.juvenile.juv_id == JUV_ID
+    assert case_file.face_image == b"jpeg"
+    assert [offense.case_no for offense in case_file.history] == [CASE_NO]
+
+    queries = conn.queries
+    assert Repository.get_case_file(conn, CASE_NO) is case_file
+    assert Repository.cached_case_file(CASE_NO) is case_file
+    assert conn.queries == queries
+
+
+def test_forget_case_files_drops_entries_of_that_juvenile():
+    Repository.get_case_file(FakeConnection(), CASE_NO)
+    Repository.forget_case_files(JUV_ID + 1)
+    assert Repository.cached_case_file(CASE_NO) is not None
+
+    Repository.forget_case_files(JUV_ID)
+    assert Repository.cached_case_file(CASE_NO) is None
+
+
+def test_load_racing_a_commit_is_not_cached():
+    # A new offense is committed while the case file is being read
+    conn = FakeConnection(on_history=lambda: Repository.forget_case_files(JUV_ID))
+    assert Repository.get_case_file(conn, CASE_NO) is not None
+    assert Repository.cached_case_file(CASE_NO) is None
@@ -0,0 +1,35 @@
+import numpy as np
+import ValidationUtils
+from EmbeddingUtils import EMBEDDING_DIM, embedding_to_bytes
+
+
+class FakeGallery:
+    def __init__(self):
+        self.queries = []
+
+    def search(self, embedding, k=5):
+        self.queries.append(embedding)
+        return [(7, 0.2), (9, 0.9)]
+
+
+def test_find_similar_faces_accepts_encoder_array(monkeypatch):
+    # FaceJob passes the float32 array straight from FaceWorker.encode_face
+    gallery = FakeGallery()
+    monkeypatch.setattr(ValidationUtils, 'get_face_gallery', lambda: gallery)
+    embedding = np.random.rand(EMBEDDING_DIM).astype(np.float32)
+
+    assert ValidationUtils.find_similar_faces(embedding, threshold=0.5) == [(7, 0.2)]
+    assert np.array_equal(gallery.queries[0], embedding)
+
+
+def test_find_similar_faces_accepts_stored_bytes(monkeypatch):
+    gallery = FakeGallery()
+    monkeypatch.setattr(ValidationUtils, 'get_face_gallery', lambda: gallery)
+    embedding = np.random.rand(EMBEDDING_DIM).astype(np.float32)
+
+    assert ValidationUtils.find_similar_faces(embedding_to_bytes(embedding), threshold=0.5) == [(7, 0.2)]
+
+
+def test_find_similar_faces_without_embedding():
+    assert ValidationUtils.find_similar_faces(None) == []
+    assert ValidationUtils.find_similar_faces(np.empty(0, dtype=np.float32)) == []